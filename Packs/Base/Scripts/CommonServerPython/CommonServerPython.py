@@ -6,25 +6,121 @@ Note that adding code to CommonServerUserPython can override functions in Common
 from __future__ import print_function
 
 import base64
+import itertools
 import json
 import logging
 import os
 import re
 import socket
 import sys
+import threading
 import time
 import traceback
+import zlib
 from random import randint
 import xml.etree.cElementTree as ET
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
 from abc import abstractmethod
-from distutils.version import LooseVersion
 
 import demistomock as demisto
 import warnings
 
 
+class StartupProfiler(object):
+    """
+       Records how long each section of this script takes to load.
+       The sections are reported to the log when the COMMON_SERVER_PROFILE_STARTUP os env is set.
+
+       :return: No data returned
+       :rtype: ``None``
+    """
+
+    def __init__(self):
+        self.start = self.last = time.time()
+        self.sections = []  # type: list
+
+    def mark(self, section):
+        """
+           Marks the end of a section, which started at the end of the previous one.
+
+           :type section: ``str``
+           :param section: The name of the section
+
+           :return: No data returned
+           :rtype: ``None``
+        """
+        now = time.time()
+        self.sections.append((section, now - self.last))
+        self.last = now
+
+    def report(self):
+        """
+           Gets the report of the sections load times.
+
+           :return: The report
+           :rtype: ``str``
+        """
+        lines = ['CommonServerPython startup profile:']
+        lines.extend('{}: {:.1f}ms'.format(section, duration * 1000) for section, duration in self.sections)
+        lines.append('total: {:.1f}ms'.format((self.last - self.start) * 1000))
+        return '\n'.join(lines)
+
+
+STARTUP_PROFILER = StartupProfiler()
+
+
+class LazyImport(object):
+    """
+       A module, or an attribute of a module, that is imported on first use.
+       Used for the heavy dependencies that most scripts do not need, the attributes are get and set on the
+       imported module (so it can be patched in unit tests).
+
+       :type module_name: ``str``
+       :param module_name: The name of the module, for example: 'distutils.version'
+
+       :type attribute: ``str``
+       :param attribute: The name of the attribute of the module to import, for example: 'LooseVersion' (optional)
+
+       :return: No data returned
+       :rtype: ``None``
+    """
+
+    def __init__(self, module_name, attribute=None):
+        object.__setattr__(self, '_module_name', module_name)
+        object.__setattr__(self, '_attribute', attribute)
+        object.__setattr__(self, '_target', None)
+
+    def _load(self):
+        target = object.__getattribute__(self, '_target')
+        if target is None:
+            import importlib
+            target = importlib.import_module(object.__getattribute__(self, '_module_name'))
+            attribute = object.__getattribute__(self, '_attribute')
+            if attribute:
+                target = getattr(target, attribute)
+            object.__setattr__(self, '_target', target)
+        return target
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __repr__(self):
+        return '<LazyImport {}>'.format(repr(self._load()))
+
+
+LooseVersion = LazyImport('distutils.version', 'LooseVersion')
+
+
 class WarningsHandler(object):
     #    Wrapper to handle warnings. We use a class to cleanup after execution
 
@@ -56,7 +152,7 @@ try:
     from urllib3.util import Retry
     from typing import Optional, Dict, List, Any, Union, Set
 
-    import dateparser
+    dateparser = LazyImport('dateparser')
     from datetime import timezone  # type: ignore
 except Exception:
     if sys.version_info[0] < 3:
@@ -64,6 +160,8 @@ except Exception:
         # for more info see https://cosmicpercolator.com/2016/01/13/exception-leaks-in-python-2-and-3/
         sys.exc_clear()
 
+STARTUP_PROFILER.mark('imports')
+
 CONTENT_RELEASE_VERSION = '0.0.0'
 CONTENT_BRANCH_NAME = 'master'
 IS_PY3 = sys.version_info[0] == 3
@@ -516,72 +614,171 @@ def get_schedule_metadata(context):
     return schedule_metadata
 
 
-def auto_detect_indicator_type(indicator_value):
+class IndicatorTypeDetector(object):
     """
-      Infer the type of the indicator.
+      Detects the type of indicator values, with the same results as trying the indicator regexes one after the
+      other. As the regexes are matched at the start of the value, a regex is only tried when the first character,
+      the length and the characters it requires allow the value to match it.
+      The TLD extractor is built once, and the types of the recently detected values are kept in an LRU cache.
 
-      :type indicator_value: ``str``
-      :param indicator_value: The indicator whose type we want to check. (required)
+      :type cache_size: ``int``
+      :param cache_size: The maximal number of values which types are cached.
 
-      :return: The type of the indicator.
-      :rtype: ``str``
+      :return: No data returned
+      :rtype: ``None``
     """
-    try:
-        import tldextract
-    except Exception:
-        raise Exception("Missing tldextract module, In order to use the auto detect function please use a docker"
-                        " image with it installed such as: demisto/jmespath")
+    DIGITS = frozenset('0123456789')
+    HEX_CHARACTERS = frozenset('0123456789abcdefABCDEF')
+    URL_PREFIXES = ('http', 'hxxp', 'ftp', 'www')
+    HASH_MIN_LENGTH = 32
+
+    def __init__(self, cache_size=10000):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # type: OrderedDict
+        self.patterns = None  # type: Optional[Dict[str, Any]]
+        self.tld_extractor = None
+        self.tld_extractor_key = None  # type: Any
+
+    def get_patterns(self):
+        if self.patterns is None:
+            self.patterns = {
+                'ipv4cidr': re.compile(ipv4cidrRegex),
+                'ipv6cidr': re.compile(ipv6cidrRegex),
+                'ipv4': re.compile(ipv4Regex),
+                'ipv6': re.compile(ipv6Regex),
+                'url': re.compile(urlRegex),
+                'email': re.compile(emailRegex),
+                'cve': re.compile(cveRegex),
+            }
+        return self.patterns
+
+    def get_tld_extractor(self, tldextract):
+        if self.tld_extractor is None:
+            if LooseVersion(tldextract.__version__) < '3.0.0':
+                self.tld_extractor = tldextract.TLDExtract(cache_file=False, suffix_list_urls=None)
+            else:
+                self.tld_extractor = tldextract.TLDExtract(cache_dir=False, suffix_list_urls=None)
+        return self.tld_extractor
+
+    def detect(self, indicator_value):
+        """
+          Infer the type of the indicator.
+
+          :type indicator_value: ``str``
+          :param indicator_value: The indicator whose type we want to check. (required)
+
+          :return: The type of the indicator.
+          :rtype: ``str``
+        """
+        try:
+            import tldextract
+        except Exception:
+            raise Exception("Missing tldextract module, In order to use the auto detect function please use a docker"
+                            " image with it installed such as: demisto/jmespath")
+
+        # the extractor and the cached types are dropped when the tldextract module changes
+        tld_extractor_key = (tldextract.TLDExtract, tldextract.__version__)
+        if tld_extractor_key != self.tld_extractor_key:
+            self.tld_extractor_key = tld_extractor_key
+            self.tld_extractor = None
+            self.cache.clear()
+
+        if indicator_value in self.cache:
+            indicator_type = self.cache.pop(indicator_value)
+        else:
+            indicator_type = self.detect_uncached(indicator_value, tldextract)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        self.cache[indicator_value] = indicator_type
+        return indicator_type
 
-    if re.match(ipv4cidrRegex, indicator_value):
-        return FeedIndicatorType.CIDR
+    def detect_uncached(self, indicator_value, tldextract):
+        patterns = self.get_patterns()
+        first_character = indicator_value[:1]
+        starts_with_digit = first_character in self.DIGITS
+        starts_with_hex = first_character in self.HEX_CHARACTERS
+        maybe_ipv6 = starts_with_hex and ':' in indicator_value
+        maybe_hash = starts_with_hex and len(indicator_value) >= self.HASH_MIN_LENGTH
 
-    if re.match(ipv6cidrRegex, indicator_value):
-        return FeedIndicatorType.IPv6CIDR
+        if starts_with_digit and '/' in indicator_value and patterns['ipv4cidr'].match(indicator_value):
+            return FeedIndicatorType.CIDR
 
-    if re.match(ipv4Regex, indicator_value):
-        return FeedIndicatorType.IP
+        if maybe_ipv6 and '/' in indicator_value and patterns['ipv6cidr'].match(indicator_value):
+            return FeedIndicatorType.IPv6CIDR
 
-    if re.match(ipv6Regex, indicator_value):
-        return FeedIndicatorType.IPv6
+        if starts_with_digit and '.' in indicator_value and patterns['ipv4'].match(indicator_value):
+            return FeedIndicatorType.IP
 
-    if re.match(sha256Regex, indicator_value):
-        return FeedIndicatorType.File
+        if maybe_ipv6 and patterns['ipv6'].match(indicator_value):
+            return FeedIndicatorType.IPv6
 
-    if re.match(urlRegex, indicator_value):
-        return FeedIndicatorType.URL
+        if maybe_hash and sha256Regex.match(indicator_value):
+            return FeedIndicatorType.File
 
-    if re.match(md5Regex, indicator_value):
-        return FeedIndicatorType.File
+        if indicator_value.startswith(self.URL_PREFIXES) and patterns['url'].match(indicator_value):
+            return FeedIndicatorType.URL
 
-    if re.match(sha1Regex, indicator_value):
-        return FeedIndicatorType.File
+        if maybe_hash and md5Regex.match(indicator_value):
+            return FeedIndicatorType.File
 
-    if re.match(emailRegex, indicator_value):
-        return FeedIndicatorType.Email
+        if maybe_hash and sha1Regex.match(indicator_value):
+            return FeedIndicatorType.File
 
-    if re.match(cveRegex, indicator_value):
-        return FeedIndicatorType.CVE
+        if '@' in indicator_value and patterns['email'].match(indicator_value):
+            return FeedIndicatorType.Email
 
-    if re.match(sha512Regex, indicator_value):
-        return FeedIndicatorType.File
+        if first_character in ('c', 'C') and patterns['cve'].match(indicator_value):
+            return FeedIndicatorType.CVE
 
-    try:
-        tldextract_version = tldextract.__version__
-        if LooseVersion(tldextract_version) < '3.0.0':
-            no_cache_extract = tldextract.TLDExtract(cache_file=False, suffix_list_urls=None)
-        else:
-            no_cache_extract = tldextract.TLDExtract(cache_dir=False, suffix_list_urls=None)
+        if maybe_hash and sha512Regex.match(indicator_value):
+            return FeedIndicatorType.File
+
+        try:
+            if self.get_tld_extractor(tldextract)(indicator_value).suffix:
+                if '*' in indicator_value:
+                    return FeedIndicatorType.DomainGlob
+                return FeedIndicatorType.Domain
 
-        if no_cache_extract(indicator_value).suffix:
-            if '*' in indicator_value:
-                return FeedIndicatorType.DomainGlob
-            return FeedIndicatorType.Domain
+        except Exception:
+            demisto.debug('tldextract failed to detect indicator type. indicator value: {}'.format(indicator_value))
+
+        demisto.debug('Failed to detect indicator type. Indicator value: {}'.format(indicator_value))
+        return None
 
-    except Exception:
-        demisto.debug('tldextract failed to detect indicator type. indicator value: {}'.format(indicator_value))
 
-    demisto.debug('Failed to detect indicator type. Indicator value: {}'.format(indicator_value))
-    return None
+INDICATOR_TYPE_DETECTOR = IndicatorTypeDetector()
+STARTUP_PROFILER.mark('constants and indicator types')
+
+
+def auto_detect_indicator_type(indicator_value):
+    """
+      Infer the type of the indicator.
+
+      :type indicator_value: ``str``
+      :param indicator_value: The indicator whose type we want to check. (required)
+
+      :return: The type of the indicator.
+      :rtype: ``str``
+    """
+    return INDICATOR_TYPE_DETECTOR.detect(indicator_value)
+
+
+def auto_detect_indicator_types(indicator_values):
+    """
+      Infer the types of a batch of indicators, detecting the type of each distinct value once.
+
+      :type indicator_values: ``list``
+      :param indicator_values: The indicators whose types we want to check. (required)
+
+      :return: The types of the indicators, in the order of the given values.
+      :rtype: ``list``
+    """
+    indicator_values = list(indicator_values)
+    types_by_value = {}  # type: Dict[str, Optional[str]]
+    for indicator_value in indicator_values:
+        if indicator_value not in types_by_value:
+            types_by_value[indicator_value] = INDICATOR_TYPE_DETECTOR.detect(indicator_value)
+    return [types_by_value[indicator_value] for indicator_value in indicator_values]
 
 
 def handle_proxy(proxy_param_name='proxy', checkbox_default_value=False, handle_insecure=True,
@@ -1247,27 +1444,52 @@ def stringUnEscape(st):
     return st.replace('\\r', '\r').replace('\\n', '\n').replace('\\t', '\t')
 
 
+MAX_LOGGER_BUFFER_SIZE = 10 * 1024 * 1024
+
+
 class IntegrationLogger(object):
     """
       a logger for python integrations:
       use LOG(<message>) to add a record to the logger (message can be any object with __str__)
       use LOG.print_log(verbose=True/False) to display all records in War-Room (if verbose) and server log.
       use add_replace_strs to add sensitive strings that should be replaced before going to the log.
+      buffered records are kept up to max_buffer_size characters, the oldest records are dropped beyond it.
 
       :type message: ``str``
       :param message: The message to be logged
 
+      :type max_buffer_size: ``int``
+      :param max_buffer_size: The maximal total length of the buffered records.
+
       :return: No data returned
       :rtype: ``None``
     """
 
-    def __init__(self, debug_logging=False):
-        self.messages = []  # type: list
+    def __init__(self, debug_logging=False, max_buffer_size=MAX_LOGGER_BUFFER_SIZE):
+        self.messages = deque()  # type: deque
+        self.messages_size = 0
+        self.dropped_messages_count = 0
+        self.max_buffer_size = max_buffer_size
         self.write_buf = []  # type: list
         self.replace_strs = []  # type: list
+        self.replace_regex = None  # type: Any
+        self.replace_regex_strs_count = 0
         self.curl = []  # type: list
         self.buffering = True
         self.debug_logging = debug_logging
+        # the params are added on the first use of the logger, the module level LOG is created by every script
+        self.sensitive_params_added = False
+
+    def add_sensitive_params(self):
+        """
+        add the sensitive params of the integration to the replace strings, once
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        if self.sensitive_params_added:
+            return
+        self.sensitive_params_added = True
         # if for some reason you don't want to auto add credentials.password to replace strings
         # set the os env COMMON_SERVER_NO_AUTO_REPLACE_STRS. Either in CommonServerUserPython, or docker env
         if (not os.getenv('COMMON_SERVER_NO_AUTO_REPLACE_STRS') and hasattr(demisto, 'getParam')):
@@ -1302,14 +1524,34 @@ class IntegrationLogger(object):
                 res = message.encode('utf-8', 'replace')  # type: ignore
             else:
                 res = "Failed encoding message with error: {}".format(exception)
-        for s in self.replace_strs:
-            res = res.replace(s, '<XX_REPLACED>')
+        replace_regex = self.get_replace_regex()
+        if replace_regex:
+            res = replace_regex.sub('<XX_REPLACED>', res)
         return res
 
+    def get_replace_regex(self):
+        """
+        Returns a single regex matching all the replace strings, longest first. The regex is built again only when
+        replace strings are added.
+        """
+        self.add_sensitive_params()
+        if len(self.replace_strs) != self.replace_regex_strs_count:
+            replace_strs = sorted(set(s for s in self.replace_strs if s), key=len, reverse=True)
+            self.replace_regex = re.compile('|'.join(re.escape(s) for s in replace_strs)) if replace_strs else None
+            self.replace_regex_strs_count = len(self.replace_strs)
+        return self.replace_regex
+
+    def buffer_message(self, text):
+        self.messages.append(text)
+        self.messages_size += len(text)
+        while self.messages_size > self.max_buffer_size and len(self.messages) > 1:
+            self.messages_size -= len(self.messages.popleft())
+            self.dropped_messages_count += 1
+
     def __call__(self, message):
         text = self.encode(message)
         if self.buffering:
-            self.messages.append(text)
+            self.buffer_message(text)
             if self.debug_logging:
                 demisto.debug(text)
         else:
@@ -1340,14 +1582,20 @@ class IntegrationLogger(object):
 
     def print_log(self, verbose=False):
         if self.write_buf:
-            self.messages.append("".join(self.write_buf))
+            self.buffer_message("".join(self.write_buf))
         if self.messages:
-            text = 'Full Integration Log:\n' + '\n'.join(self.messages)
+            text = 'Full Integration Log:\n'
+            if self.dropped_messages_count:
+                text += '({} earlier records were dropped as the log exceeded {} characters)\n'.format(
+                    self.dropped_messages_count, self.max_buffer_size)
+            text += '\n'.join(self.messages)
             if verbose:
                 demisto.log(text)
             if not self.debug_logging:  # we don't print out if in debug_logging as already all message where printed
                 demisto.info(text)
-            self.messages = []
+            self.messages = deque()
+            self.messages_size = 0
+            self.dropped_messages_count = 0
 
     def build_curl(self, text):
         """
@@ -1410,7 +1658,7 @@ class IntegrationLogger(object):
         if has_newline:
             text = "".join(self.write_buf)
             if self.buffering:
-                self.messages.append(text)
+                self.buffer_message(text)
             else:
                 demisto.info(text)
                 if is_debug_mode() and text.startswith('send:'):
@@ -1440,6 +1688,7 @@ use LOG(<message>) to add a record to the logger (message can be any object with
 use LOG.print_log() to display all records in War-Room and server log.
 """
 LOG = IntegrationLogger(debug_logging=is_debug_mode())
+STARTUP_PROFILER.mark('logger and formatting functions')
 
 
 def formatAllArgs(args, kwds):
@@ -1529,6 +1778,11 @@ def flattenCell(data, is_pretty=True):
                 string_list.append(d.encode('utf-8'))
 
         return ',\n'.join(string_list)
+    elif data is True or data is False:
+        return 'true' if data else 'false'
+    elif type(data) is int:
+        # the same as json.dumps, which is slow for the common case of a number
+        return str(data)
     else:
         return json.dumps(data, indent=indent, ensure_ascii=False)
 
@@ -1743,7 +1997,7 @@ def tableToMarkdown(name, t, headers=None, headerTransform=None, removeNull=Fals
         # should be only one header
         if headers and len(headers) > 0:
             header = headers[0]
-            t = map(lambda item: dict((h, item) for h in [header]), t)
+            t = [{header: item} for item in t]
         else:
             raise Exception("Missing headers param for tableToMarkdown. Example: headers=['Some Header']")
 
@@ -1753,11 +2007,14 @@ def tableToMarkdown(name, t, headers=None, headerTransform=None, removeNull=Fals
         headers.sort()
 
     if removeNull:
-        headers_aux = headers[:]
-        for header in headers:
-            if all(obj.get(header) in ('', None, [], {}) for obj in t):
-                headers_aux.remove(header)
-        headers = headers_aux
+        # a single pass over the rows, a header is no longer checked once it has a value
+        null_headers = set(headers)
+        for obj in t:
+            for header in [h for h in null_headers if obj.get(h) not in ('', None, [], {})]:
+                null_headers.remove(header)
+            if not null_headers:
+                break
+        headers = [header for header in headers if header not in null_headers]
 
     if t and len(headers) > 0:
         newHeaders = []
@@ -1765,25 +2022,20 @@ def tableToMarkdown(name, t, headers=None, headerTransform=None, removeNull=Fals
             def headerTransform(s): return stringEscapeMD(s, True, True)  # noqa
         for header in headers:
             newHeaders.append(headerTransform(header))
-        mdResult += '|'
-        if len(newHeaders) == 1:
-            mdResult += newHeaders[0]
-        else:
-            mdResult += '|'.join(newHeaders)
-        mdResult += '|\n'
-        sep = '---'
-        mdResult += '|' + '|'.join([sep] * len(headers)) + '|\n'
+        lines = [mdResult, '|', '|'.join(newHeaders), '|\n', '|' + '|'.join(['---'] * len(headers)) + '|\n']
         for entry in t:
-            vals = [stringEscapeMD((formatCell(entry.get(h, ''), False) if entry.get(h) is not None else ''),
-                                   True, True) for h in headers]
+            vals = ['' if val is None else escape_table_cell(val if isinstance(val, STRING_TYPES) else formatCell(val, False))
+                    for val in map(entry.get, headers)]
             # this pipe is optional
-            mdResult += '| '
             try:
-                mdResult += ' | '.join(vals)
+                lines.append('| ' + ' | '.join(vals) + ' |\n')
             except UnicodeDecodeError:
-                vals = [str(v) for v in vals]
-                mdResult += ' | '.join(vals)
-            mdResult += ' |\n'
+                lines.append('| ' + ' | '.join([str(v) for v in vals]) + ' |\n')
+        try:
+            mdResult = ''.join(lines)
+        except UnicodeDecodeError:
+            # python 2 - non ascii bytes mixed with unicode lines
+            mdResult = ''.join([str(line) for line in lines])
 
     else:
         mdResult += '**No entries.**\n'
@@ -2004,6 +2256,24 @@ def stringEscapeMD(st, minimal_escaping=False, escape_multiline=False):
     return st
 
 
+def escape_table_cell(st):
+    """
+       Escape the chars that might break a markdown table cell, the same as stringEscapeMD(st, True, True).
+       The replacements are skipped for the (common) cells without these chars.
+
+       :type st: ``str``
+       :param st: The cell content (required)
+
+       :return: A modified string
+       :rtype: ``str``
+    """
+    if '\r' in st or '\n' in st:
+        st = st.replace('\r\n', '<br>').replace('\r', '<br>').replace('\n', '<br>')
+    if '|' in st:
+        st = st.replace('|', '\\|')
+    return st
+
+
 def raiseTable(root, key):
     newInternal = {}
     if key in root and isinstance(root[key], dict):
@@ -5492,6 +5762,10 @@ class EntityRelationship:
         return indicator_relationship_context
 
 
+STARTUP_PROFILER.mark('Common classes')
+DEFAULT_MAX_TABLE_ROWS = 1000
+
+
 class CommandResults:
     """
     CommandResults class - use to return results to warroom
@@ -5540,14 +5814,28 @@ class CommandResults:
     :type scheduled_command: ``ScheduledCommand``
     :param scheduled_command: manages the way the command should be polled.
 
+    :type max_table_rows: ``int``
+    :param max_table_rows: the maximal number of rows in the readable output generated when readable_output is not set.
+        Larger outputs are shown partially, with a note of the number of rows shown. None to show all the rows.
+
+    :type raw_response_size_limit: ``int``
+    :param raw_response_size_limit: the maximal size in bytes of the (JSON serialized) raw response to return in the
+        entry. Larger raw responses are returned as a file entry instead. If not set, the raw response is never
+        returned as a file.
+
+    :type raw_response_file_name: ``str``
+    :param raw_response_file_name: the name of the file of a raw response larger than raw_response_size_limit.
+        If not set, will use '<outputs_prefix>.json'.
+
     :return: None
     :rtype: ``None``
     """
 
     def __init__(self, outputs_prefix=None, outputs_key_field=None, outputs=None, indicators=None, readable_output=None,
                  raw_response=None, indicators_timeline=None, indicator=None, ignore_auto_extract=False,
-                 mark_as_note=False, scheduled_command=None, relationships=None, entry_type=None):
-        # type: (str, object, object, list, str, object, IndicatorsTimeline, Common.Indicator, bool, bool, ScheduledCommand, list, int) -> None  # noqa: E501
+                 mark_as_note=False, scheduled_command=None, relationships=None, entry_type=None,
+                 max_table_rows=DEFAULT_MAX_TABLE_ROWS, raw_response_size_limit=None, raw_response_file_name=None):
+        # type: (str, object, object, list, str, object, IndicatorsTimeline, Common.Indicator, bool, bool, ScheduledCommand, list, int, int, int, str) -> None  # noqa: E501
         if raw_response is None:
             raw_response = outputs
         if outputs is not None and not isinstance(outputs, dict) and not outputs_prefix:
@@ -5586,6 +5874,9 @@ class CommandResults:
         self.scheduled_command = scheduled_command
 
         self.relationships = relationships
+        self.max_table_rows = max_table_rows
+        self.raw_response_size_limit = raw_response_size_limit
+        self.raw_response_file_name = raw_response_file_name
 
     def to_context(self):
         outputs = {}  # type: dict
@@ -5626,7 +5917,11 @@ class CommandResults:
         if self.outputs is not None and self.outputs != []:
             if not self.readable_output:
                 # if markdown is not provided then create table by default
-                human_readable = tableToMarkdown('Results', self.outputs)
+                if self.max_table_rows and isinstance(self.outputs, list) and len(self.outputs) > self.max_table_rows:
+                    metadata = 'Showing the first {} results out of {}.'.format(self.max_table_rows, len(self.outputs))
+                    human_readable = tableToMarkdown('Results', self.outputs[:self.max_table_rows], metadata=metadata)
+                else:
+                    human_readable = tableToMarkdown('Results', self.outputs)
             if self.outputs_prefix and self._outputs_key_field:
                 # if both prefix and key field provided then create DT key
                 formatted_outputs_key = ' && '.join(['val.{0} && val.{0} == obj.{0}'.format(key_field)
@@ -5661,6 +5956,42 @@ class CommandResults:
             return_entry.update(self.scheduled_command.to_results())
         return return_entry
 
+    def to_entries(self):
+        """Gets the war room entries of the results - the entry of ``to_context``, and a file entry of the raw response
+        when it is larger than raw_response_size_limit.
+
+        :return: The entries.
+        :rtype: ``list``
+        """
+        entry = self.to_context()
+        contents = entry['Contents']
+        if not self.raw_response_size_limit or contents is None or isinstance(contents, int):
+            return [entry]
+        data = contents if isinstance(contents, STRING_TYPES) else json.dumps(contents)
+        if len(data) <= self.raw_response_size_limit:
+            return [entry]
+        file_name = self.raw_response_file_name or '{}.json'.format(self.outputs_prefix or 'raw_response')
+        file_entry = fileResult(file_name, data)
+        entry['Contents'] = 'The raw response is {} bytes, and was returned as the file {}.'.format(len(data), file_name)
+        entry['ContentsFormat'] = EntryFormat.TEXT
+        return [entry, file_entry]
+
+
+def log_entry_size(entry):
+    """Logs the serialized size of a war room entry and of its main parts in debug mode.
+
+    :type entry: ``dict``
+    :param entry: The entry.
+
+    :return: No data returned
+    :rtype: ``None``
+    """
+    if not is_debug_mode() or not isinstance(entry, dict):
+        return
+    sizes = ', '.join('{}: {}'.format(key, len(json.dumps(entry.get(key), default=str)))
+                      for key in ('Contents', 'HumanReadable', 'EntryContext'))
+    demisto.debug('Returning an entry of {} bytes ({})'.format(len(json.dumps(entry, default=str)), sizes))
+
 
 def return_results(results):
     """
@@ -5687,10 +6018,15 @@ def return_results(results):
                 # The rest are of the new format and have a corresponding function (to_context, to_display, etc...)
                 return_results(result)
         if result_list:
+            for result in result_list:
+                log_entry_size(result)
             demisto.results(result_list)
 
     elif isinstance(results, CommandResults):
-        demisto.results(results.to_context())
+        entries = results.to_entries()
+        for entry in entries:
+            log_entry_size(entry)
+        demisto.results(entries[0] if len(entries) == 1 else entries)
 
     elif isinstance(results, BaseWidget):
         demisto.results(results.to_display())
@@ -6610,8 +6946,423 @@ H || val.SSDeep && val.SSDeep == obj.SSDeep)': {'Malicious': {'Vendor': 'Vendor'
                                .format(indicator_type, INDICATOR_TYPE_TO_CONTEXT_KEY.keys()))
 
 
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+
+class RateLimiter(object):
+    """Limits the rate of calls with a token bucket, the calls can be made from several threads.
+    The bucket holds up to ``burst`` tokens and is refilled with ``rate`` tokens every ``period`` seconds,
+    every call takes a token and waits for it if the bucket is empty.
+
+    :type rate: ``int``
+    :param rate: The number of calls allowed in a period.
+
+    :type period: ``float``
+    :param period: The period in seconds.
+
+    :type burst: ``int``
+    :param burst: The number of calls that can be made at once after a quiet time. If None, will use ``rate``.
+
+    :return: No data returned
+    :rtype: ``None``
+    """
+
+    def __init__(self, rate, period=1, burst=None):
+        self.period = period
+        self.rate = float(rate) / period
+        self.burst = burst or rate
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+        self.calls = 0
+        self.throttled_calls = 0
+        self.throttled_time = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # the bucket is not refilled before ``updated``, which is in the future while the calls are paused
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def acquire(self):
+        """Takes a token, sleeping until the bucket has one.
+
+        :return: The time slept in seconds.
+        :rtype: ``float``
+        """
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            # the token is reserved now, so the calls waiting for tokens are served in order
+            self.tokens -= 1
+            wait = max(0, self.updated - now - min(self.tokens, 0) / self.rate)
+            self.calls += 1
+            if wait:
+                self.throttled_calls += 1
+                self.throttled_time += wait
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def update(self, response):
+        """Updates the limiter with the response of a call, called by BaseClient after every request.
+
+        :type response: ``requests.Response``
+        :param response: The response.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+
+    def get_metrics(self):
+        """Gets the metrics of the limiter since it was created.
+
+        :return: The number of calls, how many of them waited for a token and the total time they waited.
+        :rtype: ``dict``
+        """
+        return {
+            'calls': self.calls,
+            'throttled_calls': self.throttled_calls,
+            'throttled_time': self.throttled_time,
+        }
+
+
+def parse_rate_limit_time(value, now=None, http_date=False):
+    """Parses the time a rate limit header points to, for example of the Retry-After or X-RateLimit-Reset headers.
+
+    :type value: ``str``
+    :param value: The header value - seconds from now, an epoch time in seconds or milliseconds, or when
+        ``http_date`` is set an HTTP date.
+
+    :type now: ``float``
+    :param now: The current epoch time. If None, will use time.time().
+
+    :type http_date: ``bool``
+    :param http_date: Whether the value can be an HTTP date, as in the Retry-After header.
+
+    :return: The epoch time the header points to, or None if it could not be parsed.
+    :rtype: ``float``
+    """
+    if value is None:
+        return None
+    now = time.time() if now is None else now
+    try:
+        seconds = float(value)
+    except ValueError:
+        if not http_date:
+            return None
+        from email.utils import mktime_tz, parsedate_tz
+        parsed = parsedate_tz(value)
+        return float(mktime_tz(parsed)) if parsed else None
+    if seconds > 1e12:
+        return seconds / 1000
+    if seconds > 1e9:
+        return seconds
+    return now + max(seconds, 0)
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """A RateLimiter that adapts its rate to the responses of the API (additive increase, multiplicative decrease).
+    A throttled response (429, or 503 with Retry-After) divides the rate, and every other successful response
+    increases it back up to the configured rate. The calls are paused until the time in the Retry-After header,
+    or in the X-RateLimit-Reset header when X-RateLimit-Remaining is 0, and the bucket never holds more tokens
+    than X-RateLimit-Remaining.
+    The state can be kept between runs of the integration with ``load_from_integration_context`` and
+    ``save_to_integration_context``.
+
+    :type rate: ``int``
+    :param rate: The maximal number of calls allowed in a period.
+
+    :type period: ``float``
+    :param period: The period in seconds.
+
+    :type burst: ``int``
+    :param burst: The number of calls that can be made at once after a quiet time. If None, will use ``rate``.
+
+    :type min_rate: ``int``
+    :param min_rate: The minimal number of calls allowed in a period.
+
+    :type decrease_factor: ``float``
+    :param decrease_factor: The factor to multiply the rate by on a throttled response.
+
+    :type increase: ``float``
+    :param increase: The number of calls per period to add to the rate on every successful response.
+
+    :return: No data returned
+    :rtype: ``None``
+    """
+
+    def __init__(self, rate, period=1, burst=None, min_rate=1, decrease_factor=0.5, increase=1):
+        super(AdaptiveRateLimiter, self).__init__(rate, period, burst)
+        self.max_rate = self.rate
+        self.min_rate = min(float(min_rate) / period, self.max_rate)
+        self.decrease_factor = decrease_factor
+        self.increase = float(increase) / period
+        self.throttled_responses = 0
+
+    def update(self, response):
+        """Adapts the rate and pauses the calls according to the status code and rate limit headers of a response.
+
+        :type response: ``requests.Response``
+        :param response: The response.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        headers = response.headers
+        now = time.time()
+        pause_until = parse_rate_limit_time(headers.get('Retry-After'), now, http_date=True)
+        throttled = response.status_code == 429 or (response.status_code == 503 and pause_until is not None)
+        remaining = headers.get('X-RateLimit-Remaining', headers.get('RateLimit-Remaining'))
+        try:
+            remaining = float(remaining) if remaining is not None else None
+        except ValueError:
+            remaining = None
+        if remaining is not None and remaining < 1:
+            reset = parse_rate_limit_time(headers.get('X-RateLimit-Reset', headers.get('RateLimit-Reset')), now)
+            if reset is not None:
+                pause_until = max(pause_until or 0, reset)
+
+        with self._lock:
+            self._refill(now)
+            if throttled:
+                self.throttled_responses += 1
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            elif response.status_code < 400:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+            if pause_until is not None and pause_until > self.updated:
+                # a single call is made when the pause ends, and the next ones are spread by the rate
+                self.tokens = min(self.tokens, 1)
+                self.updated = pause_until
+            elif remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+        if throttled:
+            demisto.debug('Rate limited with status code {}, the rate is now {:.3f} calls per {} seconds'.format(
+                response.status_code, self.rate * self.period, self.period))
+
+    def get_metrics(self):
+        """Gets the metrics of the limiter since it was created.
+
+        :return: The RateLimiter metrics, the number of throttled responses and the current rate per period.
+        :rtype: ``dict``
+        """
+        metrics = super(AdaptiveRateLimiter, self).get_metrics()
+        metrics['throttled_responses'] = self.throttled_responses
+        metrics['rate'] = self.rate * self.period
+        return metrics
+
+    def to_dict(self):
+        """Gets the state of the limiter - its current rate and remaining tokens.
+
+        :return: The state.
+        :rtype: ``dict``
+        """
+        with self._lock:
+            return {'rate': self.rate, 'tokens': self.tokens, 'updated': self.updated}
+
+    def load(self, state):
+        """Loads a state from ``to_dict``, limited to the configured rate and burst.
+
+        :type state: ``dict``
+        :param state: The state.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, min(self.max_rate, state.get('rate', self.rate)))
+            self.tokens = min(self.burst, state.get('tokens', self.tokens))
+            self.updated = state.get('updated', self.updated)
+
+    def load_from_integration_context(self, key='rate_limiter'):
+        """Loads the state saved by ``save_to_integration_context``, if there is one.
+
+        :type key: ``str``
+        :param key: The integration context key of the state.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        state = get_integration_context().get(key)
+        if state:
+            self.load(json.loads(state))
+
+    def save_to_integration_context(self, key='rate_limiter'):
+        """Saves the state in the integration context, to be loaded in the next run.
+
+        :type key: ``str``
+        :param key: The integration context key of the state.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        set_to_integration_context_with_retries({key: self.to_dict()})
+
+
+STARTUP_PROFILER.mark('command results and helpers')
+
 # Will add only if 'requests' module imported
 if 'requests' in sys.modules:
+    class HTTPTransport(object):
+        """Sends the requests of a BaseClient over a pooled ``requests.Session``.
+        The HTTP adapters are created once per retry policy and reused, so the connection pools (and their
+        keep-alive connections) survive between requests.
+
+        :type pool_connections: ``int``
+        :param pool_connections: The number of hosts to keep a connection pool for.
+
+        :type pool_maxsize: ``int``
+        :param pool_maxsize: The maximal number of connections to keep open for each host.
+
+        :type pool_block: ``bool``
+        :param pool_block: Whether to wait for a free connection when a host already has ``pool_maxsize``
+            connections in use, instead of opening a connection that will not be returned to the pool.
+
+        :type accept_encoding: ``str``
+        :param accept_encoding: The ``Accept-Encoding`` header to send, for example: 'gzip, deflate'.
+            If None, will use the requests default (gzip and deflate).
+
+        :type adapter_class: ``type``
+        :param adapter_class: The ``requests`` adapter class to mount, for example an adapter of an HTTP/2 library.
+            Must accept the ``pool_connections``, ``pool_maxsize``, ``pool_block`` and ``max_retries`` arguments
+            of ``HTTPAdapter``.
+
+        :type hooks: ``list``
+        :param hooks: Callables to call after every request with a dict of the method, url, status_code (None
+            if the request failed), elapsed (seconds) and exception (None if the request succeeded).
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+
+        def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                     pool_block=False, accept_encoding=None, adapter_class=None, hooks=None):
+            self.pool_connections = pool_connections
+            self.pool_maxsize = pool_maxsize
+            self.pool_block = pool_block
+            self.accept_encoding = accept_encoding
+            self.adapter_class = adapter_class or HTTPAdapter
+            self.hooks = list(hooks or [])
+            self._adapters = {}
+            self._adapters_lock = threading.Lock()
+
+        def create_session(self):
+            """Creates a session with the default (no retries) adapter mounted.
+
+            :return: The session.
+            :rtype: ``requests.Session``
+            """
+            session = requests.Session()
+            if self.accept_encoding:
+                session.headers['Accept-Encoding'] = self.accept_encoding
+            self.mount(session)
+            return session
+
+        def get_adapter(self, retry=None):
+            """Gets the adapter of a retry policy, creating it on the first call.
+
+            :type retry: ``tuple``
+            :param retry: The retry policy - a tuple of the arguments of ``BaseClient._implement_retry``.
+                If None, will not retry.
+
+            :return: The adapter.
+            :rtype: ``requests.adapters.HTTPAdapter``
+            """
+            with self._adapters_lock:
+                adapter = self._adapters.get(retry)
+                if adapter is None:
+                    adapter = self._adapters[retry] = self._create_adapter(retry)
+            return adapter
+
+        def _create_adapter(self, retry):
+            """Creates the adapter of a retry policy, see ``get_adapter``."""
+            max_retries = 0
+            if retry:
+                retries, status_list_to_retry, backoff_factor, raise_on_redirect, raise_on_status = retry
+                # urllib3 1.26 renamed method_whitelist to allowed_methods, and 2.0 removed the old name
+                methods_key = 'allowed_methods' if hasattr(Retry, 'DEFAULT_ALLOWED_METHODS') else 'method_whitelist'
+                max_retries = Retry(
+                    total=retries,
+                    read=retries,
+                    connect=retries,
+                    backoff_factor=backoff_factor,
+                    status=retries,
+                    status_forcelist=status_list_to_retry,
+                    raise_on_status=raise_on_status,
+                    raise_on_redirect=raise_on_redirect,
+                    **{methods_key: frozenset(['GET', 'POST', 'PUT'])}
+                )
+            return self.adapter_class(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+                                      pool_block=self.pool_block, max_retries=max_retries)
+
+        def mount(self, session, retry=None):
+            """Mounts the adapter of a retry policy on a session for http and https.
+
+            :type session: ``requests.Session``
+            :param session: The session to mount the adapter on.
+
+            :type retry: ``tuple``
+            :param retry: The retry policy, see ``get_adapter``.
+
+            :return: No data returned
+            :rtype: ``None``
+            """
+            adapter = self.get_adapter(retry)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+        def add_hook(self, hook):
+            """Adds a hook to call after every request, see the ``hooks`` argument.
+
+            :type hook: ``callable``
+            :param hook: The hook.
+
+            :return: No data returned
+            :rtype: ``None``
+            """
+            self.hooks.append(hook)
+
+        def request(self, session, method, url, **kwargs):
+            """Sends a request over the session and calls the hooks with its timing.
+
+            :type session: ``requests.Session``
+            :param session: The session to send the request over.
+
+            :type method: ``str``
+            :param method: The HTTP method, for example: GET, POST, and so on.
+
+            :type url: ``str``
+            :param url: The full url of the request.
+
+            :return: The response.
+            :rtype: ``requests.Response``
+            """
+            if not self.hooks:
+                return session.request(method, url, **kwargs)
+            res = None
+            error = None
+            start = time.time()
+            try:
+                res = session.request(method, url, **kwargs)
+                return res
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                timing = {
+                    'method': method,
+                    'url': url,
+                    'status_code': res.status_code if res is not None else None,
+                    'elapsed': time.time() - start,
+                    'exception': error,
+                }
+                for hook in self.hooks:
+                    try:
+                        hook(timing)
+                    except Exception as e:
+                        demisto.debug('HTTP transport hook failed: {}'.format(e))
+
     class BaseClient(object):
         """Client to use in integrations with powerful _http_request
         :type base_url: ``str``
@@ -6638,17 +7389,30 @@ if 'requests' in sys.modules:
             The request authorization, for example: (username, password).
             Can be None.
 
+        :type transport: ``HTTPTransport``
+        :param transport:
+            The transport to send the requests with, for example: HTTPTransport(pool_maxsize=50).
+            If None, will use an HTTPTransport with the default pool sizes.
+
+        :type rate_limiter: ``RateLimiter``
+        :param rate_limiter:
+            The rate limiter every request waits for and is updated with the response of, for example:
+            AdaptiveRateLimiter(rate=100, period=60). Can be None.
+
         :return: No data returned
         :rtype: ``None``
         """
 
-        def __init__(self, base_url, verify=True, proxy=False, ok_codes=tuple(), headers=None, auth=None):
+        def __init__(self, base_url, verify=True, proxy=False, ok_codes=tuple(), headers=None, auth=None,
+                     transport=None, rate_limiter=None):
             self._base_url = base_url
             self._verify = verify
             self._ok_codes = ok_codes
             self._headers = headers
             self._auth = auth
-            self._session = requests.Session()
+            self._transport = transport or HTTPTransport()
+            self._session = self._transport.create_session()
+            self._rate_limiter = rate_limiter
             if not proxy:
                 skip_proxy()
 
@@ -6698,28 +7462,46 @@ if 'requests' in sys.modules:
                 been exhausted.
             """
             try:
-                retry = Retry(
-                    total=retries,
-                    read=retries,
-                    connect=retries,
-                    backoff_factor=backoff_factor,
-                    status=retries,
-                    status_forcelist=status_list_to_retry,
-                    method_whitelist=frozenset(['GET', 'POST', 'PUT']),
-                    raise_on_status=raise_on_status,
-                    raise_on_redirect=raise_on_redirect
-                )
-                adapter = HTTPAdapter(max_retries=retry)
-                self._session.mount('http://', adapter)
-                self._session.mount('https://', adapter)
+                retry = self._get_retry_policy(retries, status_list_to_retry, backoff_factor, raise_on_redirect,
+                                               raise_on_status)
+                self._transport.mount(self._session, retry)
             except NameError:
                 pass
 
+        @staticmethod
+        def _get_retry_policy(retries=0, status_list_to_retry=None, backoff_factor=5, raise_on_redirect=False,
+                              raise_on_status=False, **kwargs):
+            """Gets the retry policy of the retry arguments of ``_http_request``, as used by ``HTTPTransport``.
+
+            :return: The retry policy.
+            :rtype: ``tuple``
+            """
+            return (retries, tuple(status_list_to_retry) if status_list_to_retry else None, backoff_factor,
+                    raise_on_redirect, raise_on_status)
+
+        def _create_retry_session(self, retry):
+            """Creates a session with the state of the session of the client (headers, cookies, proxies, etc.)
+            and the adapter of a retry policy mounted, so requests with different retry policies can be sent
+            concurrently without mounting adapters on a session which is in use.
+
+            :type retry: ``tuple``
+            :param retry: The retry policy, see ``_get_retry_policy``.
+
+            :return: The session.
+            :rtype: ``requests.Session``
+            """
+            session = requests.Session()
+            for attr in requests.Session.__attrs__:
+                setattr(session, attr, getattr(self._session, attr))
+            session.adapters = OrderedDict(self._session.adapters)
+            self._transport.mount(session, retry)
+            return session
+
         def _http_request(self, method, url_suffix='', full_url=None, headers=None, auth=None, json_data=None,
                           params=None, data=None, files=None, timeout=10, resp_type='json', ok_codes=None,
                           return_empty_response=False, retries=0, status_list_to_retry=None,
                           backoff_factor=5, raise_on_redirect=False, raise_on_status=False,
-                          error_handler=None, empty_valid_codes=None, **kwargs):
+                          error_handler=None, empty_valid_codes=None, rate_limiter=None, session=None, **kwargs):
             """A wrapper for requests lib to send our requests and handle requests and responses better.
 
             :type method: ``str``
@@ -6815,16 +7597,31 @@ if 'requests' in sys.modules:
             :param empty_valid_codes: A list of all valid status codes of empty responses (usually only 204, but
                 can vary)
 
+            :type rate_limiter: ``RateLimiter``
+            :param rate_limiter: The rate limiter of the request, for endpoints with their own limits.
+                If None, will use the rate limiter of the client.
+
+            :type session: ``requests.Session``
+            :param session: The session to send the request with, which already has the adapter of the retry
+                arguments mounted (see ``_create_retry_session``). If None, will use the session of the client.
+
             """
             try:
                 # Replace params if supplied
                 address = full_url if full_url else urljoin(self._base_url, url_suffix)
                 headers = headers if headers else self._headers
                 auth = auth if auth else self._auth
-                if retries:
-                    self._implement_retry(retries, status_list_to_retry, backoff_factor, raise_on_redirect, raise_on_status)
+                if session is None:
+                    session = self._session
+                    if retries:
+                        self._implement_retry(retries, status_list_to_retry, backoff_factor, raise_on_redirect,
+                                              raise_on_status)
+                rate_limiter = rate_limiter or self._rate_limiter
+                if rate_limiter:
+                    rate_limiter.acquire()
                 # Execute
-                res = self._session.request(
+                res = self._transport.request(
+                    session,
                     method,
                     address,
                     verify=self._verify,
@@ -6837,6 +7634,8 @@ if 'requests' in sys.modules:
                     timeout=timeout,
                     **kwargs
                 )
+                if rate_limiter:
+                    rate_limiter.update(res)
                 # Handle error responses gracefully
                 if not self._is_status_code_valid(res, ok_codes):
                     if error_handler:
@@ -6905,6 +7704,50 @@ if 'requests' in sys.modules:
                 err_msg = 'Max Retries Error- Request attempts with {} retries failed. \n{}'.format(retries, reason)
                 raise DemistoException(err_msg, exception)
 
+        def _http_request_many(self, requests_kwargs, max_workers=DEFAULT_POOL_MAXSIZE):
+            """Sends independent requests concurrently with ``_http_request``, over the session of the client.
+            The requests wait for the rate limiter of the client, if it has one.
+
+            :type requests_kwargs: ``list``
+            :param requests_kwargs: The ``_http_request`` arguments of every request, for example:
+                [{'method': 'GET', 'url_suffix': 'reports/1'}, {'method': 'GET', 'url_suffix': 'reports/2'}]
+
+            :type max_workers: ``int``
+            :param max_workers: The maximal number of requests to send at once. Should not be larger than the
+                pool_maxsize of the transport, since connections beyond it are not kept alive.
+
+            :return: The result of every request in the order of ``requests_kwargs``. For a request that failed,
+                the exception it raised.
+            :rtype: ``list``
+            """
+            def send(kwargs):
+                try:
+                    return self._http_request(**kwargs)
+                except Exception as e:
+                    return e
+
+            # Mounting the retry adapter on the shared session while other threads use it is not thread safe,
+            # so every retry policy gets its own session, prepared before the requests are sent.
+            sessions = {}  # type: dict
+            prepared_kwargs = []
+            for kwargs in requests_kwargs:
+                if kwargs.get('retries') and kwargs.get('session') is None:
+                    retry = self._get_retry_policy(**kwargs)
+                    if retry not in sessions:
+                        sessions[retry] = self._create_retry_session(retry)
+                    kwargs = dict(kwargs, session=sessions[retry])
+                prepared_kwargs.append(kwargs)
+            requests_kwargs = prepared_kwargs
+            workers = min(max_workers, len(requests_kwargs))
+            if workers <= 1:
+                return [send(kwargs) for kwargs in requests_kwargs]
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(workers)
+            try:
+                return pool.map(send, requests_kwargs, chunksize=1)
+            finally:
+                pool.terminate()
+
         def _is_status_code_valid(self, response, ok_codes=None):
             """If the status code is OK, return 'True'.
 
@@ -6926,8 +7769,10 @@ if 'requests' in sys.modules:
             return response.ok
 
 
-def batch(iterable, batch_size=1):
+def batch(iterable, batch_size=1, batch_size_bytes=None):
     """Gets an iterable and yields slices of it.
+    Lists, tuples and strings are sliced by index, any other iterable (e.g. a generator) is consumed lazily and
+    yielded as lists, so every item is copied once.
 
     :type iterable: ``list``
     :param iterable: list or other iterable object.
@@ -6935,15 +7780,39 @@ def batch(iterable, batch_size=1):
     :type batch_size: ``int``
     :param batch_size: the size of batches to fetch
 
+    :type batch_size_bytes: ``int``
+    :param batch_size_bytes: the maximal size in bytes of the JSON serialized batches (optional). When set, the batches
+        are yielded as lists once adding the next item would exceed this size or batch_size, and an item larger
+        than this size is yielded in a batch of its own.
+
     :rtype: ``list``
     :return:: Iterable slices of given
     """
-    current_batch = iterable[:batch_size]
-    not_batched = iterable[batch_size:]
-    while current_batch:
-        yield current_batch
-        current_batch = not_batched[:batch_size]
-        not_batched = not_batched[batch_size:]
+    if batch_size < 1:
+        return
+    if batch_size_bytes is not None:
+        current_batch = []  # type: list
+        current_batch_bytes = 2  # the list brackets
+        for item in iterable:
+            item_bytes = len(json.dumps(item, default=str)) + 2  # the item and its ', ' separator
+            if current_batch and (len(current_batch) >= batch_size
+                                  or current_batch_bytes + item_bytes > batch_size_bytes):
+                yield current_batch
+                current_batch = []
+                current_batch_bytes = 2
+            current_batch.append(item)
+            current_batch_bytes += item_bytes
+        if current_batch:
+            yield current_batch
+    elif isinstance(iterable, (list, tuple) + STRING_TYPES):
+        for i in range(0, len(iterable), batch_size):
+            yield iterable[i:i + batch_size]
+    else:
+        iterator = iter(iterable)
+        current_batch = list(itertools.islice(iterator, batch_size))
+        while current_batch:
+            yield current_batch
+            current_batch = list(itertools.islice(iterator, batch_size))
 
 
 def dict_safe_get(dict_object, keys, default_return_value=None, return_type=None, raise_return_type=True):
@@ -6995,6 +7864,8 @@ def dict_safe_get(dict_object, keys, default_return_value=None, return_type=None
 
 CONTEXT_UPDATE_RETRY_TIMES = 3
 MIN_VERSION_FOR_VERSIONED_CONTEXT = '6.0.0'
+COMPRESSED_CONTEXT_VALUE_PREFIX = '__zlib_b64__:'
+DEFAULT_CONTEXT_COMPRESS_THRESHOLD = 100 * 1024  # 100KB
 
 
 def merge_lists(original_list, updated_list, key):
@@ -7198,6 +8069,243 @@ def update_integration_context(context, object_keys=None, sync=True):
     return integration_context, version
 
 
+class IntegrationContextStore(object):
+    """
+    A key based store on top of the integration context.
+    The latest context read is cached in the process, so consecutive reads do not fetch the whole context again,
+    and only the keys that are read are decoded.
+    Writes change only the given keys and keep the stored value of all the other keys as is.
+    If the version of the context is too old by the time it is set, the context is read again and the change is
+    applied on top of it, until the retry limit is reached.
+    Values which are larger than the compression threshold once serialized are stored compressed (zlib + base64).
+
+    Example:
+    >>> store = IntegrationContextStore()
+    >>> store.set('access_token', token)
+    >>> store.merge('incidents', [{'id': '1', 'status': 'closed'}], 'id')
+    >>> store.get('access_token')
+
+    :type sync: ``bool``
+    :param sync: Whether to read and save the context directly from/to the DB.
+
+    :type compress_threshold: ``int``
+    :param compress_threshold: The serialized size (in bytes) from which values are stored compressed.
+        Set to 0 to disable compression.
+
+    :type max_retry_times: ``int``
+    :param max_retry_times: The maximum number of attempts to set the context.
+
+    :return: No data returned
+    :rtype: ``None``
+    """
+    _DELETED = object()
+
+    def __init__(self, sync=True, compress_threshold=DEFAULT_CONTEXT_COMPRESS_THRESHOLD,
+                 max_retry_times=CONTEXT_UPDATE_RETRY_TIMES):
+        self.sync = sync
+        self.compress_threshold = compress_threshold
+        self.max_retry_times = max_retry_times
+        self._context = None
+        self._version = None
+        self._decoded = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def encode_value(value, compress_threshold=DEFAULT_CONTEXT_COMPRESS_THRESHOLD):
+        """
+        Encodes a value for storing in the integration context, compressing it if it is large.
+
+        :type value: ``Any``
+        :param value: A JSON serializable value.
+
+        :type compress_threshold: ``int``
+        :param compress_threshold: The serialized size (in bytes) from which the value is compressed.
+
+        :return: The value to store.
+        :rtype: ``Any``
+        """
+        if not compress_threshold or isinstance(value, (bool, int, float)) or value is None:
+            return value
+        serialized = json.dumps(value)
+        if len(serialized) < compress_threshold:
+            return value
+        compressed = base64.b64encode(zlib.compress(serialized.encode('utf-8'))).decode('ascii')
+        if len(compressed) + len(COMPRESSED_CONTEXT_VALUE_PREFIX) >= len(serialized):
+            return value
+        return COMPRESSED_CONTEXT_VALUE_PREFIX + compressed
+
+    @staticmethod
+    def decode_value(value):
+        """
+        Decodes a value stored in the integration context.
+
+        :type value: ``Any``
+        :param value: The stored value.
+
+        :return: The original value.
+        :rtype: ``Any``
+        """
+        if isinstance(value, STRING_TYPES) and value.startswith(COMPRESSED_CONTEXT_VALUE_PREFIX):
+            compressed = base64.b64decode(value[len(COMPRESSED_CONTEXT_VALUE_PREFIX):])
+            return json.loads(zlib.decompress(compressed).decode('utf-8'))
+        return value
+
+    def load(self):
+        """
+        Reads the latest integration context (and its version) and caches it.
+
+        :return: The integration context as stored (compressed values are not decoded).
+        :rtype: ``dict``
+        """
+        with self._lock:
+            context, version = get_integration_context_with_version(self.sync)
+            self._context = dict(context or {})
+            self._version = version
+            self._decoded = {}
+            return self._context
+
+    def _get_context(self):
+        if self._context is None:
+            return self.load()
+        return self._context
+
+    def get(self, key, default=None):
+        """
+        Gets a single key from the cached integration context, reading the context on first use.
+
+        :type key: ``str``
+        :param key: The key to get.
+
+        :type default: ``Any``
+        :param default: The value to return if the key does not exist.
+
+        :return: The decoded value of the key.
+        :rtype: ``Any``
+        """
+        with self._lock:
+            context = self._get_context()
+            if key not in context:
+                return default
+            if key not in self._decoded:
+                self._decoded[key] = self.decode_value(context[key])
+            return self._decoded[key]
+
+    def keys(self):
+        """
+        :return: The keys of the cached integration context.
+        :rtype: ``list``
+        """
+        with self._lock:
+            return list(self._get_context().keys())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._get_context()
+
+    def set(self, key, value):
+        """
+        Sets a single key in the integration context.
+
+        :type key: ``str``
+        :param key: The key to set.
+
+        :type value: ``Any``
+        :param value: A JSON serializable value.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        self.update({key: value})
+
+    def update(self, values):
+        """
+        Sets multiple keys in the integration context in a single write.
+
+        :type values: ``dict``
+        :param values: The keys and values to set.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        self._write(lambda: dict(values))
+
+    def delete(self, *keys):
+        """
+        Deletes keys from the integration context.
+
+        :type keys: ``str``
+        :param keys: The keys to delete.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        self._write(lambda: {key: self._DELETED for key in keys})
+
+    def merge(self, key, items, object_key):
+        """
+        Merges a list of objects into a list key of the integration context by their unique ID (see ``merge_lists``).
+        The merge is done against the latest list, and is done again if the context changed in the meantime.
+
+        :type key: ``str``
+        :param key: The key of the list in the integration context.
+
+        :type items: ``list``
+        :param items: The objects to merge. Objects with ``remove: True`` are removed from the list.
+
+        :type object_key: ``str``
+        :param object_key: The unique ID of the objects.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        self._write(lambda: {key: merge_lists(self.get(key) or [], items, object_key)})
+
+    def _write(self, get_changes):
+        """
+        Applies changes on the latest integration context and sets it, with retries on version conflicts.
+
+        :type get_changes: ``callable``
+        :param get_changes: A function which returns the keys to change and their new (decoded) values.
+            It is called again on every attempt, after the latest context is read.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        with self._lock:
+            attempt = 0
+            while True:
+                # The version of a context which was already written is unknown, so it has to be read again.
+                if self._context is None or self._version is None:
+                    self.load()
+                changes = get_changes()
+                context = dict(self._context)
+                for key, value in changes.items():
+                    if value is self._DELETED:
+                        context.pop(key, None)
+                    else:
+                        context[key] = self.encode_value(value, self.compress_threshold)
+
+                attempt += 1
+                try:
+                    set_integration_context(context, self.sync, self._version)
+                    break
+                except ValueError as ve:
+                    demisto.debug('Failed updating integration context with version {}: {} Attempts left - {}'
+                                  ''.format(self._version, str(ve), self.max_retry_times - attempt))
+                    if attempt >= self.max_retry_times:
+                        raise Exception('Failed updating integration context. Max retry attempts exceeded.')
+                    self._version = None
+                    time.sleep(randint(1, 100) / 1000.0)
+
+            self._context = context
+            self._version = None
+            for key, value in changes.items():
+                if value is self._DELETED:
+                    self._decoded.pop(key, None)
+                else:
+                    self._decoded[key] = value
+
+
 class DemistoException(Exception):
     def __init__(self, message, exception=None, res=None, *args):
         self.res = res
@@ -7734,3 +8842,8 @@ def set_feed_last_run(last_run_indicators):
         demisto.setLastRun(last_run_indicators)
     else:
         demisto.setIntegrationContext(last_run_indicators)
+
+
+STARTUP_PROFILER.mark('BaseClient and the rest')
+if os.getenv('COMMON_SERVER_PROFILE_STARTUP'):
+    demisto.info(STARTUP_PROFILER.report())
@@ -7,8 +7,11 @@ import re
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.base import BaseEstimator, TransformerMixin
 import json
+import zlib
+import hashlib
 import pandas as pd
 from scipy.spatial.distance import cdist
+from scipy.sparse import issparse
 
 warnings.simplefilter("ignore")
 
@@ -57,6 +60,11 @@ REGEX_IP = re.compile(
     r'(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])')
 REPLACE_COMMAND_LINE = {"=": " = ", "\\": "/", "[": "", "]": "", '"': "", "'": "", }
 
+NORMALIZED_FIELD_CACHE_MODEL_NAME = 'DBotFindSimilarIncidents_cache_%s_%s_%s'
+# the last used time of a cached value is updated only once it is older than this ratio of the ttl
+NORMALIZED_FIELD_CACHE_REFRESH_RATIO = 0.5
+DEFAULT_INCIDENT_TYPE = 'all'
+
 
 def keep_high_level_field(incidents_field: List[str]) -> List[str]:
     """
@@ -214,14 +222,21 @@ def normalize_identity(my_string: str) -> str:
         return ''
 
 
-def euclidian_similarity_capped(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+def euclidian_similarity_capped(x, y) -> np.ndarray:
     """
     Return max between 1 and euclidian distance between X and y
-    :param x: np.array n*m
-    :param y: np.array 1*m
+    For sparse matrices the distance is computed from the norms and dot products, without densifying x
+    :param x: np.array or sparse matrix n*m
+    :param y: np.array or sparse matrix 1*m
     :return: np.array of ditance 1*n
     """
-    return np.maximum(1 - cdist(x, y)[:, 0], 0)
+    if not issparse(x):
+        return np.maximum(1 - cdist(x, y)[:, 0], 0)
+    x_squared_norms = np.asarray(x.multiply(x).sum(axis=1)).ravel()
+    y_squared_norm = y.multiply(y).sum()
+    dot_products = x.dot(y.T).toarray().ravel()
+    squared_distances = np.maximum(x_squared_norms + y_squared_norm - 2 * dot_products, 0)
+    return np.maximum(1 - np.sqrt(squared_distances), 0)
 
 
 def identity(X, y):  # type: ignore
@@ -236,21 +251,108 @@ def identity(X, y):  # type: ignore
     return z
 
 
+class NormalizedFieldCache:
+    """
+    Cache of the normalized values of an incident field for a given incident type, persisted in the ML models store.
+    A cached value is reused as long as the raw value of the incident field did not change, and values of incidents
+    that were not part of any run for ttl hours are evicted. The cache is stored again only if it changed.
+    """
+
+    def __init__(self, incident_type: str, transformer_type: str, field: str, ttl: float):
+        """
+        :param incident_type: type of the incidents
+        :param transformer_type: One of the key value of TRANSFORMATION dict
+        :param field: incident field
+        :param ttl: period in hours after which an unused value is evicted
+        """
+        self.model_name = NORMALIZED_FIELD_CACHE_MODEL_NAME % (incident_type, transformer_type, field)
+        self.ttl = ttl
+        self.entries = self.load()
+        self.hits = 0
+        self.modified = False
+
+    def load(self) -> Dict:
+        """
+        Load the cache entries from the ML models store
+        :return: Dict of incident id to [hash of the raw value, normalized value, last used timestamp]
+        """
+        res = demisto.executeCommand('getMLModel', {'modelName': self.model_name})
+        if is_error(res):
+            return {}
+        try:
+            model_data = res[0]['Contents']['modelData']
+            return json.loads(zlib.decompress(base64.b64decode(model_data)))
+        except Exception as e:
+            demisto.debug('Could not load the cache %s: %s' % (self.model_name, str(e)))
+            return {}
+
+    def store(self) -> None:
+        """
+        Evict the expired entries and store the cache in the ML models store, if any entry was added, updated or
+        evicted since it was loaded
+        :return:
+        """
+        expiration_time = time.time() - self.ttl * 3600
+        entries_count = len(self.entries)
+        self.entries = {incident_id: entry for incident_id, entry in self.entries.items()
+                        if entry[2] >= expiration_time}
+        if not self.modified and len(self.entries) == entries_count:
+            demisto.debug('The cache %s did not change, not storing it' % self.model_name)
+            return
+        model_data = base64.b64encode(zlib.compress(json.dumps(self.entries).encode('utf-8'))).decode('utf-8')
+        res = demisto.executeCommand('createMLModel', {'modelData': model_data,
+                                                       'modelName': self.model_name,
+                                                       'modelOverride': 'true',
+                                                       'modelHidden': True})
+        if is_error(res):
+            demisto.debug('Could not store the cache %s: %s' % (self.model_name, get_error(res)))
+
+    def normalize(self, incidents: pd.DataFrame, field: str, normalize_function) -> pd.Series:
+        """
+        Normalize the field of the incidents, using the cached value of the incidents which did not change
+        :param incidents: DataFrame of incidents with id and field columns
+        :param field: incident field
+        :param normalize_function: Normalize function to apply on the incidents that are not cached
+        :return: Series of the normalized values
+        """
+        now = time.time()
+        refresh_time = now - self.ttl * 3600 * NORMALIZED_FIELD_CACHE_REFRESH_RATIO
+        normalized_values = []
+        for incident_id, value in zip(incidents['id'], incidents[field]):
+            value_hash = hashlib.md5(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+            entry = self.entries.get(incident_id)
+            if entry and entry[0] == value_hash:
+                normalized_value = entry[1]
+                self.hits += 1
+                if entry[2] < refresh_time:
+                    entry[2] = now
+                    self.modified = True
+            else:
+                normalized_value = normalize_function(value)
+                self.entries[incident_id] = [value_hash, normalized_value, now]
+                self.modified = True
+            normalized_values.append(normalized_value)
+        return pd.Series(normalized_values, index=incidents.index, name=field)
+
+
 class Tfidf(BaseEstimator, TransformerMixin):
     """
     TFIDF transformer
     """
 
-    def __init__(self, incident_field: str, tfidf_params: dict, normalize_function, current_incident):
+    def __init__(self, incident_field: str, tfidf_params: dict, normalize_function, current_incident,
+                 cache: NormalizedFieldCache = None):
         """
         :param incident_field: incident on which we want to use the transformer
         :param tfidf_params: parameters of TFIDF
         :param normalize_function: Normalize function to apply on each sample of the corpus before the vectorization
         :param current_incident: current incident
+        :param cache: cache of the normalized values of the corpus
         """
         self.incident_field = incident_field
         self.params = tfidf_params
         self.normalize_function = normalize_function
+        self.cache = cache
         if self.normalize_function:
             current_incident = current_incident[self.incident_field].apply(self.normalize_function)
         self.vocabulary = TfidfVectorizer(**self.params, use_idf=False).fit(current_incident).vocabulary_
@@ -267,17 +369,31 @@ class Tfidf(BaseEstimator, TransformerMixin):
         self.vec.fit(x)
         return self
 
+    def fit_transform(self, x, y=None):
+        """
+        Fit TFIDF transformer and transform x, normalizing the corpus only once
+        :param x: incident on which we want to fit the transfomer
+        :return: sparse CSR matrix
+        """
+        if self.normalize_function and self.cache is not None and 'id' in x.columns:
+            x = self.cache.normalize(x, self.incident_field, self.normalize_function)
+        elif self.normalize_function:
+            x = x[self.incident_field].apply(self.normalize_function)
+        else:
+            x = x[self.incident_field]
+        return self.vec.fit_transform(x)
+
     def transform(self, x):
         """
         Transform x with the trained vectorizer
         :param x: DataFrame or np.array
-        :return:
+        :return: sparse CSR matrix
         """
         if self.normalize_function:
             x = x[self.incident_field].apply(self.normalize_function)
         else:
             x = x[self.incident_field]
-        return self.vec.transform(x).toarray()
+        return self.vec.transform(x)
 
 
 class Identity(BaseEstimator, TransformerMixin):
@@ -285,7 +401,7 @@ class Identity(BaseEstimator, TransformerMixin):
     Identity transformer for Categorical field
     """
 
-    def __init__(self, feature_names, identity_params, normalize_function, x=None):
+    def __init__(self, feature_names, identity_params, normalize_function, x=None, cache=None):
         self.feature_names = feature_names
         self.normalize_function = normalize_function
         self.identity_params = identity_params
@@ -300,11 +416,13 @@ class Identity(BaseEstimator, TransformerMixin):
             return x[self.feature_names]
 
 
+# 'cache' is set only for the normalize functions which are slower than the lookup of the cached values
 TRANSFORMATION = {
     'commandline': {'transformer': Tfidf,
                     'normalize': normalize_command_line,
                     'params': {'analyzer': 'char', 'max_features': 2000, 'ngram_range': (2, 5)},
-                    'scoring_function': euclidian_similarity_capped
+                    'scoring_function': euclidian_similarity_capped,
+                    'cache': False
                     },
     'potentialMatch': {'transformer': Identity,
                        'normalize': None,
@@ -314,7 +432,8 @@ TRANSFORMATION = {
     'json': {'transformer': Tfidf,
              'normalize': normalize_json,
              'params': {'analyzer': 'char', 'max_features': 10000, 'ngram_range': (2, 5)},
-             'scoring_function': euclidian_similarity_capped
+             'scoring_function': euclidian_similarity_capped,
+             'cache': True
              }
 }
 
@@ -324,19 +443,21 @@ class Transformer():
     Class for Transformer
     """
 
-    def __init__(self, p_transformer_type, field, p_incidents_df, p_incident_to_match, p_params):
+    def __init__(self, p_transformer_type, field, p_incidents_df, p_incident_to_match, p_params, p_cache=None):
         """
         :param p_transformer_type: One of the key value of TRANSFORMATION dict
         :param field: incident field used in this transformation
         :param p_incidents_df: DataFrame of incident (should contains one columns which same name than incident_field)
         :param p_incident_to_match: DataFrame of the current incident
         :param p_params: Dictionary of all the transformation - TRANSFORMATION
+        :param p_cache: NormalizedFieldCache of the field or None
         """
         self.transformer_type = p_transformer_type
         self.field = field
         self.incident_to_match = p_incident_to_match
         self.incidents_df = p_incidents_df
         self.params = p_params
+        self.cache = p_cache
 
     def fit_transform(self):
         """
@@ -345,7 +466,7 @@ class Transformer():
         """
         transformation = self.params[self.transformer_type]
         transformer = transformation['transformer'](self.field, transformation['params'], transformation['normalize'],
-                                                    self.incident_to_match)
+                                                    self.incident_to_match, cache=self.cache)
         x_vect = transformer.fit_transform(self.incidents_df)
         incident_vect = transformer.transform(self.incident_to_match)
 
@@ -363,11 +484,15 @@ class Transformer():
 
 
 class Model:
-    def __init__(self, p_transformation):
+    def __init__(self, p_transformation, p_incident_type=None, p_cache_ttl=None):
         """
         :param p_transformation: Dict with the transformers parameters - TRANSFORMATION
+        :param p_incident_type: type of the incidents, used to cache the normalized fields
+        :param p_cache_ttl: period in hours to keep normalized fields in cache, None to not use the cache
         """
         self.transformation = p_transformation
+        self.incident_type = p_incident_type or DEFAULT_INCIDENT_TYPE
+        self.cache_ttl = p_cache_ttl
 
     def init_prediction(self, p_incident_to_match, p_incidents_df, p_field_for_command_line=[],
                         p_field_for_potential_exact_match=[], p_field_for_display_fields_incidents=[],
@@ -429,20 +554,33 @@ class Model:
                 remove_list.append(field)
         self.field_for_json = [x for x in self.field_for_json if x not in remove_list]
 
+    def get_cache(self, transformer_type, field):
+        """
+        Return the cache of the normalized field if caching is enabled
+        :param transformer_type: One of the key value of TRANSFORMATION dict
+        :param field: incident field
+        :return: NormalizedFieldCache or None
+        """
+        if self.cache_ttl is None or not self.transformation[transformer_type].get('cache'):
+            return None
+        return NormalizedFieldCache(self.incident_type, transformer_type, field, self.cache_ttl)
+
     def get_score(self):
         """
         Apply transformation for each field in possible transformer
         :return:
         """
-        for field in self.field_for_command_line:
-            t = Transformer('commandline', field, self.incidents_df, self.incident_to_match, self.transformation)
-            t.get_score()
-        for field in self.field_for_potential_exact_match:
-            t = Transformer('potentialMatch', field, self.incidents_df, self.incident_to_match, self.transformation)
-            t.get_score()
-        for field in self.field_for_json:
-            t = Transformer('json', field, self.incidents_df, self.incident_to_match, self.transformation)
-            t.get_score()
+        for transformer_type, fields in [('commandline', self.field_for_command_line),
+                                         ('potentialMatch', self.field_for_potential_exact_match),
+                                         ('json', self.field_for_json)]:
+            for field in fields:
+                cache = self.get_cache(transformer_type, field)
+                t = Transformer(transformer_type, field, self.incidents_df, self.incident_to_match,
+                                self.transformation, cache)
+                t.get_score()
+                if cache is not None:
+                    demisto.debug('%s: %d normalized values reused from cache' % (cache.model_name, cache.hits))
+                    cache.store()
 
     def compute_final_score(self):
         """
@@ -631,10 +769,13 @@ def get_args():  # type: ignore
     show_actual_incident = demisto.args().get('showCurrentIncident')
     incident_id = demisto.args().get('incidentId')
     include_indicators_similarity = demisto.args().get('includeIndicatorsSimilarity')
+    cache_ttl = None
+    if demisto.args().get('cacheNormalizedFields') == 'True':
+        cache_ttl = float(demisto.args().get('normalizedFieldsCacheTTL') or 168)
 
     return similar_text_field, similar_json_field, similar_categorical_field, exact_match_fields, display_fields, \
         from_date, to_date, show_similarity, confidence, max_incidents, query, aggregate, limit, \
-        show_actual_incident, incident_id, include_indicators_similarity
+        show_actual_incident, incident_id, include_indicators_similarity, cache_ttl
 
 
 def load_current_incident(incident_id: str, populate_fields: List[str], from_date: str, to_date: str):
@@ -877,7 +1018,7 @@ def prepare_current_incident(incident_df: pd.DataFrame, display_fields: List[str
 def main():
     similar_text_field, similar_json_field, similar_categorical_field, exact_match_fields, display_fields, from_date, \
         to_date, show_distance, confidence, max_incidents, query, aggregate, limit, show_actual_incident, \
-        incident_id, include_indicators_similarity = get_args()
+        incident_id, include_indicators_similarity, cache_ttl = get_args()
 
     global_msg = ""
 
@@ -885,7 +1026,10 @@ def main():
         + display_fields + ['id']
     populate_high_level_fields = keep_high_level_field(populate_fields)
 
-    incident, incident_id = load_current_incident(incident_id, populate_high_level_fields, from_date, to_date)
+    # the incident type is needed to cache the normalized fields by type
+    current_incident_fields = populate_high_level_fields + ['type'] if cache_ttl is not None \
+        else populate_high_level_fields
+    incident, incident_id = load_current_incident(incident_id, current_incident_fields, from_date, to_date)
     if not incident:
         return_outputs_error(error_msg="%s \n" % MESSAGE_NO_CURRENT_INCIDENT % incident_id)
         return None, global_msg
@@ -921,7 +1065,7 @@ def main():
     incident_df = fill_nested_fields(incident_df, incident, similar_text_field, similar_categorical_field)
 
     # Model prediction
-    model = Model(p_transformation=TRANSFORMATION)
+    model = Model(p_transformation=TRANSFORMATION, p_incident_type=incident.get('type'), p_cache_ttl=cache_ttl)
     model.init_prediction(incident_df, incidents_df, similar_text_field,
                           similar_categorical_field, display_fields, similar_json_field)
     similar_incidents, fields_used = model.predict()
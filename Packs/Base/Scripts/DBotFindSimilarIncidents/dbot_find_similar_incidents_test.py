@@ -95,6 +95,80 @@ def test_euclidian_similarity_capped():
     assert distance[1] > 0
 
 
+def test_euclidian_similarity_capped_sparse():
+    from scipy.sparse import csr_matrix
+    x = np.array([[0.5, 0, 0.5, 0], [0, 0, 0, 0], [0.1, 0.2, 0, 0.9], [0.3, 0, 0.3, 0.1]])
+    y = np.array([[0.4, 0.1, 0.5, 0]])
+    assert np.allclose(euclidian_similarity_capped(csr_matrix(x), csr_matrix(y)),
+                       euclidian_similarity_capped(x, y))
+
+
+def test_normalized_field_cache(mocker):
+    from DBotFindSimilarIncidents import NormalizedFieldCache
+    import time
+    store = {}
+
+    def execute_command(command, args):
+        if command == 'getMLModel':
+            if args['modelName'] in store:
+                return [{'Type': 1, 'Contents': {'modelData': store[args['modelName']]}}]
+            return [{'Type': 4, 'Contents': 'model not found'}]
+        store[args['modelName']] = args['modelData']
+        return [{'Type': 1, 'Contents': 'done'}]
+
+    mocker.patch.object(demisto, 'executeCommand', side_effect=execute_command)
+    normalize_function = mocker.Mock(side_effect=normalize_command_line)
+    incidents = pd.DataFrame([{'id': '1', 'commandline': 'cmd.exe /c 1.1.1.1'},
+                              {'id': '2', 'commandline': 'powershell.exe -enc abc'}])
+    cache = NormalizedFieldCache('Phishing', 'commandline', 'commandline', 1)
+    first = cache.normalize(incidents, 'commandline', normalize_function)
+    cache.store()
+    assert cache.hits == 0
+    assert normalize_function.call_count == 2
+
+    incidents.loc[1, 'commandline'] = 'powershell.exe -enc def'
+    cache = NormalizedFieldCache('Phishing', 'commandline', 'commandline', 1)
+    second = cache.normalize(incidents, 'commandline', normalize_function)
+    assert cache.hits == 1
+    assert normalize_function.call_count == 3
+    assert second[0] == first[0]
+    assert second[1] == normalize_command_line('powershell.exe -enc def')
+
+    cache.store()
+    stored_data = store['DBotFindSimilarIncidents_cache_Phishing_commandline_commandline']
+
+    # all the values are cached and recently used, so the cache is not stored again
+    cache = NormalizedFieldCache('Phishing', 'commandline', 'commandline', 1)
+    cache.normalize(incidents, 'commandline', normalize_function)
+    assert cache.hits == 2
+    assert not cache.modified
+    store.clear()
+    cache.store()
+    assert store == {}
+    store['DBotFindSimilarIncidents_cache_Phishing_commandline_commandline'] = stored_data
+
+    # the last used time of a value is updated once it is older than half the ttl
+    cache = NormalizedFieldCache('Phishing', 'commandline', 'commandline', 1)
+    cache.entries['1'][2] = time.time() - 0.75 * 3600
+    cache.normalize(incidents.iloc[[0]], 'commandline', normalize_function)
+    assert cache.modified
+    assert cache.entries['1'][2] > time.time() - 60
+
+    cache.entries['2'][2] = time.time() - 2 * 3600
+    cache.store()
+    assert list(NormalizedFieldCache('Phishing', 'commandline', 'commandline', 1).entries) == ['1']
+
+
+def test_get_cache_only_for_cached_transformations(mocker):
+    from DBotFindSimilarIncidents import Model, TRANSFORMATION, NormalizedFieldCache
+    mocker.patch.object(NormalizedFieldCache, 'load', return_value={})
+    model = Model(TRANSFORMATION, 'Phishing', 168)
+    assert isinstance(model.get_cache('json', 'CustomFields'), NormalizedFieldCache)
+    assert model.get_cache('commandline', 'commandline') is None
+    assert model.get_cache('potentialMatch', 'name') is None
+    assert Model(TRANSFORMATION, 'Phishing', None).get_cache('json', 'CustomFields') is None
+
+
 def test_main_regular(mocker):
     global SIMILAR_INDICATORS, FETCHED_INCIDENT, CURRENT_INCIDENT
     FETCHED_INCIDENT = FETCHED_INCIDENT_NOT_EMPTY
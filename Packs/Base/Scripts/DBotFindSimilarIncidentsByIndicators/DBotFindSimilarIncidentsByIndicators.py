@@ -5,9 +5,8 @@ from CommonServerUserPython import *
 from sklearn.base import BaseEstimator, TransformerMixin
 import pandas as pd
 import numpy as np
-from collections import Counter
+import scipy.sparse as sp
 import re
-import math
 
 STATUS_DICT = {
     0: "Pending",
@@ -54,38 +53,86 @@ def flatten_list(my_list: List[List]) -> List:
 class FrequencyIndicators(BaseEstimator, TransformerMixin):
     """
     FrequencyIndicators class for indicator frequencies computation
+
+    The incidents are indexed once in a sparse incidence matrix (incidents x indicators), and the score of all the
+    incidents is the product of this matrix with the weights of the current incident indicators.
     """
 
     def __init__(self, incident_field, normalize_function, current_incident):
         self.incident_field = incident_field
         self.normalize_function = normalize_function
-        self.frequency = {}
+        self.frequency = {}  # type: Dict[str, float]
+        self.words_index = {}  # type: Dict[str, int]
+        self.weights = np.zeros(0)
         if self.normalize_function:
             current_incident = current_incident[self.incident_field].apply(self.normalize_function)
         else:
             current_incident = current_incident[self.incident_field]
         self.vocabulary = current_incident.iloc[0].split(' ')
 
-    def fit(self, x):
+    def get_field_values(self, x):
         if self.normalize_function:
-            x = x[self.incident_field].apply(self.normalize_function)
-        else:
-            x = x[self.incident_field]
-        size = len(x) + 1
-        frequencies = Counter(flatten_list([t.split(' ') for t in x.values]))
-        frequencies.update(Counter(self.vocabulary))
-        self.frequency = {k: math.log(1 + size / v) for k, v in frequencies.items()}
+            return x[self.incident_field].apply(self.normalize_function)
+        return x[self.incident_field]
+
+    def get_counts_matrix(self, x, add_words=False):
+        """
+        Incidence matrix of the incidents and their indicators
+        :param x: Series of indicators strings
+        :param add_words: add the indicators which are not indexed yet, otherwise they are ignored
+        :return: csr_matrix with the number of occurrences of each indicator in each incident
+        """
+        words_index = self.words_index
+        indices = []  # type: List[int]
+        indptr = [0]
+        for indicators_string in x.values:
+            words = indicators_string.split(' ')
+            if add_words:
+                indices.extend([words_index.setdefault(word, len(words_index)) for word in words])
+            else:
+                indices.extend([column for column in map(words_index.get, words) if column is not None])
+            indptr.append(len(indices))
+        counts_matrix = sp.csr_matrix((np.ones(len(indices)), indices, indptr),
+                                      shape=(len(x), len(self.words_index)))
+        counts_matrix.sum_duplicates()
+        return counts_matrix
+
+    def fit(self, x):
+        x = self.get_field_values(x)
+        self.fit_counts_matrix(self.get_counts_matrix(x, add_words=True))
         return self
 
+    def fit_counts_matrix(self, counts_matrix):
+        size = counts_matrix.shape[0] + 1
+        counts = np.asarray(counts_matrix.sum(axis=0)).ravel()
+        vocabulary_columns = [self.words_index.setdefault(word, len(self.words_index)) for word in self.vocabulary]
+        counts = np.concatenate([counts, np.zeros(len(self.words_index) - len(counts))])
+        np.add.at(counts, vocabulary_columns, 1)
+        frequencies = np.log(1 + size / counts)
+        self.frequency = dict(zip(self.words_index.keys(), frequencies))
+        self.weights = np.zeros(len(self.words_index))
+        np.add.at(self.weights, vocabulary_columns, frequencies[vocabulary_columns])
+        self.weights /= frequencies[vocabulary_columns].sum()
+
+    def fit_transform(self, x, y=None):
+        # the incidents are indexed once, for both the frequencies and the scores
+        x = self.get_field_values(x)
+        counts_matrix = self.get_counts_matrix(x, add_words=True)
+        self.fit_counts_matrix(counts_matrix)
+        return self.get_scores(counts_matrix, x.index)
+
     def transform(self, x):
-        if self.normalize_function:
-            x = x[self.incident_field].apply(self.normalize_function)
-        else:
-            x = x[self.incident_field]
-        return x.apply(self.compute_term_score)
+        x = self.get_field_values(x)
+        return self.get_scores(self.get_counts_matrix(x), x.index)
+
+    def get_scores(self, counts_matrix, index):
+        presence_matrix = counts_matrix.copy()
+        presence_matrix.data[:] = 1
+        # the indicators of the current incident which are not in the incidents have the last columns
+        return pd.Series(presence_matrix.dot(self.weights[:presence_matrix.shape[1]]), index=index)
 
     def compute_term_score(self, indicators_values_string: str) -> float:
-        x = indicators_values_string.split(' ')
+        x = set(indicators_values_string.split(' '))
         return sum([1 * self.frequency[word] for word in self.vocabulary if word in x]) / sum(
             [self.frequency[word] for word in self.vocabulary])
 
@@ -171,7 +218,7 @@ class Model:
             t.get_score()
 
     def prepare_for_display(self):
-        vocabulary = self.incident_to_match['indicators'].iloc[0].split(' ')
+        vocabulary = set(self.incident_to_match['indicators'].iloc[0].split(' '))
         self.incidents_df['Identical indicators'] = self.incidents_df['indicators'].apply(
             lambda x: ','.join([id for id in x.split(' ') if id in vocabulary]))
 
@@ -233,8 +280,8 @@ def match_indicators_incident(indicators: List[Dict], incident_ids: List[str]) -
         inv_ids = indicator.get('investigationIDs', None)
         if inv_ids:
             for inv_id in inv_ids:
-                if inv_id in d.keys():
-                    d[inv_id] = d[inv_id] + [indicator['id']]
+                if inv_id in d:
+                    d[inv_id].append(indicator['id'])
     return d
 
 
@@ -325,12 +372,13 @@ def return_indicator_entry(incident_ids, indicators_types, indicators_list):
         return_no_mututal_indicators_found_entry()
         return indicators_df
     indicators_df = indicators_df[indicators_df['relatedIncCount'] < 150]
+    incident_ids_set = set(incident_ids)
     indicators_df['Involved Incidents Count'] = \
-        indicators_df['investigationIDs'].apply(lambda x: sum(id_ in incident_ids for id_ in x))
+        indicators_df['investigationIDs'].apply(lambda x: sum(id_ in incident_ids_set for id_ in x))
     indicators_df = indicators_df[indicators_df['Involved Incidents Count'] > 1]
     if indicators_types:
         indicators_df = indicators_df[indicators_df.indicator_type.isin(indicators_types)]
-    indicators_df = indicators_df[indicators_df.id.isin([x.get('id') for x in indicators_list])]
+    indicators_df = indicators_df[indicators_df.id.isin({x.get('id') for x in indicators_list})]
     if len(indicators_df) == 0:
         return_no_mututal_indicators_found_entry()
         return indicators_df
@@ -464,7 +512,8 @@ def get_incidents_ids_related_to_indicators(indicators):
     """
     incident_ids = [indicator.get('investigationIDs', None) for indicator in indicators if
                     indicator.get('investigationIDs', None)]
-    incident_ids = flatten_list(incident_ids)
+    # an incident shares usually more than one indicator, each one is queried once
+    incident_ids = list(dict.fromkeys(flatten_list(incident_ids)))
     p = re.compile(PLAYGROUND_PATTERN)
     incident_ids = [x for x in incident_ids if not p.match(x)]
     if not incident_ids:
@@ -92,3 +92,16 @@ def test_score(mocker):
     scores = res.values.tolist()
     assert (all(scores[i] >= scores[i + 1] for i in range(len(scores) - 1)))
     assert (all(scores[i] >= 0 for i in range(len(scores) - 1)))
+
+
+def test_score_sparse_matches_term_score():
+    normalize_function = TRANSFORMATION['indicators']['normalize']
+    incident = pd.DataFrame({'indicators': ['1 2 3 7']})
+    incidents = pd.DataFrame({'indicators': ['1 2', '1 3 3', '4 5', '', '2 3 1 6']}, index=['a', 'b', 'c', 'd', 'e'])
+    tfidf = FrequencyIndicators('indicators', normalize_function, incident)
+    scores = tfidf.fit_transform(incidents)
+    assert list(scores.index) == ['a', 'b', 'c', 'd', 'e']
+    for index, indicators in incidents['indicators'].items():
+        assert abs(scores[index] - tfidf.compute_term_score(indicators)) < 1e-9
+    assert scores['c'] == 0
+    assert scores.equals(tfidf.transform(incidents))
@@ -7,15 +7,19 @@ import demistomock as demisto
 from CommonServerPython import *
 from CommonServerUserPython import *
 import json
+import os
 import pickle
 import re
+import shutil
+import tempfile
 from nltk.tokenize import word_tokenize, sent_tokenize
 import string
 from bs4 import BeautifulSoup
 from collections import Counter
 import pandas as pd
-import signal
 import numpy as np
+import multiprocessing
+from multiprocessing.connection import wait
 import zlib
 from base64 import b64encode
 from nltk import ngrams
@@ -27,6 +31,7 @@ EXECUTION_JSON_FIELD = 'last_execution'
 VERSION_JSON_FIELD = 'script_version'
 
 MAX_ALLOWED_EXCEPTIONS = 20
+INCIDENT_TIMEOUT_SECONDS = 5
 
 NO_FETCH_EXTRACT = tldextract.TLDExtract(suffix_list_urls=None)
 NON_POSITIVE_VALIDATION_VALUES = set(['none', 'fail', 'softfail'])
@@ -52,10 +57,12 @@ FASTTEXT_PATH = '/ml/fasttext_top_20k.p'
 DOMAIN_TO_RANK_PATH = '/ml/domain_to_rank.p'
 WORD_TO_NGRAM_PATH = '/ml/word_to_ngram.p'
 WORD_TO_REGEX_PATH = '/ml/word_to_regex.p'
+RESOURCES_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'dbot_ml_fetch_data_resources')
+RESOURCES_CACHE_VERSION = 1
 
-EMBEDDING_DICT_GLOVE_50 = None
-EMBEDDING_DICT_GLOVE_100 = None
-EMBEDDING_DICT_FASTTEXT = None
+EMBEDDINGS_GLOVE_50 = None
+EMBEDDINGS_GLOVE_100 = None
+EMBEDDINGS_FASTTEXT = None
 DOMAIN_TO_RANK = None
 WORD_TO_REGEX = None
 WORD_TO_NGRAMS = None
@@ -75,23 +82,11 @@ ENVELOP_FROM_REGEX = r'(?<=envelope-from )<?[a-zA-Z0-9@_\.\+\-]+>?'
 
 IP_DOMAIN_TOKEN = 'IP_DOMAIN'
 
-'''
-Define time out functionality
-'''
+ML_FEATURES_FIELDS = ['ml_features', 'ml_features_subject', 'ml_features_body']
 
-
-class TimeoutException(Exception):  # Custom exception class
-    pass
-
-
-def timeout_handler(signum, frame):  # Custom signal handler
-    if signum or frame:
-        pass
-    raise TimeoutException
-
-
-# Change the behavior of SIGALRM
-signal.signal(signal.SIGALRM, timeout_handler)
+EXTRACTION_SUCCESS = 'success'
+EXTRACTION_SHORT_TEXT = 'short_text'
+EXTRACTION_EXCEPTION = 'exception'
 
 
 class ShortTextException(Exception):
@@ -299,38 +294,193 @@ def get_html_features(soup):
     return html_counter
 
 
+def load_array(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        # empty arrays can not be memory mapped
+        return np.load(path)
+
+
+class WordEmbeddings:
+    """
+      Word embeddings stored as a sorted vocabulary array and a float32 vectors matrix, which row i is the vector of
+      the i-th word of the vocabulary. Both arrays are memory mapped, so their pages are only read when used and are
+      shared between the worker processes and between concurrent executions.
+    """
+
+    def __init__(self, vocabulary, vectors):
+        self.vocabulary = vocabulary
+        self.vectors = vectors
+        self.size = vectors.shape[1]
+
+    @staticmethod
+    def save(word_to_vector, directory, size):
+        vocabulary = np.array(list(word_to_vector), dtype=str)
+        if len(vocabulary) > 0:
+            vectors = np.array(list(word_to_vector.values()), dtype=np.float32).reshape(len(vocabulary), -1)
+        else:
+            vectors = np.zeros((0, size), dtype=np.float32)
+        order = np.argsort(vocabulary, kind='stable')
+        np.save(os.path.join(directory, 'vocabulary.npy'), vocabulary[order])
+        np.save(os.path.join(directory, 'vectors.npy'), vectors[order])
+
+    @classmethod
+    def load(cls, directory):
+        return cls(load_array(os.path.join(directory, 'vocabulary.npy')),
+                   load_array(os.path.join(directory, 'vectors.npy')))
+
+    def __contains__(self, word):
+        return len(self.get_token_ids([word])) > 0
+
+    def get_token_ids(self, tokenized_text):
+        if len(tokenized_text) == 0 or len(self.vocabulary) == 0:
+            return np.array([], dtype=np.int64)
+        tokens = np.array(tokenized_text, dtype=str)
+        token_ids = np.minimum(np.searchsorted(self.vocabulary, tokens), len(self.vocabulary) - 1)
+        return token_ids[self.vocabulary[token_ids] == tokens]
+
+    def get_mean_vector(self, token_ids):
+        if len(token_ids) == 0:
+            return np.zeros(self.size)
+        return self.vectors[token_ids].mean(axis=0)
+
+
+class DomainRanks:
+    """
+      Domains ranks stored as the sorted utf-8 encoded domains concatenated into a single bytes array, with the
+      offsets of the domains in this array and their ranks. A domain is looked up by a binary search over the memory
+      mapped arrays, so only the few pages visited by the search are read.
+    """
+
+    def __init__(self, domains, offsets, ranks):
+        self.domains = domains
+        self.offsets = offsets
+        self.ranks = ranks
+
+    @staticmethod
+    def save(domain_to_rank, directory):
+        encoded_domains = sorted((domain.encode('utf-8', 'surrogatepass'), rank)
+                                 for domain, rank in domain_to_rank.items())
+        offsets = np.cumsum([0] + [len(domain) for domain, _ in encoded_domains], dtype=np.int64)
+        domains = np.frombuffer(b''.join(domain for domain, _ in encoded_domains), dtype=np.uint8)
+        np.save(os.path.join(directory, 'domains.npy'), domains)
+        np.save(os.path.join(directory, 'offsets.npy'), offsets)
+        np.save(os.path.join(directory, 'ranks.npy'), np.array([rank for _, rank in encoded_domains]))
+
+    @classmethod
+    def load(cls, directory):
+        return cls(load_array(os.path.join(directory, 'domains.npy')),
+                   load_array(os.path.join(directory, 'offsets.npy')),
+                   load_array(os.path.join(directory, 'ranks.npy')))
+
+    def get_domain(self, index):
+        return self.domains[self.offsets[index]:self.offsets[index + 1]].tobytes()
+
+    def get(self, domain, default=None):
+        key = domain.encode('utf-8', 'surrogatepass')
+        low, high = 0, len(self.ranks)
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_domain(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.ranks) and self.get_domain(low) == key:
+            return self.ranks[low].item()
+        return default
+
+
+def get_resource_cache_path(resource_path):
+    """
+      Returns the directory of the converted resource, named after the resource file name, size and modification
+      time so an updated resource is converted again. None is returned when the resource file can not be found.
+    """
+    try:
+        stat = os.stat(resource_path)
+    except OSError:
+        return None
+    cache_name = '{}_{}_{}_v{}'.format(os.path.basename(resource_path), stat.st_size, stat.st_mtime_ns,
+                                       RESOURCES_CACHE_VERSION)
+    return os.path.join(RESOURCES_CACHE_DIR, cache_name)
+
+
+def load_mapped_resource(resource_path, resource_class, *save_args):
+    """
+      Loads a pickled resource as memory mapped arrays. The resource is converted only on the first execution,
+      into a temporary directory which is then renamed, so concurrent executions never read a partial conversion.
+    """
+    cache_path = get_resource_cache_path(resource_path)
+    if cache_path is None or not os.path.isdir(cache_path):
+        with open(resource_path, 'rb') as file:
+            data = pickle.load(file)
+        os.makedirs(RESOURCES_CACHE_DIR, exist_ok=True)
+        converted_path = tempfile.mkdtemp(dir=RESOURCES_CACHE_DIR)
+        resource_class.save(data, converted_path, *save_args)
+        del data
+        if cache_path is None:
+            cache_path = converted_path
+        else:
+            try:
+                os.rename(converted_path, cache_path)
+            except OSError:
+                # the resource was converted by a concurrent execution
+                shutil.rmtree(converted_path, ignore_errors=True)
+    return resource_class.load(cache_path)
+
+
 def load_external_resources():
-    global EMBEDDING_DICT_GLOVE_50, EMBEDDING_DICT_GLOVE_50, EMBEDDING_DICT_GLOVE_100, EMBEDDING_DICT_FASTTEXT, \
-        DOMAIN_TO_RANK, DOMAIN_TO_RANK_PATH, WORD_TO_NGRAMS, WORD_TO_REGEX
-    with open(GLOVE_50_PATH, 'rb') as file:
-        EMBEDDING_DICT_GLOVE_50 = pickle.load(file)
-    with open(GLOVE_100_PATH, 'rb') as file:
-        EMBEDDING_DICT_GLOVE_100 = pickle.load(file)
-    with open(FASTTEXT_PATH, 'rb') as file:
-        EMBEDDING_DICT_FASTTEXT = pickle.load(file)
-    with open(DOMAIN_TO_RANK_PATH, 'rb') as file:
-        DOMAIN_TO_RANK = pickle.load(file)
+    global EMBEDDINGS_GLOVE_50, EMBEDDINGS_GLOVE_100, EMBEDDINGS_FASTTEXT, DOMAIN_TO_RANK, WORD_TO_NGRAMS, \
+        WORD_TO_REGEX
+    EMBEDDINGS_GLOVE_50 = load_mapped_resource(GLOVE_50_PATH, WordEmbeddings, 50)
+    EMBEDDINGS_GLOVE_100 = load_mapped_resource(GLOVE_100_PATH, WordEmbeddings, 100)
+    EMBEDDINGS_FASTTEXT = load_mapped_resource(FASTTEXT_PATH, WordEmbeddings, 300)
+    DOMAIN_TO_RANK = load_mapped_resource(DOMAIN_TO_RANK_PATH, DomainRanks)
     with open(WORD_TO_NGRAM_PATH, 'rb') as file:
         WORD_TO_NGRAMS = pickle.load(file)
     with open(WORD_TO_REGEX_PATH, 'rb') as file:
         WORD_TO_REGEX = pickle.load(file)
 
 
-def get_avg_embedding_vector_for_text(tokenized_text, embedding_dict, size, prefix):
-    vectors = [embedding_dict[w] for w in tokenized_text if w in embedding_dict]
-    if len(vectors) == 0:
-        mean_vector = np.zeros(size)
-    else:
-        mean_vector = np.mean(vectors, axis=0)  # type: ignore
-    res = {'{}_{}'.format(prefix, str(i)): mean_vector[i].item() for i in range(len(mean_vector))}
-    return res
+def get_embeddings_by_prefix():
+    return [('glove50', EMBEDDINGS_GLOVE_50), ('glove100', EMBEDDINGS_GLOVE_100), ('fasttext', EMBEDDINGS_FASTTEXT)]
+
+
+def get_avg_embedding_vector_for_text(tokenized_text, embeddings, prefix):
+    mean_vector = embeddings.get_mean_vector(embeddings.get_token_ids(tokenized_text))
+    return {'{}_{}'.format(prefix, str(i)): mean_vector[i].item() for i in range(len(mean_vector))}
 
 
 def get_embedding_features(tokenized_text):
-    res_glove_50 = get_avg_embedding_vector_for_text(tokenized_text, EMBEDDING_DICT_GLOVE_50, 50, 'glove50')
-    res_glove_100 = get_avg_embedding_vector_for_text(tokenized_text, EMBEDDING_DICT_GLOVE_100, 100, 'glove100')
-    res_fasttext = get_avg_embedding_vector_for_text(tokenized_text, EMBEDDING_DICT_FASTTEXT, 300, 'fasttext')
-    return {**res_glove_50, **res_glove_100, **res_fasttext}
+    res = {}
+    for prefix, embeddings in get_embeddings_by_prefix():
+        res.update(get_avg_embedding_vector_for_text(tokenized_text, embeddings, prefix))
+    return res
+
+
+def get_embedding_vectors(email_body_word_tokenized, email_subject_word_tokenized):
+    """
+      Returns the mean embedding vectors of the whole text, the subject and the body, one per row. Each row is the
+      concatenation of the mean vectors of all the embeddings, the token ids are looked up once per embedding.
+    """
+    vectors = []
+    for _, embeddings in get_embeddings_by_prefix():
+        body_ids = embeddings.get_token_ids(email_body_word_tokenized)
+        subject_ids = embeddings.get_token_ids(email_subject_word_tokenized)
+        vectors.append([embeddings.get_mean_vector(np.concatenate([body_ids, subject_ids])),
+                        embeddings.get_mean_vector(subject_ids),
+                        embeddings.get_mean_vector(body_ids)])
+    return np.array([np.concatenate(text_vectors) for text_vectors in zip(*vectors)])
+
+
+def embedding_vector_to_features(vector):
+    res = {}
+    offset = 0
+    for prefix, embeddings in get_embeddings_by_prefix():
+        for i in range(embeddings.size):
+            res['{}_{}'.format(prefix, str(i))] = vector[offset + i].item()
+        offset += embeddings.size
+    return res
 
 
 def get_header_value(email_headers, header_name, index=0, ignore_case=False):
@@ -418,10 +568,7 @@ def get_rank_address(address):
         full_domain = address.split('@')[1]
     else:
         full_domain = address
-    if full_domain in DOMAIN_TO_RANK:  # type: ignore
-        return DOMAIN_TO_RANK[full_domain]  # type: ignore
-    else:
-        return -1
+    return DOMAIN_TO_RANK.get(full_domain, -1)  # type: ignore
 
 
 def compare_values(v1, v2):
@@ -560,7 +707,7 @@ def get_closing_fields_from_incident(row):
         if isinstance(close_notes, str):
             close_notes = close_notes.strip().lower()
             close_notes_tokenized = word_tokenize(close_notes)
-            close_notes_tokenized = [token if token in EMBEDDING_DICT_FASTTEXT else hash_value(token)  # type: ignore
+            close_notes_tokenized = [token if token in EMBEDDINGS_FASTTEXT else hash_value(token)  # type: ignore
                                      for token in close_notes_tokenized]  # type: ignore
             close_notes = ' '.join(close_notes_tokenized)
 
@@ -621,9 +768,7 @@ def extract_features_from_incident(row, label_fields):
                                             email_subject_word_tokenized)
     characters_features = get_characters_features(text)
     html_feature = get_html_features(soup)
-    ml_features = get_embedding_features(email_body_word_tokenized + email_subject_word_tokenized)
-    ml_features_subject = get_embedding_features(email_subject_word_tokenized)
-    ml_features_body = get_embedding_features(email_body_word_tokenized)
+    embedding_vectors = get_embedding_vectors(email_body_word_tokenized, email_subject_word_tokenized)
     headers_features = get_headers_features(email_headers)
     url_feautres = get_url_features(email_body=email_body, email_html=email_html, soup=soup)
     attachments_features = get_attachments_features(email_attachments=email_attachments)
@@ -632,9 +777,10 @@ def extract_features_from_incident(row, label_fields):
         'lexical_features': lexical_features,
         'characters_features': characters_features,
         'html_feature': html_feature,
-        'ml_features': ml_features,
-        'ml_features_subject': ml_features_subject,
-        'ml_features_body': ml_features_body,
+        # the embedding features are kept in the embedding vectors until all the incidents are processed
+        'ml_features': None,
+        'ml_features_subject': None,
+        'ml_features_body': None,
         'headers_features': headers_features,
         'url_features': url_feautres,
         'attachments_features': attachments_features,
@@ -657,39 +803,140 @@ def extract_features_from_incident(row, label_fields):
     except Exception:
         pass
 
-    return res
+    return res, embedding_vectors
 
 
-def extract_features_from_all_incidents(incidents_df, label_fields):
-    X = []
+def extract_features_worker(incidents_df, label_fields, connection):
+    """
+      Extracts the features of the incidents which positions are sent over the connection, until None is sent.
+      The incidents data frame is inherited from the parent process, only positions and results are sent.
+    """
+    while True:
+        position = connection.recv()
+        if position is None:
+            break
+        start = time.time()
+        try:
+            result = (EXTRACTION_SUCCESS, extract_features_from_incident(incidents_df.iloc[position], label_fields))
+        except ShortTextException:
+            result = (EXTRACTION_SHORT_TEXT, None)
+        except Exception:
+            result = (EXTRACTION_EXCEPTION, traceback.format_exc())
+        try:
+            connection.send((position, result, time.time() - start))
+        except Exception:
+            connection.send((position, (EXTRACTION_EXCEPTION, traceback.format_exc()), time.time() - start))
+
+
+class FeaturesExtractionWorker:
+    def __init__(self, context, incidents_df, label_fields):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=extract_features_worker,
+                                       args=(incidents_df, label_fields, child_connection), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.position = None
+        self.deadline = None
+
+    def submit(self, position):
+        self.position = position
+        self.deadline = time.time() + INCIDENT_TIMEOUT_SECONDS
+        self.connection.send(position)
+
+    def receive(self):
+        self.position = self.deadline = None
+        return self.connection.recv()
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except Exception:
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+def extract_features_from_all_incidents(incidents_df, label_fields, max_workers=None):
+    """
+      Extracts the features of the incidents over a pool of forked worker processes. Each worker handles a single
+      incident at a time, so an incident exceeding the timeout is handled by killing its worker and starting a new one.
+      The embedding vectors of the incidents are collected in a single matrix and turned into the embedding features
+      only once all the incidents are processed.
+    """
     exceptions_log = []
     exception_indices = set()
     timeout_indices = set()
     short_text_indices = set()
-    durations = []
-    for index, row in incidents_df.iterrows():
-        signal.alarm(5)
-        try:
-            start = time.time()
-            X_i = extract_features_from_incident(row, label_fields)
-            end = time.time()
-            X.append(X_i)
-            durations.append(end - start)
-        except TimeoutException:
-            timeout_indices.add(index)
-        except ShortTextException:
-            short_text_indices.add(index)
-        except Exception:
-            exception_indices.add(index)
-            exceptions_log.append(traceback.format_exc())
-            if len(exception_indices) == MAX_ALLOWED_EXCEPTIONS:
-                break
-        finally:
-            signal.alarm(0)
+    features_by_position = {}
+    durations_by_position = {}
+    n_incidents = len(incidents_df)
+    embeddings_matrix = None
+    workers_count = max(1, min(max_workers or multiprocessing.cpu_count(), n_incidents))
+    context = multiprocessing.get_context('fork')
+    positions = iter(range(n_incidents))
+    workers = []  # type: list
+    while n_incidents > 0:
+        if len(exception_indices) < MAX_ALLOWED_EXCEPTIONS:
+            while len(workers) < workers_count:
+                workers.append(FeaturesExtractionWorker(context, incidents_df, label_fields))
+            for worker in workers:
+                if worker.position is None:
+                    position = next(positions, None)
+                    if position is None:
+                        break
+                    worker.submit(position)
+        busy_workers = [worker for worker in workers if worker.position is not None]
+        if not busy_workers:
+            break
+        timeout = max(0, min(worker.deadline for worker in busy_workers) - time.time())
+        ready_connections = wait([worker.connection for worker in busy_workers], timeout)
+        for worker in busy_workers:
+            index = incidents_df.index[worker.position]
+            if worker.connection in ready_connections:
+                try:
+                    position, (status, result), duration = worker.receive()
+                except EOFError:
+                    exception_indices.add(index)
+                    exceptions_log.append('The features extraction worker process terminated unexpectedly.')
+                    worker.kill()
+                    workers.remove(worker)
+                    continue
+                if status == EXTRACTION_SUCCESS:
+                    features, embedding_vectors = result
+                    if embeddings_matrix is None:
+                        embeddings_matrix = np.zeros((n_incidents,) + embedding_vectors.shape)
+                    embeddings_matrix[position] = embedding_vectors
+                    features_by_position[position] = features
+                    durations_by_position[position] = duration
+                elif status == EXTRACTION_SHORT_TEXT:
+                    short_text_indices.add(index)
+                else:
+                    exception_indices.add(index)
+                    exceptions_log.append(result)
+            elif time.time() >= worker.deadline:
+                timeout_indices.add(index)
+                worker.kill()
+                workers.remove(worker)
+    for worker in workers:
+        worker.stop()
+
+    X = []
+    for position in sorted(features_by_position):
+        features = features_by_position[position]
+        for field, embedding_vector in zip(ML_FEATURES_FIELDS, embeddings_matrix[position]):  # type: ignore
+            features[field] = embedding_vector_to_features(embedding_vector)
+        X.append(features)
+    durations = [durations_by_position[position] for position in sorted(durations_by_position)]
     return X, Counter(exceptions_log).most_common(), short_text_indices, exception_indices, timeout_indices, durations
 
 
-def extract_data_from_incidents(incidents, input_label_field=None):
+def extract_data_from_incidents(incidents, input_label_field=None, max_workers=None):
     incidents_df = pd.DataFrame(incidents)
     if 'created' in incidents_df:
         incidents_df['created'] = incidents_df['created'].apply(lambda x: dateutil.parser.parse(x))  # type: ignore
@@ -741,7 +988,7 @@ def extract_data_from_incidents(incidents, input_label_field=None):
     else:
         load_external_resources()
         X, exceptions_log, short_text_indices, exception_indices, timeout_indices, durations \
-            = extract_features_from_all_incidents(incidents_df, label_fields)
+            = extract_features_from_all_incidents(incidents_df, label_fields, max_workers)
 
     return {'X': X,
             'n_fetched_incidents': len(X),
@@ -839,7 +1086,8 @@ def main():
         demisto.results('No results were found')
     else:
         tag_field = demisto.args().get('tagField', None)
-        data = extract_data_from_incidents(incidents, tag_field)
+        max_workers = int(demisto.args().get('maxWorkers') or multiprocessing.cpu_count())
+        data = extract_data_from_incidents(incidents, tag_field, max_workers)
         data_str = json.dumps(data)
         compress = demisto.args().get('compress', 'True') == 'True'
         if compress:
@@ -6,6 +6,12 @@ import string
 from bs4 import BeautifulSoup
 import math
 import pandas as pd
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def resources_cache_dir(mocker, tmp_path):
+    mocker.patch('DBotMLFetchData.RESOURCES_CACHE_DIR', str(tmp_path / 'resources'))
 
 
 def test_find_label_fields_candidates():
@@ -39,6 +45,39 @@ def test_get_ml_features(mocker):
     assert featurs['glove50_1'] == -0.5
 
 
+def test_load_mapped_resource(mocker, tmp_path):
+    resource_path = str(tmp_path / 'domain_to_rank.p')
+    with open('test_data/domain_to_rank_top_5.p', 'rb') as source, open(resource_path, 'wb') as target:
+        target.write(source.read())
+    domain_ranks = load_mapped_resource(resource_path, DomainRanks)
+    assert domain_ranks.get('google.com') == 1
+    assert domain_ranks.get('facebook.com') == 5
+    assert domain_ranks.get('facebook.co', -1) == -1
+    assert domain_ranks.get('zzz.com', -1) == -1
+
+    # the converted resource is reused by the next executions
+    pickle_load = mocker.patch.object(pickle, 'load')
+    domain_ranks = load_mapped_resource(resource_path, DomainRanks)
+    assert pickle_load.call_count == 0
+    assert isinstance(domain_ranks.offsets, np.memmap)
+    assert domain_ranks.get('baidu.com') == 4
+
+
+def test_word_embeddings_token_ids(mocker):
+    mocker.patch('DBotMLFetchData.open', mock_read_func)
+    embeddings = load_mapped_resource(GLOVE_50_PATH, WordEmbeddings, 50)
+    with open('test_data/glove_50_top_10.p', 'rb') as file:
+        word_to_vector = pickle.load(file)
+    words = list(word_to_vector)
+    text = [words[3], 'not-in-vocabulary', words[0], words[3]]
+    token_ids = embeddings.get_token_ids(text)
+    assert [embeddings.vocabulary[i] for i in token_ids] == [words[3], words[0], words[3]]
+    assert (embeddings.vectors[token_ids[1]] == word_to_vector[words[0]]).all()
+    assert words[0] in embeddings
+    assert 'not-in-vocabulary' not in embeddings
+    assert len(embeddings.get_token_ids([])) == 0
+
+
 def test_get_ngrams_features(mocker):
     mocker.patch('DBotMLFetchData.open', mock_read_func)
     load_external_resources()
@@ -434,6 +473,39 @@ def test_whole_preprocessing_incdient_without_label(mocker):
         [inc['closeReason'] for i, inc in enumerate(incidents) if i != no_label_idx])
 
 
+def test_whole_preprocessing_multiple_workers(mocker):
+    mocker.patch('DBotMLFetchData.open', mock_read_func)
+    data_file_path = 'test_data/100_incidents.p'
+    with open(data_file_path, 'rb') as file:
+        incidents = pickle.load(file)
+    data = extract_data_from_incidents(incidents=incidents, max_workers=1)
+    data_multiple_workers = extract_data_from_incidents(incidents=incidents, max_workers=4)
+    assert len(data_multiple_workers['log']['exceptions']) == 0
+    assert json.dumps(data_multiple_workers['X']) == json.dumps(data['X'])
+
+
+def test_whole_preprocessing_incident_timeout(mocker):
+    import time
+    import DBotMLFetchData
+    mocker.patch('DBotMLFetchData.open', mock_read_func)
+    data_file_path = 'test_data/100_incidents.p'
+    with open(data_file_path, 'rb') as file:
+        incidents = pickle.load(file)[:10]
+    original_extract_features_from_incident = DBotMLFetchData.extract_features_from_incident
+
+    def slow_extract_features_from_incident(row, label_fields):
+        if row['id'] == incidents[3]['id']:
+            time.sleep(5)
+        return original_extract_features_from_incident(row, label_fields)
+
+    mocker.patch.object(DBotMLFetchData, 'INCIDENT_TIMEOUT_SECONDS', 0.5)
+    mocker.patch.object(DBotMLFetchData, 'extract_features_from_incident', slow_extract_features_from_incident)
+    data = extract_data_from_incidents(incidents=incidents, max_workers=2)
+    assert data['log']['n_timout'] == 1
+    assert len(data['X']) == 9
+    assert [x['id'] for x in data['X']] == [inc['id'] for i, inc in enumerate(incidents) if i != 3]
+
+
 def test_find_forwarded_features():
     assert find_forwarded_features('RE- Are you free to discuss?', '')['response']
     assert not find_forwarded_features('Are you free to discuss?', '')['response']
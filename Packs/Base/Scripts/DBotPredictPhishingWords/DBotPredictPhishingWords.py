@@ -15,26 +15,23 @@ def OrderedSet(iterable):
 
 
 def get_model_data(model_name, store_type, is_return_error):
-    res_model_list = demisto.executeCommand("getList", {"listName": model_name})[0]
-    res_model = demisto.executeCommand("getMLModel", {"modelName": model_name})[0]
-    if is_error(res_model_list) and not is_error(res_model):
-        model_data = res_model['Contents']['modelData']
-        try:
-            model_type = res_model['Contents']['model']["type"]["type"]
-            return model_data, model_type
-        except Exception:
-            return model_data, UNKNOWN_MODEL_TYPE
-    elif not is_error(res_model_list) and is_error(res_model):
-        return res_model_list["Contents"], UNKNOWN_MODEL_TYPE
-    elif not is_error(res_model_list) and not is_error(res_model):
-        if store_type == "list":
-            return res_model_list["Contents"], UNKNOWN_MODEL_TYPE
-        elif store_type == "mlModel":
-            model_data = res_model['Contents']['modelData']
-            model_type = res_model['Contents']['model']["type"]["type"]
-            return model_data, model_type
-    else:
-        handle_error("error reading model %s from Demisto" % model_name, is_return_error)
+    # the store of store_type is read first, the other one only if the model is not found there
+    stores = ['mlModel', 'list'] if store_type == 'mlModel' else ['list', 'mlModel']
+    for store in stores:
+        if store == 'list':
+            res_model_list = demisto.executeCommand("getList", {"listName": model_name})[0]
+            if not is_error(res_model_list):
+                return res_model_list["Contents"], UNKNOWN_MODEL_TYPE
+        else:
+            res_model = demisto.executeCommand("getMLModel", {"modelName": model_name})[0]
+            if not is_error(res_model):
+                model_data = res_model['Contents']['modelData']
+                try:
+                    model_type = res_model['Contents']['model']["type"]["type"]
+                    return model_data, model_type
+                except Exception:
+                    return model_data, UNKNOWN_MODEL_TYPE
+    handle_error("error reading model %s from Demisto" % model_name, is_return_error)
 
 
 def handle_error(message, is_return_error):
@@ -113,7 +110,11 @@ def predict_batch_incidents_light_output(email_subject, email_body, phishing_mod
     text_list = [{'text': "%s \n%s" % (subject, body)} for subject, body in zip(email_subject, email_body)]
     preprocessed_text_list = preprocess_text(text_list, model_type, is_return_error=False)
     batch_predictions = []
+    predictions_by_text = {}  # type: Dict[str, Dict[str, Any]]
     for input_text in preprocessed_text_list:
+        if input_text in predictions_by_text:
+            batch_predictions.append(dict(predictions_by_text[input_text]))
+            continue
         incident_res = {'Label': -1, 'Probability': -1, 'Error': ''}
         filtered_text, filtered_text_number_of_words = phishing_model.filter_model_words(input_text)
         if filtered_text_number_of_words == 0:
@@ -127,7 +128,8 @@ def predict_batch_incidents_light_output(email_subject, email_body, phishing_mod
             if isinstance(prob, np.floating):
                 prob = prob.item()
             incident_res['Probability'] = prob
-        batch_predictions.append(incident_res)
+        predictions_by_text[input_text] = incident_res
+        batch_predictions.append(dict(incident_res))
     return {
         'Type': entryTypes['note'],
         'Contents': batch_predictions,
@@ -221,6 +223,20 @@ def try_get_incident_field(field):
     return value
 
 
+def get_batch_input(batch_input):
+    """
+    Parse the batchInput argument
+    :param batch_input: JSON list of objects with emailSubject and emailBody (or emailBodyHTML) keys
+    :return: list of email subjects, list of email bodies
+    """
+    emails = json.loads(batch_input) if isinstance(batch_input, str) else batch_input
+    if not isinstance(emails, list):
+        emails = [emails]
+    email_subjects = [email.get('emailSubject') or '' for email in emails]
+    email_bodies = [email.get('emailBody') or email.get('emailBodyHTML') or '' for email in emails]
+    return email_subjects, email_bodies
+
+
 def main():
     confidence_threshold = 0
     confidence_threshold = float(demisto.args().get("labelProbabilityThreshold", confidence_threshold))
@@ -231,6 +247,8 @@ def main():
         email_subject = try_get_incident_field(field='emailsubject')
     if email_body == '':
         email_body = try_get_incident_field(field='emailbody')
+    if demisto.args().get('batchInput'):
+        email_subject, email_body = get_batch_input(demisto.args()['batchInput'])
     result = predict_phishing_words(demisto.args()['modelName'],
                                     demisto.args()['modelStoreType'],
                                     email_subject,
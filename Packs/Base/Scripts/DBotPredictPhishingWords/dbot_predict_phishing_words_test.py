@@ -1,5 +1,6 @@
 from collections import defaultdict
 
+import numpy as np
 import pytest
 
 from CommonServerPython import *
@@ -316,3 +317,36 @@ def test_no_positive_words(mocker):
 
     res = main()
     assert res['Contents']['TextTokensHighlighted'] == TOKENIZATION_RESULT['originalText']
+
+
+def test_get_model_data_single_store(mocker):
+    execute_command = mocker.patch.object(demisto, 'executeCommand', side_effect=executeCommand)
+    get_model_data("test", "mlModel", True)
+    assert [call[0][0] for call in execute_command.call_args_list] == ['getMLModel']
+
+
+def test_main_batch_input(mocker):
+    phishing_mock = PhishingModelMock()
+    emails = [{'emailSubject': 'word1', 'emailBody': 'word2'},
+              {'emailSubject': 'word3', 'emailBody': ''},
+              {'emailSubject': 'word1', 'emailBody': 'word2'}]
+    args = {'modelName': 'modelName', 'modelStoreType': 'list', 'batchInput': json.dumps(emails),
+            'minTextLength': '0', 'labelProbabilityThreshold': '0', 'wordThreshold': '0', 'topWordsLimit': '10',
+            'returnError': 'true'}
+    mocker.patch.object(demisto, 'args', return_value=args)
+    mocker.patch.object(demisto, 'incidents', return_value=[{'isPlayground': True}])
+
+    def execute_command(command, args=None):
+        if command == 'DBotPreProcessTextData':
+            texts = json.loads(args['input'])
+            return [{'Contents': json.dumps([{'dbot_processed_text': x['text']} for x in texts]), 'Type': 'note'}]
+        return executeCommand(command, args)
+
+    mocker.patch.object(demisto, 'executeCommand', side_effect=execute_command)
+    mocker.patch('demisto_ml.phishing_model_loads_handler', return_value=phishing_mock, create=True)
+    mocker.patch.object(phishing_mock, 'filter_model_words', return_value=("text", 2), create=True)
+    predict = mocker.patch.object(phishing_mock, 'predict', return_value=('Valid', np.float32(0.5)), create=True)
+
+    res = main()
+    assert res['Contents'] == [{'Label': 'Valid', 'Probability': 0.5, 'Error': ''}] * 3
+    assert predict.call_count == 2
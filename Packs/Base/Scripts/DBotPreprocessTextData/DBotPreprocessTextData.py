@@ -2,10 +2,13 @@
 from CommonServerUserPython import *
 from CommonServerPython import *
 from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.random_projection import SparseRandomProjection
+import numpy as np
 import pickle
 import uuid
 import spacy
 import string
+from bisect import bisect_right
 from html.parser import HTMLParser
 from html import unescape
 from re import compile as _Re
@@ -52,7 +55,7 @@ class Tokenizer:
     def __init__(self, clean_html=True, remove_new_lines=True, hash_seed=None, remove_non_english=True,
                  remove_stop_words=True, remove_punct=True, remove_non_alpha=True, replace_emails=True,
                  replace_numbers=True, lemma=True, replace_urls=True, language='English',
-                 tokenization_method='byWords'):
+                 tokenization_method='byWords', batch_size=1000, n_process=1):
         self.number_pattern = "NUMBER_PATTERN"
         self.url_pattern = "URL_PATTERN"
         self.email_pattern = "EMAIL_PATTERN"
@@ -70,6 +73,8 @@ class Tokenizer:
         self.lemma = lemma
         self.language = language
         self.tokenization_method = tokenization_method
+        self.batch_size = batch_size
+        self.n_process = n_process
         self.max_text_length = 10 ** 5
 
         self.nlp = None
@@ -83,25 +88,22 @@ class Tokenizer:
                                          'Italian': 'it_core_news_sm',
                                          'Dutch': 'nl_core_news_sm'
                                          }
-        self.spacy_count = 0
-        self.spacy_reset_count = 500
 
     def handle_long_text(self):
         return '', ''
 
-    def map_indices_to_words(self, text):
-        original_text_indices_to_words = {}
-        word_start = 0
-        while word_start < len(text) and text[word_start].isspace():
-            word_start += 1
-        for word in text.split():
-            for char_idx, char in enumerate(word):
-                original_text_indices_to_words[word_start + char_idx] = word
-            # find beginning of next word
-            word_start += len(word)
-            while word_start < len(text) and text[word_start].isspace():
-                word_start += 1
-        return original_text_indices_to_words
+    def map_word_starts(self, text):
+        """
+        Map the words of the text to their start index, the word of a character index is found with bisect
+        :param text: text
+        :return: sorted list of the words start indices, list of the words
+        """
+        word_starts = []
+        words = []
+        for match in re.finditer(r'\S+', text):
+            word_starts.append(match.start())
+            words.append(match.group())
+        return word_starts, words
 
     def remove_line_breaks(self, text):
         return text.replace("\r", " ").replace("\n", " ")
@@ -118,6 +120,30 @@ class Tokenizer:
         tokenized_text = ' '.join(tokens_list).strip()
         return tokenized_text, original_words_to_tokens
 
+    def tokenize_texts(self, texts):
+        """
+        Tokenize the texts, passing them to the spaCy model in batches of batch_size texts
+        :param texts: list of texts
+        :return: generator of (tokenized text, original words to tokens) for each text
+        """
+        if self.language not in self.languages_to_model_names:
+            for text in texts:
+                if len(text) < self.max_text_length:
+                    yield self.handle_tokenizaion_method(text)
+                else:
+                    yield self.handle_long_text()
+            return
+        if self.nlp is None:
+            self.init_spacy_model(self.language)
+        docs = self.nlp.pipe((text for text in texts if len(text) < self.max_text_length),  # type: ignore
+                             batch_size=self.batch_size, n_process=self.n_process)
+        for text in texts:
+            if len(text) < self.max_text_length:
+                tokens_list, original_words_to_tokens = self.tokenize_doc_spacy(next(docs), text)
+                yield ' '.join(tokens_list).strip(), original_words_to_tokens
+            else:
+                yield self.handle_long_text()
+
     def tokenize_text_other(self, text):
         tokens_list = []
         tokenization_method = self.tokenization_method
@@ -137,11 +163,13 @@ class Tokenizer:
         return tokens_list, original_words_to_tokens
 
     def tokenize_text_spacy(self, text):
-        if self.nlp is None or self.spacy_count % self.spacy_reset_count == 0:
+        if self.nlp is None:
             self.init_spacy_model(self.language)
         doc = self.nlp(text)  # type: ignore
-        self.spacy_count += 1
-        original_text_indices_to_words = self.map_indices_to_words(text)
+        return self.tokenize_doc_spacy(doc, text)
+
+    def tokenize_doc_spacy(self, doc, text):
+        word_starts, words = self.map_word_starts(text)
         tokens_list = []
         original_words_to_tokens = {}  # type: ignore
         for word in doc:
@@ -167,7 +195,7 @@ class Tokenizer:
                 else:
                     token_to_add = word.lower_
                 tokens_list.append(token_to_add)
-                original_word = original_text_indices_to_words[word.idx]
+                original_word = words[bisect_right(word_starts, word.idx) - 1]
                 if original_word not in original_words_to_tokens:
                     original_words_to_tokens[original_word] = []
                 original_words_to_tokens[original_word].append(token_to_add)
@@ -185,7 +213,8 @@ class Tokenizer:
     def word_tokenize(self, text):
         if not isinstance(text, list):
             text = [text]
-        result = []
+        original_texts = []
+        texts_to_tokenize = []
         for t in text:
             original_text = t
             if self.remove_new_lines:
@@ -193,11 +222,11 @@ class Tokenizer:
             if self.clean_html:
                 t = clean_html_from_text(t)
                 original_text = t
-            t = self.remove_multiple_whitespaces(t)
-            if len(t) < self.max_text_length:
-                tokenized_text, original_words_to_tokens = self.handle_tokenizaion_method(t)
-            else:
-                tokenized_text, original_words_to_tokens = self.handle_long_text()
+            original_texts.append(original_text)
+            texts_to_tokenize.append(self.remove_multiple_whitespaces(t))
+        result = []
+        for original_text, (tokenized_text, original_words_to_tokens) in zip(original_texts,
+                                                                             self.tokenize_texts(texts_to_tokenize)):
             text_result = create_text_result(original_text, tokenized_text, original_words_to_tokens,
                                              hash_seed=self.hash_seed)
             result.append(text_result)
@@ -219,6 +248,15 @@ HTML_PATTERNS = [
 ]
 html_parser = HTMLParser()
 tokenizer = None
+# duplicates are searched exhaustively up to this number of distinct samples, and with LSH above it
+DEDUP_EXACT_MAX_SAMPLES = 5000
+DEDUP_BLOCK_SIZE = 1000
+DEDUP_PAIRS_BLOCK_SIZE = 100000
+DEDUP_LSH_MAX_PAIRWISE_BUCKET_SIZE = 32
+DEDUP_LSH_BANDS = 16
+DEDUP_LSH_MAX_ROWS = 32
+DEDUP_LSH_RECALL = 0.99
+DEDUP_LSH_SEED = 0
 
 
 def read_file(input_data, input_type):
@@ -279,9 +317,15 @@ def pre_process_batch(data, source_text_field, target_text_field, remove_html_ta
     if remove_html_tags:
         raw_text_data = [clean_html_from_text(x) for x in raw_text_data]
     raw_text_data = [remove_line_breaks(x) for x in raw_text_data]
+    if pre_process_type == 'nlp':
+        # the tokenizer processes all the texts together, in batches
+        tokenized_texts = pre_process_tokenizer(raw_text_data, hash_seed)
+        if not isinstance(tokenized_texts, list):
+            tokenized_texts = [tokenized_texts]
+    else:
+        tokenized_texts = [pre_process_single_text(raw_text, hash_seed, pre_process_type) for raw_text in raw_text_data]
     tokenized_text_data = []
-    for raw_text in raw_text_data:
-        tokenized_text = pre_process_single_text(raw_text, hash_seed, pre_process_type)
+    for tokenized_text in tokenized_texts:
         if hash_seed is None:
             tokenized_text_data.append(tokenized_text['tokenizedText'])
         else:
@@ -301,7 +345,9 @@ def pre_process_tokenizer(text, seed):
     global tokenizer
     if tokenizer is None:
         tokenizer = Tokenizer(tokenization_method=demisto.args()['tokenizationMethod'],
-                              language=demisto.args()['language'], hash_seed=seed)
+                              language=demisto.args()['language'], hash_seed=seed,
+                              batch_size=int(demisto.args().get('batchSize') or 1000),
+                              n_process=int(demisto.args().get('numberOfProcesses') or 1))
     processed_text = tokenizer.word_tokenize(text)
     return processed_text
 
@@ -334,20 +380,124 @@ def remove_short_text(data, text_field, target_text_field, remove_short_threshol
     return data, description
 
 
-def get_tf_idf_similarity_arr(documents):
-    tfidf = TfidfVectorizer(stop_words="english", min_df=1).fit_transform(documents)
-    pairwise_similarity = tfidf * tfidf.T
-    return pairwise_similarity.toarray()
+def get_tf_idf_vectors(documents):
+    return TfidfVectorizer(stop_words="english", min_df=1).fit_transform(documents)
+
+
+def find_similar_to_previous(tfidf, indices, dedup_threshold):
+    """
+    Find the samples which are more similar than dedup_threshold to a previous sample, without building the
+    dense similarity matrix
+    :param tfidf: sparse matrix of the l2 normalized TF-IDF vectors
+    :param indices: sorted array of the rows of tfidf to compare
+    :param dedup_threshold: similarity threshold
+    :return: set of the rows j from indices with a row i < j from indices more similar than dedup_threshold
+    """
+    duplicate_indices = set()
+    vectors = tfidf[indices]
+    for start in range(0, len(indices), DEDUP_BLOCK_SIZE):
+        similarity = (vectors[start:start + DEDUP_BLOCK_SIZE] * vectors.T).tocoo()
+        mask = (similarity.col > similarity.row + start) & (similarity.data > dedup_threshold)
+        duplicate_indices.update(indices[similarity.col[mask]].tolist())
+    return duplicate_indices
+
+
+def get_lsh_band_keys(tfidf, dedup_threshold):
+    """
+    Compute the LSH band keys of the samples with random hyperplanes signatures, so that two samples with a cosine
+    similarity of dedup_threshold share at least one band key with a probability of DEDUP_LSH_RECALL
+    :param tfidf: sparse matrix of the l2 normalized TF-IDF vectors
+    :param dedup_threshold: similarity threshold
+    :return: array of shape (number of samples, DEDUP_LSH_BANDS) of the band keys
+    """
+    bit_collision_probability = 1 - np.arccos(np.clip(dedup_threshold, -1, 1)) / np.pi
+    band_collision_probability = 1 - (1 - DEDUP_LSH_RECALL) ** (1.0 / DEDUP_LSH_BANDS)
+    rows = int(np.clip(np.log(band_collision_probability) / np.log(bit_collision_probability),
+                       1, DEDUP_LSH_MAX_ROWS))
+    projection = SparseRandomProjection(n_components=DEDUP_LSH_BANDS * rows, dense_output=True,
+                                        random_state=DEDUP_LSH_SEED).fit(tfidf)
+    powers = 2 ** np.arange(rows, dtype=np.int64)
+    keys = np.empty((tfidf.shape[0], DEDUP_LSH_BANDS), dtype=np.int64)
+    for start in range(0, tfidf.shape[0], DEDUP_BLOCK_SIZE):
+        bits = projection.transform(tfidf[start:start + DEDUP_BLOCK_SIZE]) > 0
+        keys[start:start + DEDUP_BLOCK_SIZE] = bits.reshape(-1, DEDUP_LSH_BANDS, rows).dot(powers)
+    return keys
+
+
+def find_similar_pairs(tfidf, pairs, dedup_threshold):
+    """
+    Find the second samples of the pairs which are more similar than dedup_threshold
+    :param tfidf: sparse matrix of the l2 normalized TF-IDF vectors
+    :param pairs: array of shape (number of pairs, 2) of rows i < j
+    :param dedup_threshold: similarity threshold
+    :return: set of the rows j more similar than dedup_threshold to their row i
+    """
+    duplicate_indices = set()
+    for start in range(0, len(pairs), DEDUP_PAIRS_BLOCK_SIZE):
+        block = pairs[start:start + DEDUP_PAIRS_BLOCK_SIZE]
+        similarity = np.asarray(tfidf[block[:, 0]].multiply(tfidf[block[:, 1]]).sum(axis=1)).ravel()
+        duplicate_indices.update(block[similarity > dedup_threshold, 1].tolist())
+    return duplicate_indices
+
+
+def find_duplicate_indices_lsh(tfidf, dedup_threshold):
+    """
+    Find the samples which are more similar than dedup_threshold to a previous sample, comparing only the samples
+    which share an LSH bucket
+    :param tfidf: sparse matrix of the l2 normalized TF-IDF vectors
+    :param dedup_threshold: similarity threshold
+    :return: set of the duplicate rows
+    """
+    # no two samples are more similar than 1
+    if dedup_threshold >= 1:
+        return set()
+    keys = get_lsh_band_keys(tfidf, dedup_threshold)
+    duplicate_indices = set()
+    candidate_pairs = []
+    for band in range(DEDUP_LSH_BANDS):
+        # stable sort keeps the samples of each bucket in ascending order
+        order = np.argsort(keys[:, band], kind='stable')
+        band_keys = keys[order, band]
+        is_bucket_start = np.r_[True, band_keys[1:] != band_keys[:-1]]
+        starts = np.flatnonzero(is_bucket_start)
+        sizes = np.diff(np.r_[starts, len(order)])
+        # small buckets are compared pairwise, all together, and large buckets by blocks
+        for start, size in zip(starts[sizes > DEDUP_LSH_MAX_PAIRWISE_BUCKET_SIZE],
+                               sizes[sizes > DEDUP_LSH_MAX_PAIRWISE_BUCKET_SIZE]):
+            duplicate_indices.update(find_similar_to_previous(tfidf, order[start:start + size], dedup_threshold))
+        buckets = np.cumsum(is_bucket_start)
+        is_pairwise = np.repeat(sizes <= DEDUP_LSH_MAX_PAIRWISE_BUCKET_SIZE, sizes)
+        for offset in range(1, min(DEDUP_LSH_MAX_PAIRWISE_BUCKET_SIZE, sizes.max())):
+            same_bucket = (buckets[:-offset] == buckets[offset:]) & is_pairwise[offset:]
+            candidate_pairs.append(np.column_stack((order[:-offset][same_bucket], order[offset:][same_bucket])))
+    if candidate_pairs:
+        pairs = np.unique(np.concatenate(candidate_pairs), axis=0)
+        duplicate_indices.update(find_similar_pairs(tfidf, pairs, dedup_threshold))
+    return duplicate_indices
 
 
 def find_duplicate_indices(texts, dedup_threshold):
-    similarity_arr = get_tf_idf_similarity_arr(texts)
-    indices_to_remove = []
-    for i in range(similarity_arr.shape[0]):
-        for j in range(similarity_arr.shape[1]):
-            if j > i and similarity_arr[i][j] > dedup_threshold:
-                indices_to_remove.append(j)
-    return set(indices_to_remove)
+    # the similarities are between -1 and 1, so no sample is a duplicate above 1 and all are below -1
+    if dedup_threshold >= 1:
+        return set()
+    dedup_threshold = max(dedup_threshold, -1)
+    tfidf = get_tf_idf_vectors(texts)
+    # identical texts are duplicates of their first occurrence, unless they have no vocabulary at all
+    first_occurrences = {}  # type: ignore
+    duplicate_indices = set()
+    for i in np.flatnonzero(tfidf.getnnz(axis=1)).tolist():
+        if texts[i] in first_occurrences:
+            duplicate_indices.add(i)
+        else:
+            first_occurrences[texts[i]] = i
+    unique_indices = np.array(sorted(first_occurrences.values()), dtype=np.int64)
+    if len(unique_indices) <= DEDUP_EXACT_MAX_SAMPLES:
+        unique_duplicate_indices = find_similar_to_previous(tfidf[unique_indices], np.arange(len(unique_indices)),
+                                                            dedup_threshold)
+    else:
+        unique_duplicate_indices = find_duplicate_indices_lsh(tfidf[unique_indices], dedup_threshold)
+    duplicate_indices.update(unique_indices[list(unique_duplicate_indices)].tolist())
+    return duplicate_indices
 
 
 def remove_duplicate_by_indices(data, duplicate_indices):
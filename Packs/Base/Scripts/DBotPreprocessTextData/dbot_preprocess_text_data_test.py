@@ -3,8 +3,9 @@ import unittest
 from CommonServerPython import *
 from DBotPreprocessTextData import clean_html_from_text, remove_line_breaks, hash_word, \
     concat_text_fields, whitelist_dict_fields, remove_short_text, remove_duplicate_by_indices, pre_process_batch, main, \
-    read_file, Tokenizer
+    read_file, Tokenizer, find_duplicate_indices
 import string
+import pytest
 
 from copy import deepcopy
 import pandas as pd
@@ -124,6 +125,32 @@ def test_remove_dups():
     assert len(data) == 2
 
 
+@pytest.mark.parametrize('exact_max_samples', [5000, 0])
+def test_find_duplicate_indices(mocker, exact_max_samples):
+    mocker.patch('DBotPreprocessTextData.DEDUP_EXACT_MAX_SAMPLES', exact_max_samples)
+    texts = [
+        'phishing email asking to reset the account password',
+        'quarterly report attached for review',
+        'phishing email asking to reset the account password',
+        'phishing email asking to verify your bank details',
+        'the',
+        'the',
+        'invoice payment overdue please pay',
+    ]
+    assert find_duplicate_indices(texts, 0.99) == {2}
+    assert find_duplicate_indices(texts, 0.3) == {2, 3}
+    assert find_duplicate_indices(texts, 1) == set()
+    assert find_duplicate_indices(texts, 1.5) == set()
+
+
+def test_find_duplicate_indices_lsh_threshold_out_of_range():
+    from DBotPreprocessTextData import find_duplicate_indices_lsh, get_lsh_band_keys, get_tf_idf_vectors
+    tfidf = get_tf_idf_vectors(['phishing email reset password', 'phishing email reset password now', 'invoice'])
+    assert find_duplicate_indices_lsh(tfidf, 1) == set()
+    assert find_duplicate_indices_lsh(tfidf, 1.5) == set()
+    assert get_lsh_band_keys(tfidf, -1.5).shape[0] == 3
+
+
 def test_pre_process():
     data = [
         {
@@ -401,6 +428,20 @@ I have 3 dogs
                     "don't": ['do', "n't"], 'live': ['live'], 'in': ['in'], 'Petach': ['petach'], 'Tikva': ['tikva']}
         assert res1['originalWordsToTokens'] == expected
 
+    def test_batch_tokenize(self):
+        texts = ["I'm 29 years old", 'example  sentence', "I don't live in Petach Tikva", 'x' * 20]
+        t1 = Tokenizer(batch_size=2, **neagative_initalization)
+        t1.max_text_length = 19
+        res1 = t1.word_tokenize(texts)
+        t2 = Tokenizer(**neagative_initalization)
+        t2.max_text_length = 19
+        assert res1 == [t2.word_tokenize(text) for text in texts]
+        assert res1[3]['tokenizedText'] == ''
+
+    def test_map_word_starts(self):
+        t1 = Tokenizer(**neagative_initalization)
+        assert t1.map_word_starts(' I am  here') == ([1, 3, 7], ['I', 'am', 'here'])
+
 
 def test_read_file(mocker):
     mocker.patch.object(demisto, 'getFilePath', return_value={'path': './TestData/input_json_file_test'})
@@ -5,6 +5,7 @@ from CommonServerUserPython import *
 import pandas as pd
 import numpy as np
 import collections
+import zlib
 import dill as pickle
 import builtins
 from sklearn.pipeline import Pipeline
@@ -13,6 +14,7 @@ from sklearn import cluster
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.manifold import TSNE
+from scipy.spatial.distance import cdist
 import hdbscan
 from datetime import datetime
 from typing import Type, Tuple
@@ -28,6 +30,8 @@ MESSAGE_WARNING_TRUNCATED = "- Incidents fetched have been truncated to %s. plea
 MESSAGE_CLUSTERING_NOT_VALID = "Clustering cannot be created with this dataset"
 MESSAGE_INCORRECT_FIELD = "- %s field(s) don't/doesn't exist within the fetched incidents."
 MESSAGE_INVALID_FIELD = "- %s field(s) has/have too many missing values and won't be used in the model."
+MESSAGE_INCREMENTAL_REFIT = "- The model has been retrained because %s%% of the new incidents were not close to any " \
+                            "group and the new incidents represent %s%% of the training incidents."
 MESSAGE_NO_FIELD_NAME_OR_CLUSTERING = "- Empty or incorrect fieldsForClustering " \
                                       "for training OR fieldForClusterName is incorrect."
 
@@ -47,6 +51,10 @@ UNKNOWN_MODEL_TYPE = 'UNKNOWN_MODEL_TYPE'
 MESSAGE_ERROR_MESSAGE = 'Model cannot be loaded'
 CLUSTERING_STEP_PIPELINE = 'clustering'
 PREPROCESSOR_STEP_PIPELINE = 'preprocessor'
+MODEL_FORMAT_VERSION = 1
+MODEL_CENTERS_DECIMALS = 6
+MODEL_RADIUS_TOLERANCE = 1e-4
+DATE_TRAINING_FORMAT = "%m/%d/%Y %H:%M:%S"
 
 PALETTE_COLOR = ['0048BA', '#B0BF1A	', '#7CB9E8	', '#B284BE	', '#E52B50', '#FFBF00', '#665D1E', '#8DB600',
                  '#D0FF14']
@@ -190,7 +198,7 @@ class PostProcessing(object):
         self.stats = {}  # type: ignore
         self.statistics()
         self.compute_dist()
-        self.date_training = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
+        self.date_training = datetime.now().strftime(DATE_TRAINING_FORMAT)
         self.summary = None  # type: ignore
         self.global_msg = None  # type: ignore
         self.json = None  # type: ignore
@@ -259,6 +267,185 @@ class PostProcessing(object):
         self.selected_clusters = dist_total
 
 
+class ClusteringModelArtifact(object):
+    """
+    Compact and versioned model stored in demisto. Contrary to PostProcessing, it doesn't hold the training data nor
+    the fitted clustering model but only the centers of the clusters, their names and statistics and the vocabularies
+    of the vectorizers
+    """
+
+    def __init__(self, model_dict: Dict):
+        """
+        :param model_dict: Dict of the model attributes, as created by to_dict
+        """
+        self.version = model_dict['version']
+        self.date_training = model_dict['date_training']
+        self.summary = model_dict['summary']
+        self.summary_description = model_dict['summary_description']
+        self.global_msg = model_dict['global_msg']
+        self.json = model_dict['json']
+        self.stats = keys_to_int(model_dict['stats'])
+        self.selected_clusters = keys_to_int(model_dict['selected_clusters'])
+        self.centers = keys_to_int(model_dict['centers'])
+        self.fields_for_clustering = model_dict['fields_for_clustering']
+        self.vectorizers = model_dict['vectorizers']
+        self.radii = keys_to_int(model_dict.get('radii', {}))
+        self.date_update = model_dict.get('date_update', self.date_training)
+        self.number_new_incidents = model_dict.get('number_new_incidents', 0)
+
+    @classmethod
+    def from_post_processing(cls, model_processed: Type[PostProcessing], preprocessor: ColumnTransformer,
+                             fields_for_clustering: List[str]):
+        """
+        Create the artifact from the trained model
+        :param model_processed: PostProcessing
+        :param preprocessor: fitted ColumnTransformer of the Tfidf of each field
+        :param fields_for_clustering: fields used for the clustering, in the order of the preprocessor features
+        :return: ClusteringModelArtifact
+        """
+        vectorizers = {}
+        for field in fields_for_clustering:
+            vec = preprocessor.named_transformers_['tfidf' + field].named_steps['tfidf'].vec
+            vectorizers[field] = {
+                'vocabulary': sorted(vec.vocabulary_, key=vec.vocabulary_.get),
+                'idf': vec.idf_.tolist()
+            }
+        clustering = model_processed.clustering
+        centers = {}
+        radii = {}
+        for cluster_number, center in clustering.centers.items():  # type: ignore
+            # Only the selected clusters are displayed, new incidents close to the other ones are outliers
+            if cluster_number not in model_processed.selected_clusters:
+                continue
+            center = np.round(np.asarray(center, dtype=float), MODEL_CENTERS_DECIMALS)
+            members = np.asarray(clustering.data[clustering.model.labels_ == cluster_number], dtype=float)  # type: ignore
+            centers[cluster_number] = center.tolist()
+            radii[cluster_number] = float(np.linalg.norm(members - center, axis=1).max())
+        return cls({
+            'version': MODEL_FORMAT_VERSION,
+            'date_training': model_processed.date_training,
+            'summary': model_processed.summary,
+            'summary_description': getattr(model_processed, 'summary_description', ''),
+            'global_msg': model_processed.global_msg,
+            'json': model_processed.json,
+            'stats': model_processed.stats,
+            'selected_clusters': model_processed.selected_clusters,
+            'centers': centers,
+            'fields_for_clustering': fields_for_clustering,
+            'vectorizers': vectorizers,
+            'radii': radii
+        })
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': self.version,
+            'date_training': self.date_training,
+            'summary': self.summary,
+            'summary_description': self.summary_description,
+            'global_msg': self.global_msg,
+            'json': self.json,
+            'stats': self.stats,
+            'selected_clusters': self.selected_clusters,
+            'centers': self.centers,
+            'fields_for_clustering': self.fields_for_clustering,
+            'vectorizers': self.vectorizers,
+            'radii': self.radii,
+            'date_update': self.date_update,
+            'number_new_incidents': self.number_new_incidents
+        }
+
+    def dumps(self) -> str:
+        """
+        Serialize the artifact to compressed JSON in base64
+        :return: string base64 model
+        """
+        model_json = json.dumps(self.to_dict(), default=lambda x: x.item() if isinstance(x, np.generic) else str(x))
+        return base64.b64encode(zlib.compress(model_json.encode('utf-8'), 9)).decode('utf-8')
+
+    @classmethod
+    def loads(cls, model_base64: str):
+        """
+        Deserialize the artifact from compressed JSON in base64
+        :param model_base64: string base64 model
+        :return: ClusteringModelArtifact
+        """
+        model_dict = json.loads(zlib.decompress(base64.b64decode(model_base64)))
+        if not isinstance(model_dict, dict) or model_dict.get('version') != MODEL_FORMAT_VERSION:
+            raise ValueError('Unsupported model format version')
+        return cls(model_dict)
+
+    def transform(self, incidents_df: pd.DataFrame) -> np.ndarray:
+        """
+        Vectorize incidents with the vocabularies of the training, like the preprocessor of the training
+        :param incidents_df: DataFrame of incidents with the fields used for the clustering
+        :return: vector of features - np.ndarray
+        """
+        features = []
+        for field in self.fields_for_clustering:
+            tfidf = Tfidf(normalize_function=normalize_global)
+            tfidf.vec = TfidfVectorizer(**dict(TFIDF_PARAMS, vocabulary=self.vectorizers[field]['vocabulary']))
+            tfidf.vec.idf_ = np.array(self.vectorizers[field]['idf'])
+            features.append(tfidf.transform(incidents_df[[field]]))
+        return np.hstack(features)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Assign each incident to the cluster with the nearest center if it is within the radius of this cluster
+        :param X: vector of features - np.ndarray
+        :return: cluster number of each incident, -1 for the incidents that are not close to any displayed cluster
+        """
+        displayed_clusters = {int(row['pivot'].split(':')[1]) for row in json.loads(self.json)['data']}
+        cluster_numbers = np.array(sorted(x for x in self.centers if x in displayed_clusters))
+        if len(cluster_numbers) == 0:
+            return np.full(len(X), -1)
+        distances = cdist(X, np.array([self.centers[cluster_number] for cluster_number in cluster_numbers]))
+        nearest = distances.argmin(axis=1)
+        radii = np.array([self.radii.get(cluster_number, 0.0) for cluster_number in cluster_numbers])
+        is_within_radius = distances[np.arange(len(X)), nearest] <= radii[nearest] + MODEL_RADIUS_TOLERANCE
+        return np.where(is_within_radius, cluster_numbers[nearest], -1)
+
+    def add_incidents(self, incidents_df: pd.DataFrame, labels: np.ndarray, display_fields: List[str]) -> None:
+        """
+        Add the incidents assigned by predict to the clusters json and statistics
+        :param incidents_df: DataFrame of incidents
+        :param labels: cluster number of each incident
+        :param display_fields: fields to display
+        :return: None
+        """
+        data_clusters = json.loads(self.json)
+        columns = [x for x in dict.fromkeys(display_fields + self.fields_for_clustering) if x in incidents_df.columns]
+        for row in data_clusters['data']:
+            mask = labels == int(row['pivot'].split(':')[1])
+            if mask.any():
+                row['incidents_ids'] += incidents_df[mask].id.values.tolist()
+                row['incidents'] = json.dumps(json.loads(row['incidents'])
+                                              + json.loads(incidents_df[mask][columns].to_json(orient='records')))
+                row['data'] = [row['data'][0] + int(mask.sum())]
+        mask = labels == -1
+        if mask.any():
+            outliers = data_clusters['outliers']
+            outliers['incidents_ids'] += incidents_df[mask].id.values.tolist()
+            outliers['incidents'] = json.dumps(json.loads(outliers['incidents']) + json.loads(
+                incidents_df[mask][[x for x in display_fields if x in incidents_df.columns]].to_json(orient='records')))
+        for cluster_number, count in collections.Counter(labels.tolist()).items():
+            if cluster_number in self.stats:
+                self.stats[cluster_number]['number_samples'] += count
+        self.json = json.dumps(data_clusters, indent=4, sort_keys=True)
+        self.number_new_incidents += len(labels)
+        self.date_update = datetime.now().strftime(DATE_TRAINING_FORMAT)
+        self.summary['Number of incidents added since training'] = str(self.number_new_incidents)
+        self.summary['Last update time'] = self.date_update
+
+
+def keys_to_int(obj: Dict) -> Dict:
+    """
+    Convert back to int the cluster numbers keys of a dict loaded from JSON
+    :param obj: Dict
+    :return: Dict with the keys which are cluster numbers as int
+    """
+    return {int(k) if isinstance(k, str) and re.match(r'^-?\d+$', k) else k: v for k, v in obj.items()}
+
+
 def extract_fields_from_args(arg: List[str]) -> List[str]:
     """
     Extract field from field with prefixe (like incident.commandline)
@@ -317,11 +504,14 @@ def get_args():  # type: ignore
     force_retrain = demisto.args().get('forceRetrain', 'False') == 'True'
     model_expiration = float(demisto.args().get('modelExpiration'))
     model_hidden = demisto.args().get('model_hidden', 'False') == 'True'
+    incremental_update = demisto.args().get('incrementalUpdate', 'False') == 'True'
+    max_noise_ratio = float(demisto.args().get('maxNoiseRatio', 0.3))
+    max_new_incidents_ratio = float(demisto.args().get('maxNewIncidentsRatio', 0.5))
 
     return fields_for_clustering, field_for_cluster_name, display_fields, from_date, to_date, limit, query, \
         incident_type, min_number_of_incident_in_cluster, model_name, store_model, min_homogeneity_cluster, \
         model_override, max_percentage_of_missing_value, debug, force_retrain, model_expiration, model_hidden, \
-        number_feature_per_field
+        number_feature_per_field, incremental_update, max_noise_ratio, max_new_incidents_ratio
 
 
 def get_all_incidents_for_time_window_and_type(populate_fields: List[str], from_date: str, to_date: str,
@@ -513,15 +703,18 @@ class Tfidf(BaseEstimator, TransformerMixin):
         return self.vec.transform(x).toarray()
 
 
-def store_model_in_demisto(model: Type[PostProcessing], model_name: str, model_override: bool,
+def store_model_in_demisto(model: ClusteringModelArtifact, model_name: str, model_override: bool,
                            model_hidden: bool) -> None:
-    model_data = base64.b64encode(pickle.dumps(model)).decode('utf-8')  # guardrails-disable-line
+    model_data = model.dumps()
     res = demisto.executeCommand('createMLModel', {'modelData': model_data,
                                                    'modelName': model_name,
                                                    'modelOverride': model_override,
                                                    'modelHidden': model_hidden,
                                                    'modelExtraInfo': {
-                                                       'modelSummaryMarkdown': model.summary_description}  # type:ignore
+                                                       'modelSummaryMarkdown': model.summary_description,
+                                                       'modelFormatVersion': model.version,
+                                                       'trainingTime': model.date_training,
+                                                       'updateTime': model.date_update}
                                                    })
     if is_error(res):
         return_error(get_error(res))
@@ -753,20 +946,21 @@ def remove_not_valid_field(fields_for_clustering: List[str], incidents_df: pd.Da
 
 def get_model_data(model_name):
     """
-    Return model in base 64 and message about the load of the model
+    Return model in base 64, message about the load of the model and extra information of the model
     :param model_name: model_name
     :return:
     """
     res_model = demisto.executeCommand("getMLModel", {"modelName": model_name})[0]
     if not is_error(res_model):
         model_data = res_model['Contents']['modelData']
+        model_extra_info = res_model['Contents'].get('model', {}).get('extra') or {}
         try:
             model_type = res_model['Contents']['model']["type"]["type"]
-            return model_data, model_type
+            return model_data, model_type, model_extra_info
         except Exception:
-            return model_data, UNKNOWN_MODEL_TYPE
+            return model_data, UNKNOWN_MODEL_TYPE, model_extra_info
     else:
-        return None, MESSAGE_ERROR_MESSAGE
+        return None, MESSAGE_ERROR_MESSAGE, {}
 
 
 def is_model_needs_retrain(force_retrain: bool, model_expiration: float, model_name: str):
@@ -775,16 +969,21 @@ def is_model_needs_retrain(force_retrain: bool, model_expiration: float, model_n
     :param force_retrain: boolean if the user cho to retrain the model in any case
     :param model_expiration: period in hour after which you want to retrain the model
     :param model_name: model_name
-    :return: PostProcessing model, boolean if needs to be retrained
+    :return: ClusteringModelArtifact or PostProcessing model, boolean if needs to be retrained
     """
     if force_retrain:
         return None, True
-    model_data, model_type = get_model_data(model_name)
+    model_data, model_type, model_extra_info = get_model_data(model_name)
     if not model_data:
         return None, True
+    # the training time is stored in the model extra info since the compact model format
+    training_time = model_extra_info.get('updateTime') or model_extra_info.get('trainingTime')
+    if training_time and pd.to_datetime(training_time, format=DATE_TRAINING_FORMAT) < \
+            datetime.now() - timedelta(hours=model_expiration):
+        return None, True
     else:
         model = load_model64(model_data)
-        model_training_time = pd.to_datetime(model.date_training)
+        model_training_time = pd.to_datetime(getattr(model, 'date_update', model.date_training))
         return model, model_training_time < datetime.now() - timedelta(hours=model_expiration)
 
 
@@ -792,8 +991,12 @@ def load_model64(model_base64: str):
     """
     Load model from base64 model
     :param model_base64: string base64 model
-    :return: PostProcessing model
+    :return: ClusteringModelArtifact, or PostProcessing model if stored by a previous version of the script
     """
+    try:
+        return ClusteringModelArtifact.loads(model_base64)
+    except (zlib.error, ValueError):
+        pass
     try:
         model = pickle.loads(base64.b64decode(model_base64))  # guardrails-disable-line
         return model
@@ -801,6 +1004,47 @@ def load_model64(model_base64: str):
         return_error("Model exist but cannot be loaded")
 
 
+def update_model_incrementally(model_name: str, display_fields: List[str], query: str, limit: int,
+                               incident_type: str, max_noise_ratio: float, max_new_incidents_ratio: float):
+    """
+    Assign the incidents created since the last update of the model to its clusters, instead of retraining it
+    :param model_name: model_name
+    :param display_fields: fields to display
+    :param query: additional criteria for the query
+    :param limit: maximum number of incident to fetch
+    :param incident_type: type of incident to fetch
+    :param max_noise_ratio: maximum ratio of new incidents not close to any cluster before retraining
+    :param max_new_incidents_ratio: maximum ratio of incidents added since training to training incidents
+    :return: updated ClusteringModelArtifact or None if the model needs to be retrained, message
+    """
+    model_data, model_type, model_extra_info = get_model_data(model_name)
+    if not model_data:
+        return None, ""
+    model = load_model64(model_data)
+    # models stored by a previous version of the script don't have the radius of the clusters
+    if not isinstance(model, ClusteringModelArtifact) or not model.radii:
+        return None, ""
+    populate_fields = model.fields_for_clustering + display_fields
+    incidents, msg = get_all_incidents_for_time_window_and_type(keep_high_level_field(populate_fields),
+                                                                model.date_update, '', query, limit, incident_type)
+    if not incidents:
+        model.add_incidents(pd.DataFrame(columns=['id']), np.array([], dtype=int), display_fields)
+        return model, ""
+    incidents_df = pd.DataFrame(incidents).fillna('')
+    incidents_df.index = incidents_df.id
+    incidents_df = fill_nested_fields(incidents_df, incidents, model.fields_for_clustering)
+    for field in model.fields_for_clustering:
+        if field not in incidents_df.columns:
+            incidents_df[field] = ''
+    labels = model.predict(model.transform(incidents_df))
+    noise_ratio = float(np.mean(labels == -1))
+    new_incidents_ratio = (model.number_new_incidents + len(labels)) / float(model.stats['General']['Nb sample'])
+    if noise_ratio > max_noise_ratio or new_incidents_ratio > max_new_incidents_ratio:
+        return None, "%s \n" % MESSAGE_INCREMENTAL_REFIT % (round(100 * noise_ratio), round(100 * new_incidents_ratio))
+    model.add_incidents(incidents_df, labels, display_fields)
+    return model, msg
+
+
 def prepare_data_for_training(generic_cluster_name, incidents_df, field_for_cluster_name):
     """
 
@@ -862,7 +1106,7 @@ def main():
     fields_for_clustering, field_for_cluster_name, display_fields, from_date, to_date, limit, query, incident_type, \
         min_number_of_incident_in_cluster, model_name, store_model, min_homogeneity_cluster, model_override, \
         max_percentage_of_missing_value, debug, force_retrain, model_expiration, model_hidden, \
-        number_feature_per_field = get_args()
+        number_feature_per_field, incremental_update, max_noise_ratio, max_new_incidents_ratio = get_args()
 
     HDBSCAN_PARAMS.update({'min_cluster_size': min_number_of_incident_in_cluster,
                            'min_samples': min_number_of_incident_in_cluster})
@@ -872,6 +1116,15 @@ def main():
     # Check if need to retrain
     model_processed, retrain = is_model_needs_retrain(force_retrain, model_expiration, model_name)
 
+    # Assign the new incidents to the existing clusters instead of retraining if possible
+    if retrain and incremental_update and not force_retrain:
+        model_processed, msg = update_model_incrementally(model_name, display_fields, query, limit, incident_type,
+                                                          max_noise_ratio, max_new_incidents_ratio)
+        global_msg += msg
+        retrain = model_processed is None
+        if not retrain and store_model:
+            store_model_in_demisto(model_processed, model_name, True, model_hidden)
+
     if not retrain:
         if debug:
             return_outputs(
@@ -991,7 +1244,9 @@ def main():
         model_processed.json = output_clustering_json
         return_entry_clustering(output_clustering=model_processed.json, tag="trained")  # type: ignore
         if store_model:
-            store_model_in_demisto(model_processed, model_name, model_override, model_hidden)
+            model_artifact = ClusteringModelArtifact.from_post_processing(
+                model_processed, model.named_steps[PREPROCESSOR_STEP_PIPELINE], fields_for_clustering)
+            store_model_in_demisto(model_artifact, model_name, model_override, model_hidden)
         return model_processed, output_clustering_json, global_msg
 
 
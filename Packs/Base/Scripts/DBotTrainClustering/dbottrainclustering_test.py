@@ -326,3 +326,132 @@ def test_same_cluster_name(mocker):
     clusters_name = [x['clusterName'] for x in model.selected_clusters.values()]
     assert 'nmap' in clusters_name
     assert 'nmap_0' in clusters_name
+
+
+# Test that the stored model is compact and that its expiration is checked without loading it
+def test_store_and_load_model_artifact(mocker):
+    from DBotTrainClustering import ClusteringModelArtifact, load_model64, is_model_needs_retrain, timedelta, \
+        store_model_in_demisto, DATE_TRAINING_FORMAT
+    global FETCHED_INCIDENT
+    FETCHED_INCIDENT = FETCHED_INCIDENT_NOT_EMPTY
+    PARAMETERS_DICT.update(
+        {'fieldsForClustering': 'field_1, field_2', 'fieldForClusterName': 'entityname', 'forceRetrain': 'True',
+         'storeModel': 'True', 'modelExpiration': 24})
+    mocker.patch.object(demisto, 'args', return_value=PARAMETERS_DICT)
+    stored_model = {}
+
+    def execute_command(command, args):
+        if command == 'createMLModel':
+            stored_model.update(args)
+            return [{'Contents': 'done', 'Type': 'note'}]
+        if command == 'getMLModel':
+            return [{'Contents': {'modelData': stored_model['modelData'],
+                                  'model': {'type': {'type': ''}, 'extra': stored_model['modelExtraInfo']}},
+                     'Type': 'note'}]
+        return executeCommand(command, args)
+
+    mocker.patch.object(demisto, 'executeCommand', side_effect=execute_command)
+    model, output_clustering_json, msg = main()
+    PARAMETERS_DICT.update({'storeModel': 'False'})
+
+    model_artifact = load_model64(stored_model['modelData'])
+    assert isinstance(model_artifact, ClusteringModelArtifact)
+    assert b'raw_data' not in pickle.dumps(model_artifact)
+    assert model_artifact.json == output_clustering_json
+    assert model_artifact.selected_clusters == model.selected_clusters
+    assert set(model_artifact.centers) <= set(model.selected_clusters)
+    assert set(model_artifact.vectorizers) == {'field_1', 'field_2'}
+    assert stored_model['modelExtraInfo']['trainingTime'] == model.date_training
+
+    model_loaded, retrain = is_model_needs_retrain(False, 24, 'model')
+    assert not retrain
+    assert model_loaded.json == output_clustering_json
+
+    load_model = mocker.patch('DBotTrainClustering.load_model64')
+    stored_model['modelExtraInfo']['updateTime'] = (datetime.now() - timedelta(hours=25)).strftime(
+        DATE_TRAINING_FORMAT)
+    assert is_model_needs_retrain(False, 24, 'model') == (None, True)
+    assert not load_model.called
+    store_model_in_demisto(model_artifact, 'model', True, False)
+    assert load_model64(stored_model['modelData']).to_dict() == model_artifact.to_dict()
+
+
+# Test that new incidents are assigned to the existing clusters and that too many outliers trigger a retraining
+def test_update_model_incrementally(mocker):
+    from DBotTrainClustering import ClusteringModelArtifact, update_model_incrementally, Tfidf, normalize_global, \
+        MODEL_FORMAT_VERSION
+    import numpy as np
+    import pandas as pd
+    training_df = pd.DataFrame(FETCHED_INCIDENT_NOT_EMPTY)
+    tfidf = Tfidf(normalize_function=normalize_global).fit(training_df[['field_1']])
+    X = tfidf.transform(training_df[['field_1']])
+    clusters_json = {'data': [{'pivot': 'clusterId:%d' % i, 'incidents_ids': ids, 'data': [2],
+                               'incidents': json.dumps([{'id': x} for x in ids])}
+                              for i, ids in enumerate([['1', '3'], ['2', '4']])],
+                     'outliers': {'incidents_ids': [], 'incidents': '[]'}}
+    model = ClusteringModelArtifact({
+        'version': MODEL_FORMAT_VERSION, 'date_training': '01/30/2021 00:00:00', 'summary': {},
+        'summary_description': '', 'global_msg': '', 'json': json.dumps(clusters_json),
+        'stats': {'General': {'Nb sample': 4}, '-1': {'number_samples': 0}, '0': {'number_samples': 2},
+                  '1': {'number_samples': 2}},
+        'selected_clusters': {}, 'centers': {'0': X[[0, 2]].mean(axis=0).tolist(), '1': X[[1, 3]].mean(axis=0).tolist()},
+        'fields_for_clustering': ['field_1'],
+        'vectorizers': {'field_1': {'vocabulary': sorted(tfidf.vec.vocabulary_, key=tfidf.vec.vocabulary_.get),
+                                    'idf': tfidf.vec.idf_.tolist()}},
+        'radii': {'0': float(np.linalg.norm(X[0] - X[[0, 2]].mean(axis=0))),
+                  '1': float(np.linalg.norm(X[1] - X[[1, 3]].mean(axis=0)))}})
+    new_incidents = [{'id': '5', 'created': "2021-01-31", 'name': 'name_5', 'field_1': 'powershell IP=1.1.1.1'},
+                     {'id': '6', 'created': "2021-01-31", 'name': 'name_6', 'field_1': 'certutil -urlcache -f'}]
+    mocker.patch('DBotTrainClustering.get_model_data', return_value=(model.dumps(), '', {}))
+    mocker.patch.object(demisto, 'executeCommand',
+                        return_value=[{'Contents': json.dumps(new_incidents), 'Type': 'note'}])
+
+    updated_model, msg = update_model_incrementally('model', ['id', 'name'], '', 1000, 'Phishing', 0.5, 1)
+    output_json = json.loads(updated_model.json)
+    assert output_json['data'][0]['incidents_ids'] == ['1', '3', '5']
+    assert output_json['data'][0]['data'] == [3]
+    assert output_json['outliers']['incidents_ids'] == ['6']
+    assert updated_model.stats[0]['number_samples'] == 3
+    assert updated_model.number_new_incidents == 2
+    assert demisto.executeCommand.call_args[0][1]['fromDate'] == '01/30/2021 00:00:00'
+
+    updated_model, msg = update_model_incrementally('model', ['id', 'name'], '', 1000, 'Phishing', 0.4, 1)
+    assert updated_model is None
+    assert 'retrained' in msg
+
+
+# Test that new incidents close to a cluster which is not displayed are outliers
+def test_update_model_incrementally_not_selected_cluster(mocker):
+    from DBotTrainClustering import ClusteringModelArtifact, update_model_incrementally, Tfidf, normalize_global, \
+        MODEL_FORMAT_VERSION
+    import numpy as np
+    import pandas as pd
+    training_df = pd.DataFrame(FETCHED_INCIDENT_NOT_EMPTY)
+    tfidf = Tfidf(normalize_function=normalize_global).fit(training_df[['field_1']])
+    X = tfidf.transform(training_df[['field_1']])
+    clusters_json = {'data': [{'pivot': 'clusterId:0', 'incidents_ids': ['1', '3'], 'data': [2],
+                               'incidents': json.dumps([{'id': '1'}, {'id': '3'}])}],
+                     'outliers': {'incidents_ids': ['2', '4'], 'incidents': json.dumps([{'id': '2'}, {'id': '4'}])}}
+    model = ClusteringModelArtifact({
+        'version': MODEL_FORMAT_VERSION, 'date_training': '01/30/2021 00:00:00', 'summary': {},
+        'summary_description': '', 'global_msg': '', 'json': json.dumps(clusters_json),
+        'stats': {'General': {'Nb sample': 4}, '-1': {'number_samples': 0}, '0': {'number_samples': 2},
+                  '1': {'number_samples': 2}},
+        'selected_clusters': {}, 'centers': {'0': X[[0, 2]].mean(axis=0).tolist(), '1': X[[1, 3]].mean(axis=0).tolist()},
+        'fields_for_clustering': ['field_1'],
+        'vectorizers': {'field_1': {'vocabulary': sorted(tfidf.vec.vocabulary_, key=tfidf.vec.vocabulary_.get),
+                                    'idf': tfidf.vec.idf_.tolist()}},
+        'radii': {'0': float(np.linalg.norm(X[0] - X[[0, 2]].mean(axis=0))),
+                  '1': float(np.linalg.norm(X[1] - X[[1, 3]].mean(axis=0)))}})
+    new_incidents = [{'id': '5', 'created': "2021-01-31", 'name': 'name_5', 'field_1': 'powershell IP=1.1.1.1'},
+                     {'id': '6', 'created': "2021-01-31", 'name': 'name_6', 'field_1': 'nmap port 1'}]
+    mocker.patch('DBotTrainClustering.get_model_data', return_value=(model.dumps(), '', {}))
+    mocker.patch.object(demisto, 'executeCommand',
+                        return_value=[{'Contents': json.dumps(new_incidents), 'Type': 'note'}])
+
+    updated_model, msg = update_model_incrementally('model', ['id', 'name'], '', 1000, 'Phishing', 0.5, 1)
+    output_json = json.loads(updated_model.json)
+    assert output_json['data'][0]['incidents_ids'] == ['1', '3', '5']
+    assert output_json['outliers']['incidents_ids'] == ['2', '4', '6']
+    assert updated_model.stats[1]['number_samples'] == 2
+    assert updated_model.number_new_incidents == 2
@@ -1,12 +1,17 @@
 from CommonServerPython import *
 
 import pickle
+import queue
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dateutil import parser
 
 PREFIXES_TO_REMOVE = ['incident.']
 PAGE_SIZE = int(demisto.args().get('pageSize', 500))
 PYTHON_MAGIC = "$$##"
+MAX_CONCURRENT_TIME_WINDOWS = 4
+MAX_PREFETCHED_PAGES_PER_WINDOW = 2
 
 
 def parse_datetime(datetime_str):
@@ -140,7 +145,7 @@ def get_demisto_datetme_format(date_string):
             return None
 
 
-def get_incidents(query, time_field, size, from_date, to_date, fields_to_populate, include_context):
+def get_incidents_args(query, time_field, size, from_date, to_date):
     query_size = min(PAGE_SIZE, size)
     args = {"query": query, "size": query_size, "sort": "%s.%s" % (time_field, "desc")}
     # apply only when created time field
@@ -158,16 +163,135 @@ def get_incidents(query, time_field, size, from_date, to_date, fields_to_populat
                 args['todate'] = to_datetime
             else:
                 demisto.results("did not set to date due to a wrong format: " + from_date)
+    return args
 
-    incident_list = []  # type: ignore
+
+def iterate_incidents_pages(args, size, fields_to_populate, include_context, stop_event=None):
+    """
+      Yields the pages of incidents as they are fetched, until size incidents were yielded or there are no more
+      incidents. The last page is trimmed to the requested size.
+    """
     page = 0
-    while len(incident_list) < size:
+    incidents_count = 0
+    while incidents_count < size and not (stop_event and stop_event.is_set()):
         incidents = get_incidents_by_page(args, page, fields_to_populate, include_context)
         if not incidents:
             break
-        incident_list += incidents
+        incidents = incidents[:size - incidents_count]
+        incidents_count += len(incidents)
+        yield incidents
         page += 1
-    return incident_list[:size]
+
+
+def get_time_windows(from_date, to_date, windows_count):
+    """
+      Splits the time range into disjoint windows of the same length, ordered from the newest to the oldest so the
+      incidents keep their descending time order. Returns None when the time range can not be split.
+    """
+    if windows_count <= 1 or not from_date:
+        return None
+    from_datetime = get_demisto_datetme_format(from_date)
+    to_datetime = get_demisto_datetme_format(to_date) if to_date else datetime.now().astimezone().isoformat('T')
+    if not from_datetime or not to_datetime:
+        return None
+    start, end = parser.parse(from_datetime), parser.parse(to_datetime)
+    if start >= end:
+        return None
+    window_length = (end - start) / windows_count
+    bounds = [start + window_length * i for i in range(windows_count)] + [end]
+    return [(bounds[i].isoformat(), bounds[i + 1].isoformat()) for i in reversed(range(windows_count))]
+
+
+def fetch_time_window_pages(args, time_field, window, size, fields_to_populate, include_context, pages_queue,
+                            stop_event, include_end=False):
+    """
+      Puts the pages of incidents of a time window in pages_queue, followed by None once the window is fetched or by
+      the exception which failed the fetch. The queue is bounded, so only a few pages of a window are fetched ahead
+      of the consumer. Stops once stop_event is set.
+    """
+    window_args = dict(args)
+    window_args['query'] = '%s and (%s:>="%s") and (%s:%s"%s")' % (args['query'], time_field, window[0], time_field,
+                                                                   '<=' if include_end else '<', window[1])
+
+    def put(item):
+        while not stop_event.is_set():
+            try:
+                pages_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for incidents_page in iterate_incidents_pages(window_args, size, fields_to_populate, include_context,
+                                                      stop_event):
+            if not put(incidents_page):
+                return
+        put(None)
+    except Exception as e:
+        put(e)
+
+
+def iterate_incidents(query, time_field, size, from_date, to_date, fields_to_populate, include_context,
+                      time_windows=1):
+    """
+      Yields the pages of incidents matching the query. When the time range is split into several time windows,
+      the windows are fetched concurrently, each with shallow paging. The pages are yielded as they are fetched by
+      the windows order, and the older windows fetch at most MAX_PREFETCHED_PAGES_PER_WINDOW pages ahead.
+    """
+    args = get_incidents_args(query, time_field, size, from_date, to_date)
+    windows = get_time_windows(from_date, to_date, time_windows)
+    if windows is None:
+        yield from iterate_incidents_pages(args, size, fields_to_populate, include_context)
+        return
+
+    stop_event = threading.Event()
+    pages_queues = [queue.Queue(maxsize=MAX_PREFETCHED_PAGES_PER_WINDOW) for _ in windows]
+    incidents_count = 0
+    with ThreadPoolExecutor(max_workers=min(len(windows), MAX_CONCURRENT_TIME_WINDOWS)) as executor:
+        # the newest window includes its end, so the windows drop no incident that the query itself does not drop
+        for i, (window, pages_queue) in enumerate(zip(windows, pages_queues)):
+            executor.submit(fetch_time_window_pages, args, time_field, window, size, fields_to_populate,
+                            include_context, pages_queue, stop_event, include_end=i == 0)
+        try:
+            for pages_queue in pages_queues:
+                while incidents_count < size:
+                    incidents = pages_queue.get()
+                    if incidents is None:
+                        break
+                    if isinstance(incidents, Exception):
+                        raise incidents
+                    incidents = incidents[:size - incidents_count]
+                    incidents_count += len(incidents)
+                    yield incidents
+                if incidents_count >= size:
+                    break
+        finally:
+            stop_event.set()
+
+
+def get_incidents(query, time_field, size, from_date, to_date, fields_to_populate, include_context, time_windows=1):
+    incident_list = []  # type: ignore
+    for incidents in iterate_incidents(query, time_field, size, from_date, to_date, fields_to_populate,
+                                       include_context, time_windows):
+        incident_list += incidents
+    return incident_list
+
+
+def write_ndjson_file(incidents_pages):
+    """
+      Writes the incidents to a file as they are fetched, a JSON object per line.
+      Returns the file ID and the number of incidents written.
+    """
+    file_id = demisto.uniqueFile()
+    incidents_count = 0
+    with open(demisto.investigation()['id'] + '_' + file_id, 'w') as f:
+        for incidents in incidents_pages:
+            for incident in incidents:
+                f.write(json.dumps(incident))
+                f.write('\n')
+            incidents_count += len(incidents)
+    return file_id, incidents_count
 
 
 def get_comma_sep_list(value):
@@ -205,26 +329,31 @@ def main():
             fields_to_populate.append('id')
             fields_to_populate = set([x for x in fields_to_populate if x])  # type: ignore
         include_context = d_args['includeContext'] == 'true'
-        incidents = get_incidents(query, d_args['timeField'],
-                                  int(d_args['limit']),
-                                  d_args.get('fromDate'),
-                                  d_args.get('toDate'),
-                                  fields_to_populate,
-                                  include_context)
+        time_windows = int(d_args.get('timeWindows') or 1)
+        incidents_args = (query, d_args['timeField'], int(d_args['limit']), d_args.get('fromDate'),
+                          d_args.get('toDate'), fields_to_populate, include_context, time_windows)
 
         # output
         file_name = str(uuid.uuid4())
         output_format = d_args['outputFormat']
-        if output_format == 'pickle':
-            data_encoded = pickle.dumps(incidents, protocol=2)
-        elif output_format == 'json':
-            data_encoded = json.dumps(incidents)  # type: ignore
+        if output_format == 'ndjson':
+            # the incidents are streamed to the file, so they are not returned in the entry contents
+            file_id, incidents_count = write_ndjson_file(iterate_incidents(*incidents_args))
+            entry = {'Contents': '', 'ContentsFormat': formats['text'], 'Type': entryTypes['file'],
+                     'File': file_name, 'FileID': file_id}
+        elif output_format in ['pickle', 'json']:
+            incidents = get_incidents(*incidents_args)
+            incidents_count = len(incidents)
+            if output_format == 'pickle':
+                data_encoded = pickle.dumps(incidents, protocol=2)
+            else:
+                data_encoded = json.dumps(incidents)  # type: ignore
+            entry = fileResult(file_name, data_encoded)
+            entry['Contents'] = incidents
         else:
             raise Exception("Invalid output format: %s" % output_format)
 
-        entry = fileResult(file_name, data_encoded)
-        entry['Contents'] = incidents
-        entry['HumanReadable'] = "Fetched %d incidents successfully by the query: %s" % (len(incidents), query)
+        entry['HumanReadable'] = "Fetched %d incidents successfully by the query: %s" % (incidents_count, query)
         entry['EntryContext'] = {
             'GetIncidentsByQuery': {
                 'Filename': file_name,
@@ -1,5 +1,6 @@
 from GetIncidentsByQuery import build_incidents_query, get_incidents, parse_relative_time, main, \
-    preprocess_incidents_fields_list, get_demisto_datetme_format, get_fields_to_populate_arg, PYTHON_MAGIC
+    preprocess_incidents_fields_list, get_demisto_datetme_format, get_fields_to_populate_arg, get_time_windows, \
+    PYTHON_MAGIC
 
 from CommonServerPython import *
 
@@ -169,6 +170,88 @@ def test_skip_python_magic(mocker):
     assert len(entry['Contents']) == 1
 
 
+def test_get_time_windows():
+    windows = get_time_windows('2020-01-01T00:00:00+00:00', '2020-01-05T00:00:00+00:00', 4)
+    assert windows == [('2020-01-04T00:00:00+00:00', '2020-01-05T00:00:00+00:00'),
+                       ('2020-01-03T00:00:00+00:00', '2020-01-04T00:00:00+00:00'),
+                       ('2020-01-02T00:00:00+00:00', '2020-01-03T00:00:00+00:00'),
+                       ('2020-01-01T00:00:00+00:00', '2020-01-02T00:00:00+00:00')]
+    assert get_time_windows('2020-01-01T00:00:00+00:00', '2020-01-05T00:00:00+00:00', 1) is None
+    assert get_time_windows(None, '2020-01-05T00:00:00+00:00', 4) is None
+    assert len(get_time_windows('3 days ago', None, 3)) == 3
+
+
+def execute_command_get_incidents_by_time_window(command, args):
+    # each time window holds 3 incidents, returned in pages of 2 incidents
+    window_start = args['query'].split('created:>="')[1][:10]
+    incidents = [dict(incident1, id='%s-%d' % (window_start, i)) for i in range(3)]
+    page = incidents[args['page'] * 2:args['page'] * 2 + 2]
+    return [{'Type': entryTypes['note'], 'Contents': {'data': page or None}}]
+
+
+def test_get_incidents_time_windows(mocker):
+    mocker.patch.object(demisto, 'executeCommand', side_effect=execute_command_get_incidents_by_time_window)
+    incidents = get_incidents('query', 'created', 100, '2020-01-01T00:00:00+00:00', '2020-01-04T00:00:00+00:00',
+                              [], False, time_windows=3)
+    assert [inc['id'] for inc in incidents] == ['2020-01-03-0', '2020-01-03-1', '2020-01-03-2',
+                                                '2020-01-02-0', '2020-01-02-1', '2020-01-02-2',
+                                                '2020-01-01-0', '2020-01-01-1', '2020-01-01-2']
+    incidents = get_incidents('query', 'created', 4, '2020-01-01T00:00:00+00:00', '2020-01-04T00:00:00+00:00',
+                              [], False, time_windows=3)
+    assert [inc['id'] for inc in incidents] == ['2020-01-03-0', '2020-01-03-1', '2020-01-03-2', '2020-01-02-0']
+
+
+def test_get_incidents_time_windows_bounds(mocker):
+    execute_command = mocker.patch.object(demisto, 'executeCommand',
+                                          side_effect=execute_command_get_incidents_by_time_window)
+    get_incidents('query', 'created', 100, '2020-01-01T00:00:00+00:00', '2020-01-03T00:00:00+00:00', [], False,
+                  time_windows=2)
+    queries = {call[0][1]['query'] for call in execute_command.call_args_list}
+    assert queries == {'query and (created:>="2020-01-02T00:00:00+00:00") and (created:<="2020-01-03T00:00:00+00:00")',
+                       'query and (created:>="2020-01-01T00:00:00+00:00") and (created:<"2020-01-02T00:00:00+00:00")'}
+
+
+def test_iterate_incidents_time_windows_prefetch(mocker):
+    """
+    Given:
+      - Time windows which each hold many pages of incidents.
+    When:
+      - Iterating over a few incidents.
+    Then:
+      - The pages are yielded as they are fetched, and the other windows fetch only a few pages ahead.
+    """
+    from GetIncidentsByQuery import iterate_incidents, MAX_PREFETCHED_PAGES_PER_WINDOW
+
+    def execute_command(command, args):
+        return [{'Type': entryTypes['note'], 'Contents': {'data': [dict(incident1, id=args['page'])] * 2}}]
+
+    execute_command_mock = mocker.patch.object(demisto, 'executeCommand', side_effect=execute_command)
+    pages = iterate_incidents('query', 'created', 10, '2020-01-01T00:00:00+00:00', '2020-01-04T00:00:00+00:00',
+                              [], False, time_windows=3)
+    assert [inc['id'] for inc in next(pages)] == [0, 0]
+    assert sum(len(page) for page in pages) == 8
+    # the pages of the consumed window, and the prefetched pages (plus the page being fetched) of the others
+    assert execute_command_mock.call_count <= 5 + 2 * (MAX_PREFETCHED_PAGES_PER_WINDOW + 1)
+
+
+def test_main_ndjson(mocker, tmp_path):
+    args = dict(get_args())
+    args['outputFormat'] = 'ndjson'
+    mocker.patch.object(demisto, 'args', return_value=args)
+    mocker.patch.object(demisto, 'investigation', return_value={'id': str(tmp_path / 'investigation')})
+    mocker.patch.object(demisto, 'uniqueFile', return_value='file_id')
+    mocker.patch.object(demisto, 'executeCommand', side_effect=execute_command_get_incidents_with_magic)
+
+    entry = main()
+    assert "Fetched 1 incidents successfully" in entry['HumanReadable']
+    assert entry['Contents'] == ''
+    assert entry['FileID'] == 'file_id'
+    with open(str(tmp_path / 'investigation_file_id')) as f:
+        incidents = [json.loads(line) for line in f]
+    assert [inc['id'] for inc in incidents] == [1]
+    assert incidents[0]['testField'] == 'testValue'
+
+
 def test_preprocess_incidents_fields_list():
     incidents_fields = ['incident.emailbody', ' incident.emailsbuject']
     assert preprocess_incidents_fields_list(incidents_fields) == ['emailbody', 'emailsbuject']
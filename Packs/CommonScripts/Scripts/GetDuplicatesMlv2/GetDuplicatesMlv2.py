@@ -2,6 +2,8 @@ import demistomock as demisto
 from CommonServerPython import *
 import collections
 import re
+import base64
+import hashlib
 import dateutil.parser
 import pickle
 import ipaddress
@@ -10,7 +12,9 @@ import editdistance
 import zlib
 from rfc822 import parseaddr  # type:ignore
 from urlparse import urlparse
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from sklearn.ensemble import RandomForestClassifier
 from datetime import datetime, timedelta
 from sklearn.preprocessing import Imputer
@@ -250,6 +254,10 @@ INSTANCE_LABEL = 'Instance'
 CANDIDATES_FEATURES_NA_RATIO = 0.2
 TIME_FIELD = 'created'
 
+MODEL_NAME_PREFIX = 'GetDuplicatesMlv2_'
+MODEL_FORMAT_VERSION = 1
+MODEL_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
 LABELS_BLACKLIST = [BRAND_LABEL, INSTANCE_LABEL, EMAIL_SENDER_ADDRESS_LABEL, EMAIL_SENDER_NAME_LABEL,
                     EMAIL_SUBJECT_LABEL, EMAIL_RECEIVED_LABEL, EMAIL_ATTACHMENT_LABEL, EMAIL_DATE_LABEL,
                     EMAIL_TEXT_LABEL, EMAIL_HTML_LABEL]
@@ -266,13 +274,21 @@ class Utils():
     email_pattern = re.compile(
         r"""[a-zA-Z0-9.!#$%&'*+/=?^_`{|}~-]+@[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?(?:\.[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)*""")  # noqa: E501
 
+    tld_extract = None
+    domains_by_url = {}  # type: dict
+
     @staticmethod
     def extract_domain_from_url(url):
-        extract = tldextract.TLDExtract(cache_file='/tmp/.tld_set')
-        domain = extract(url).domain.lower()
-        suffix = extract(url).suffix.lower()
-        if len(domain) > 0 and len(suffix) > 0:
-            return ".".join([domain, suffix])
+        if url in Utils.domains_by_url:
+            return Utils.domains_by_url[url]
+        if Utils.tld_extract is None:
+            Utils.tld_extract = tldextract.TLDExtract(cache_file='/tmp/.tld_set')
+        extract_result = Utils.tld_extract(url)
+        domain = extract_result.domain.lower()
+        suffix = extract_result.suffix.lower()
+        result = ".".join([domain, suffix]) if len(domain) > 0 and len(suffix) > 0 else None
+        Utils.domains_by_url[url] = result
+        return result
 
     @staticmethod
     def uri_validator(url):
@@ -423,35 +439,40 @@ class Utils():
             return ip_address
 
 
-class IncidentFeatures:
-    def __init__(self, incident1, incident2):
+class PreparedIncident:
+    """
+    Labels map and indicators (with the extracted domains and canonized IPs) of an incident, computed once so
+    the incident can be compared with many others
+    """
+    def __init__(self, incident):
+        self.incident = incident
+        self.labels_map = Utils.get_incident_labels_map(incident['labels'])
+        self.indicators = dict(incident['indicators'])
 
-        self.incident1 = incident1
-        self.incident2 = incident2
+        domains = Utils.get_unique_list(
+            self.indicators.get('Domain', []) + Utils.get_domains(self.indicators, self.labels_map))
+        if len(domains) > 0:
+            self.indicators['Domain'] = domains
+
+        if IP_MASK_BITS_FOR_COMPARISON < 32 and IP_MASK_BITS_FOR_COMPARISON > 0:
+            if 'IP' in self.indicators:
+                self.indicators['IP'] = map(lambda ip: Utils.canonize_ip_to_netrok(
+                    ip, IP_MASK_BITS_FOR_COMPARISON), self.indicators['IP'])
 
-        self.indicators1 = incident1['indicators']
-        self.indicators2 = incident2['indicators']
 
-        self.labels_map1 = Utils.get_incident_labels_map(self.incident1['labels'])
-        self.labels_map2 = Utils.get_incident_labels_map(self.incident2['labels'])
+class IncidentFeatures:
+    def __init__(self, incident1, incident2):
+        prepared1 = incident1 if isinstance(incident1, PreparedIncident) else PreparedIncident(incident1)
+        prepared2 = incident2 if isinstance(incident2, PreparedIncident) else PreparedIncident(incident2)
 
-        domains1 = Utils.get_unique_list(
-            self.indicators1.get('Domain', []) + Utils.get_domains(self.indicators1, self.labels_map2))
-        domains2 = Utils.get_unique_list(
-            self.indicators2.get('Domain', []) + Utils.get_domains(self.indicators2, self.labels_map2))
+        self.incident1 = prepared1.incident
+        self.incident2 = prepared2.incident
 
-        if len(domains1) > 0:
-            self.indicators1['Domain'] = domains1
-        if len(domains2) > 0:
-            self.indicators2['Domain'] = domains2
+        self.indicators1 = prepared1.indicators
+        self.indicators2 = prepared2.indicators
 
-        if IP_MASK_BITS_FOR_COMPARISON < 32 and IP_MASK_BITS_FOR_COMPARISON > 0:
-            if 'IP' in self.indicators1:
-                self.indicators1['IP'] = map(lambda ip: Utils.canonize_ip_to_netrok(
-                    ip, IP_MASK_BITS_FOR_COMPARISON), self.indicators1['IP'])
-            if 'IP' in self.indicators2:
-                self.indicators2['IP'] = map(lambda ip: Utils.canonize_ip_to_netrok(
-                    ip, IP_MASK_BITS_FOR_COMPARISON), self.indicators2['IP'])
+        self.labels_map1 = prepared1.labels_map
+        self.labels_map2 = prepared2.labels_map
 
     def get_email_labels_features(self):
         def add_label_ld_feature(label_name):
@@ -521,6 +542,172 @@ class IncidentFeatures:
         return features
 
 
+class CandidatesFeatures:
+    """
+    The features of IncidentFeatures, calculated for an incident against all the candidates at once. Each feature
+    is a column: sets are encoded as integer ids in a sparse matrix with a row for each candidate, and values that
+    repeat between candidates are compared once. Features which IncidentFeatures does not set for a pair are NaN.
+    """
+    def __init__(self, incident, candidates):
+        self.incident = PreparedIncident(incident)
+        self.candidates = [PreparedIncident(candidate) for candidate in candidates]
+
+    @staticmethod
+    def get_hashable_values(values):
+        if values is None:
+            return None
+        if type(values) == dict:
+            values = Utils.get_hashable_from_dict(values)
+        return [v for v in values if isinstance(v, collections.Hashable)]
+
+    @staticmethod
+    def jaccard_similarities(values, candidates_values):
+        """
+        Jaccard similarity of values with the values of each candidate, the same as Utils.jaccard_similarity
+        :param values: the incident values
+        :param candidates_values: list with the values of each candidate, None for a candidate without values
+        :return: numpy array of similarities
+        """
+        similarities = np.zeros(len(candidates_values))
+        values = CandidatesFeatures.get_hashable_values(values)
+        if not values:
+            return similarities
+        ids = {}  # type: dict
+        for value in values:
+            ids.setdefault(value, len(ids))
+        incident_vector = np.ones(len(ids))
+        indptr = [0]
+        indices = []  # type: list
+        for candidate_values in candidates_values:
+            candidate_values = CandidatesFeatures.get_hashable_values(candidate_values) or []
+            indices.extend(ids.setdefault(value, len(ids)) for value in set(candidate_values))
+            indptr.append(len(indices))
+        candidates_matrix = sp.csr_matrix((np.ones(len(indices)), indices, indptr),
+                                          shape=(len(candidates_values), len(ids)))
+        candidates_sizes = np.diff(indptr)
+        intersection = candidates_matrix[:, :len(incident_vector)].dot(incident_vector)
+        union = candidates_sizes + len(incident_vector) - intersection
+        mask = candidates_sizes > 0
+        similarities[mask] = intersection[mask] / union[mask]
+        return similarities
+
+    @staticmethod
+    def pairwise_feature(value, candidates_values, compare):
+        """
+        Compare the incident value with the value of each candidate, each distinct candidate value is compared once
+        :param value: the incident value
+        :param candidates_values: list with the value of each candidate, None where the feature is not set
+        :param compare: function of two values, returns the feature value or None
+        :return: numpy array of the feature, NaN where the feature is not set
+        """
+        feature = np.full(len(candidates_values), np.nan)
+        if value is None:
+            return feature
+        compared = {}  # type: dict
+        for i, candidate_value in enumerate(candidates_values):
+            if candidate_value is None:
+                continue
+            try:
+                if candidate_value not in compared:
+                    compared[candidate_value] = compare(value, candidate_value)
+                result = compared[candidate_value]
+            except TypeError:
+                result = compare(value, candidate_value)
+            if result is not None:
+                feature[i] = result
+        return feature
+
+    @staticmethod
+    def time_diffs_seconds(value, candidates_values):
+        parsed_times = {}  # type: dict
+
+        def parse_time(time_value):
+            if time_value is None or 'datetime' in str(type(time_value)):
+                return time_value
+            if time_value not in parsed_times:
+                try:
+                    parsed_times[time_value] = dateutil.parser.parse(time_value)
+                except Exception:
+                    parsed_times[time_value] = None
+            return parsed_times[time_value]
+
+        return CandidatesFeatures.pairwise_feature(parse_time(value), [parse_time(x) for x in candidates_values],
+                                                   Utils.get_time_diff_seconds)
+
+    @staticmethod
+    def equal(value, candidates_values):
+        return np.array([value == candidate_value for candidate_value in candidates_values], dtype=float)
+
+    def get_label_values(self, label_name, transform=None):
+        transform = transform or (lambda x: x)
+        value = transform(self.incident.labels_map[label_name]) if label_name in self.incident.labels_map else None
+        candidates_values = [transform(candidate.labels_map[label_name]) if label_name in candidate.labels_map
+                             else None for candidate in self.candidates]
+        return value, candidates_values
+
+    def get_email_labels_features(self):
+        features = {}
+        value, candidates_values = self.get_label_values(EMAIL_SENDER_ADDRESS_LABEL, Utils.get_email_address)
+        features[EMAIL_SENDER_ADDRESS_LABEL] = self.pairwise_feature(
+            value, candidates_values, lambda x, y: editdistance.eval(x, y) if x and y else None)
+
+        value, candidates_values = self.get_label_values(EMAIL_DATE_LABEL)
+        features[EMAIL_DATE_LABEL] = self.time_diffs_seconds(value, candidates_values)
+
+        for label_name in [EMAIL_SUBJECT_LABEL, EMAIL_ATTACHMENT_LABEL]:
+            value, candidates_values = self.get_label_values(label_name)
+            features[label_name] = self.pairwise_feature(value, candidates_values, editdistance.eval)
+
+        for label_name in [EMAIL_TEXT_LABEL, EMAIL_HTML_LABEL]:
+            value, candidates_values = self.get_label_values(label_name, lambda x: x.split())
+            similarities = self.jaccard_similarities(value or [], candidates_values)
+            if value is None:
+                similarities[:] = np.nan
+            similarities[[x is None for x in candidates_values]] = np.nan
+            features[label_name] = similarities
+        return features
+
+    def get_incident_features(self):
+        features = {}
+        incident = self.incident.incident
+        candidates = [candidate.incident for candidate in self.candidates]
+        features['incident_time_diff'] = self.time_diffs_seconds(incident[TIME_FIELD],
+                                                                 [candidate[TIME_FIELD] for candidate in candidates])
+        features['same_type'] = self.equal(incident['type'], [candidate['type'] for candidate in candidates])
+        features['same_severity'] = self.equal(incident['severity'],
+                                               [candidate['severity'] for candidate in candidates])
+        features['custom_fields_jaccard'] = self.jaccard_similarities(
+            incident.get('CustomFields', []), [candidate.get('CustomFields', []) for candidate in candidates])
+        features['labels_jaccard'] = self.jaccard_similarities(
+            [(k, v) for (k, v) in self.incident.labels_map.items() if k not in LABELS_BLACKLIST],
+            [[(k, v) for (k, v) in candidate.labels_map.items() if k not in LABELS_BLACKLIST]
+             for candidate in self.candidates])
+
+        value, candidates_values = self.get_label_values(INSTANCE_LABEL)
+        features['same_instance'] = self.pairwise_feature(value, candidates_values, lambda x, y: x == y)
+
+        for indicator_type in INDICATORS_FOR_JACCARD:
+            if indicator_type not in self.incident.indicators:
+                continue
+            candidates_values = [candidate.indicators.get(indicator_type) for candidate in self.candidates]
+            similarities = self.jaccard_similarities(self.incident.indicators[indicator_type], candidates_values)
+            similarities[[x is None for x in candidates_values]] = np.nan
+            features['indicator_%s_jaccard' % indicator_type] = similarities
+        return features
+
+    def calculate_features(self, expected_features=FEATURES):
+        """
+        :return: DataFrame with a row for each candidate, and the candidate id in the 'id' column
+        """
+        features = {}  # type: dict
+        features.update(self.get_incident_features())
+        features.update(self.get_email_labels_features())
+        for key in set(expected_features).difference(set(features.keys())):
+            features[key] = np.full(len(self.candidates), np.nan)
+        features['id'] = [candidate.incident['id'] for candidate in self.candidates]
+        return pd.DataFrame(features, columns=sorted(features.keys()))
+
+
 ##################################################################################
 
 
@@ -585,6 +772,7 @@ def get_my_duplicate_incidents_features(incident_type, days_to_fetch_duplicates,
     if incident_list is None:
         return None
     incidents = enrich_incidents_by_indicators(incident_list, max_indicators)
+    prepared_incidents = {incident_id: PreparedIncident(incident) for incident_id, incident in incidents.items()}
 
     related_features = {}  # type: dict
     for incident in incidents.values():
@@ -597,7 +785,8 @@ def get_my_duplicate_incidents_features(incident_type, days_to_fetch_duplicates,
                 key = get_unique_key_for_pair(incident['id'], related_incident_id)
                 if incident['id'] == related_incident_id or key in related_features or related_incident_id not in incidents:
                     continue
-                related_features[key] = IncidentFeatures(incident, incidents[related_incident_id]).calculate_features()
+                related_features[key] = IncidentFeatures(prepared_incidents[incident['id']],
+                                                         prepared_incidents[related_incident_id]).calculate_features()
                 related_features[key][DUPLICATE_COL] = 1
     return pd.DataFrame.from_dict(related_features.values())
 
@@ -617,6 +806,102 @@ def get_ml_model():
     return RandomForestClassifier(max_depth=10, n_estimators=100, random_state=1)
 
 
+def get_candidates_features(incident, candidates):
+    """
+    Calculate the features of the incident against each of the candidates
+    :param incident: the incident to find duplicates for
+    :param candidates: candidate incidents
+    :return: DataFrame of features with a row for each candidate, with the candidate id in the 'id' column
+    """
+    return CandidatesFeatures(incident, candidates).calculate_features()
+
+
+class DuplicatesModel:
+    """
+    Fitted classifier, stored with the sum and the count of the known values of each training feature. Missing
+    candidates features are completed with the mean of the training and the candidates values, the same as
+    union_complete_missing_values does, without keeping the training data.
+    """
+    def __init__(self, model, features, features_sum, features_count, training_time, version=MODEL_FORMAT_VERSION):
+        self.version = version
+        self.model = model
+        self.features = features
+        self.features_sum = features_sum
+        self.features_count = features_count
+        self.training_time = training_time
+
+    @staticmethod
+    def train(features_df, use_features):
+        X = filter_features(features_df, use_features).astype(float)
+        Y = features_df[DUPLICATE_COL]
+        model = get_ml_model()
+        model.fit(X, Y)
+        return DuplicatesModel(model, list(X.columns), X.sum().values, X.count().values,
+                               datetime.now().strftime(MODEL_TIME_FORMAT))
+
+    def complete_missing_values(self, candidates_features_x):
+        candidates_features_x = candidates_features_x.reindex(columns=self.features).astype(float)
+        features_sum = self.features_sum + candidates_features_x.sum().values
+        features_count = self.features_count + candidates_features_x.count().values
+        features_mean = features_sum / np.maximum(features_count, 1)
+        return candidates_features_x.fillna(dict(zip(self.features, features_mean)))
+
+    def predict_proba(self, candidates_features_x):
+        return self.model.predict_proba(self.complete_missing_values(candidates_features_x))
+
+    def dumps(self):
+        # the script classes can not be unpickled in a later run, so only the model attributes are pickled
+        return base64.b64encode(zlib.compress(pickle.dumps(self.__dict__, protocol=2)))
+
+    @staticmethod
+    def loads(model_data):
+        model_dict = pickle.loads(zlib.decompress(base64.b64decode(model_data)))
+        if model_dict.get('version') != MODEL_FORMAT_VERSION:
+            raise ValueError('Unsupported model format version: %s' % model_dict.get('version'))
+        return DuplicatesModel(**model_dict)
+
+
+def get_model_name(features_set, use_features, local_duplicates_days, incident_type):
+    model_key = '%s_%s_%d' % (features_set, ','.join(sorted(use_features)), local_duplicates_days)
+    if local_duplicates_days > 0:
+        # the local duplicates used for training are of the incident type
+        model_key += '_%s' % incident_type
+    return MODEL_NAME_PREFIX + hashlib.md5(model_key.encode('utf-8')).hexdigest()
+
+
+def load_stored_model(model_name, model_expiration_hours):
+    """
+    Load a trained model from the ML model store
+    :param model_name: model name
+    :param model_expiration_hours: number of hours after which the model is retrained
+    :return: DuplicatesModel, or None if the model does not exist, is expired or could not be loaded
+    """
+    res = demisto.executeCommand('getMLModel', {'modelName': model_name})
+    if is_error(res):
+        return None
+    model_extra_info = res[0]['Contents'].get('model', {}).get('extra') or {}
+    training_time = model_extra_info.get('trainingTime')
+    try:
+        if not training_time or datetime.strptime(training_time, MODEL_TIME_FORMAT) < \
+                datetime.now() - timedelta(hours=model_expiration_hours):
+            return None
+        return DuplicatesModel.loads(res[0]['Contents']['modelData'])
+    except Exception as e:
+        demisto.debug('Could not load model %s: %s' % (model_name, str(e)))
+        return None
+
+
+def store_model(model, model_name):
+    res = demisto.executeCommand('createMLModel', {'modelData': model.dumps(),
+                                                   'modelName': model_name,
+                                                   'modelOverride': 'true',
+                                                   'modelHidden': 'true',
+                                                   'modelExtraInfo': {'trainingTime': model.training_time,
+                                                                      'modelFormatVersion': model.version}})
+    if is_error(res):
+        demisto.debug('Could not store model %s: %s' % (model_name, get_error(res)))
+
+
 def get_result_record(incident, probabilty):
     occured_time = incident[TIME_FIELD]
     try:
@@ -687,6 +972,8 @@ def main():
     MAX_INDICATORS = MAX_INCIDENTS * 100
     THRESHOLD = float(demisto.args().get('threshold', 0.5))
     TIME_FIELD = demisto.args().get('timeField', 'created')
+    MODEL_EXPIRATION_HOURS = float(demisto.args().get('modelExpirationHours', 24))
+    FORCE_RETRAIN = demisto.args().get('forceRetrain', 'no') == 'yes'
 
     incident = enrich_incidents_by_indicators(demisto.incidents(), MAX_INDICATORS).values()[0]
 
@@ -698,44 +985,41 @@ def main():
 
     use_features = set(FEATURES).union(email_features).union(indicators_features)
 
-    if len(email_features) > 0:
-        features_df = load_compressed_features(FEATURES_PHISHING_STRING)
-    else:
-        features_df = load_compressed_features(FEATURES_OTHERS_STRING)
-
-    use_features = set(features_df.columns).intersection(use_features)
-    if USE_MY_DUPLICATES_X_DAYS_AGO > 0:
-        my_tagged_data_features = get_my_duplicate_incidents_features(incident['type'], USE_MY_DUPLICATES_X_DAYS_AGO,
-                                                                      MAX_INCIDENTS, MAX_INDICATORS)
-        features_df = union_complete_missing_values(features_df, my_tagged_data_features).reset_index()
-
-    X = filter_features(features_df, use_features)
-    Y = features_df[DUPLICATE_COL]
-    model = get_ml_model()
-    model.fit(X, Y)
+    features_set = 'phishing' if len(email_features) > 0 else 'others'
+    model_name = get_model_name(features_set, use_features, USE_MY_DUPLICATES_X_DAYS_AGO, incident['type'])
+    model = None if FORCE_RETRAIN else load_stored_model(model_name, MODEL_EXPIRATION_HOURS)
+    if model is None:
+        if len(email_features) > 0:
+            features_df = load_compressed_features(FEATURES_PHISHING_STRING)
+        else:
+            features_df = load_compressed_features(FEATURES_OTHERS_STRING)
+
+        if USE_MY_DUPLICATES_X_DAYS_AGO > 0:
+            my_tagged_data_features = get_my_duplicate_incidents_features(incident['type'],
+                                                                          USE_MY_DUPLICATES_X_DAYS_AGO,
+                                                                          MAX_INCIDENTS, MAX_INDICATORS)
+            features_df = union_complete_missing_values(features_df, my_tagged_data_features).reset_index()
+
+        model = DuplicatesModel.train(features_df, set(features_df.columns).intersection(use_features))
+        store_model(model, model_name)
+    use_features = set(model.features)
+
     candidates = enrich_incidents_by_indicators(get_incidents_by_time_diff(incident.get('id'),
                                                                            incident[TIME_FIELD],
                                                                            IGNORE_CLOSED_INCIDENTS,
                                                                            MAX_INCIDENTS, TIME_DIFF_HOURS), MAX_INDICATORS)
     candidates.pop(incident['id'], None)
 
-    candidates_features_list = []
-    for candidate in candidates.values():
-        feature_dict = IncidentFeatures(incident, candidate).calculate_features()
-        feature_dict['id'] = candidate['id']
-        candidates_features_list.append(feature_dict)
-    if len(candidates_features_list) == 0:
+    candidates_features = get_candidates_features(incident, candidates.values())
+    if len(candidates_features) == 0:
         demisto.results('Did not find any duplicate incidents candidates')
         return
 
-    candidates_features = pd.DataFrame.from_dict(candidates_features_list)
     candidates_features = candidates_features.dropna(axis=0, thresh=(len(use_features) * (1 - CANDIDATES_FEATURES_NA_RATIO)))
     candidates_features_x = filter_features(candidates_features, use_features)
-    candidates_features_x = union_complete_missing_values(X, candidates_features_x, ['features', 'candidates']).loc['candidates']
     predications_prob = model.predict_proba(candidates_features_x)
-    predications = model.predict(candidates_features_x)
     result = []
-    for i in range(0, len(predications)):
+    for i in range(0, len(predications_prob)):
         incident_id = candidates_features.iloc[i]['id']
         probability = predications_prob[i][1]
         if probability >= THRESHOLD:
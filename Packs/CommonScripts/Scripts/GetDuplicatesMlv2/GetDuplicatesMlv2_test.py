@@ -1,9 +1,12 @@
+import math
+
 import demistomock as demisto
-from GetDuplicatesMlv2 import main, Utils
+import GetDuplicatesMlv2
+from GetDuplicatesMlv2 import main, Utils, IncidentFeatures, CandidatesFeatures
 from CommonServerPython import entryTypes
 
 
-def test_main(mocker):
+def get_execute_command(ml_models):
     def executeCommand(name, args=None):
         if name == 'findIndicators':
             return [
@@ -18,16 +21,28 @@ def test_main(mocker):
             ]
         elif name == 'getIncidents':
             return demisto.exampleIncidents  # use original mock
+        elif name == 'getMLModel':
+            if args['modelName'] not in ml_models:
+                return [{'Type': entryTypes['error'], 'Contents': 'model not found'}]
+            model = ml_models[args['modelName']]
+            return [{'Type': entryTypes['note'],
+                     'Contents': {'modelData': model['modelData'], 'model': {'extra': model['modelExtraInfo']}}}]
+        elif name == 'createMLModel':
+            ml_models[args['modelName']] = args
+            return [{'Type': entryTypes['note'], 'Contents': 'done'}]
         else:
             raise ValueError('Unimplemented command called: {}'.format(name))
+    return executeCommand
 
+
+def test_main(mocker):
     mocker.patch.object(demisto, 'args', return_value={
         "compareIndicators": "Email, IP, Domain, File SHA256, File MD5, URL",
         "compareEmailLabels": "Email/headers/From, Email/headers/Subject, Email/text, Email/html, Email/attachments",
         "UseLocalEnvDuplicatesInLastDays": "30"
     })
     mocker.patch.object(demisto, 'results')
-    mocker.patch.object(demisto, 'executeCommand', side_effect=executeCommand)
+    mocker.patch.object(demisto, 'executeCommand', side_effect=get_execute_command({}))
     # validate our mocks are good
     assert 'URL' in demisto.args()['compareIndicators']
     main()
@@ -42,3 +57,62 @@ def test_extract_domain_from_url():
     assert res == 'google.com'
     res = Utils.extract_domain_from_url("https://www.google.co.il")  # disable-secrets-detection
     assert res == 'google.co.il'
+
+
+def test_stored_model(mocker):
+    ml_models = {}
+    args = {
+        "compareIndicators": "Email, IP, Domain, File SHA256, File MD5, URL",
+        "compareEmailLabels": "Email/headers/From, Email/headers/Subject, Email/text, Email/html, Email/attachments",
+    }
+    mocker.patch.object(demisto, 'args', return_value=args)
+    mocker.patch.object(demisto, 'results')
+    mocker.patch.object(demisto, 'executeCommand', side_effect=get_execute_command(ml_models))
+    train = mocker.spy(GetDuplicatesMlv2.DuplicatesModel, 'train')
+    main()
+    assert len(ml_models) == 1
+    assert train.call_count == 1
+    # the next run uses the stored model
+    main()
+    assert train.call_count == 1
+    # an expired model is retrained
+    args['modelExpirationHours'] = '0'
+    main()
+    assert train.call_count == 2
+    assert len(ml_models) == 1
+
+
+def get_incident(incident_id, labels, indicators, incident_type='Phishing', severity=1, custom_fields=None,
+                 created='2019-01-01T10:00:00Z'):
+    return {'id': incident_id, 'type': incident_type, 'severity': severity, 'created': created,
+            'CustomFields': custom_fields, 'indicators': indicators,
+            'labels': [{'type': k, 'value': v} for k, v in labels.items()]}
+
+
+def test_candidates_features(mocker):
+    mocker.patch.object(GetDuplicatesMlv2, 'INDICATORS_FOR_JACCARD', ['Email', 'IP', 'Domain'])
+    incident = get_incident('1', {'Email/headers/From': 'a <a@test.com>', 'Email/headers/Subject': 'hello',
+                                  'Email/text': 'hello world', 'Instance': 'inst1', 'other': 'x'},
+                            {'Email': ['a@test.com', 'b@test.com'], 'IP': ['1.1.1.1']}, custom_fields={'f': 1})
+    candidates = [
+        get_incident('2', {'Email/headers/From': 'b <b@test.com>', 'Email/headers/Subject': 'hello again',
+                           'Email/text': 'hello there world', 'Instance': 'inst1', 'other': 'x'},
+                     {'Email': ['b@test.com'], 'IP': ['1.1.1.1', '2.2.2.2']}, custom_fields={'f': 1, 'g': [1]},
+                     created='2019-01-01T12:00:00Z'),
+        get_incident('3', {'Email/headers/Subject': 'hello', 'Instance': 'inst2'}, {'IP': ['3.3.3.3']},
+                     incident_type='Other', severity=2),
+        get_incident('4', {}, {}, created='not a date'),
+        get_incident('5', {'Email/headers/From': 'not an address', 'Email/text': ''}, {'Email': ['a@test.com']},
+                     custom_fields={'f': 2}),
+    ]
+    features = CandidatesFeatures(incident, candidates).calculate_features().set_index('id')
+    assert list(features.index) == ['2', '3', '4', '5']
+    for candidate in candidates:
+        expected = IncidentFeatures(incident, candidate).calculate_features()
+        for feature in features.columns:
+            value = features.loc[candidate['id'], feature]
+            expected_value = expected.get(feature)
+            if expected_value is None:
+                assert math.isnan(value), feature
+            else:
+                assert value == expected_value, feature
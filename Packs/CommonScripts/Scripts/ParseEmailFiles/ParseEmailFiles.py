@@ -1,15 +1,20 @@
 import demistomock as demisto
 from CommonServerPython import *
-from email import message_from_string
 from email.header import decode_header
 import base64
+import binascii
+import shutil
 from base64 import b64decode
 
 import email.utils
-from email.parser import HeaderParser
+from email.generator import Generator
+from email.feedparser import FeedParser
 import traceback
 import tempfile
 import sys
+import multiprocessing
+from functools import partial
+from Queue import Empty
 
 # -*- coding: utf-8 -*-
 # !/usr/bin/env python
@@ -43,6 +48,18 @@ sys.setdefaultencoding('utf8')  # pylint: disable=no-member
 
 MAX_DEPTH_CONST = 3
 
+# attachments are decoded into spooled temporary files, kept in memory up to this size and then rolled over to disk
+ATTACHMENT_SPOOL_MAX_MEMORY = 1024 * 1024
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+
+# optional attachments size limits in bytes (None means unlimited), set from the script arguments
+MAX_ATTACHMENT_SIZE = None
+MAX_TOTAL_ATTACHMENTS_SIZE = None
+TOTAL_ATTACHMENTS_SIZE = 0
+
+# demisto functions called while parsing an email in a batch mode worker process, collected and sent by the parent
+BATCH_COLLECTED_DEMISTO_FUNCTIONS = ('results', 'setContext', 'debug', 'info', 'error')
+
 """
 https://github.com/vikramarsid/msg_parser
 
@@ -2667,6 +2684,8 @@ RECIPIENT_HEADER_SIZE = 8
 ATTACHMENT_HEADER_SIZE = 8
 EMBEDDED_MSG_HEADER_SIZE = 24
 CONTROL_CHARS = re.compile(r'[\n\r\t]')
+# properties which may hold large binary data, read from the msg file only when the attachment is saved
+LAZY_LOADED_PROPERTIES = {'AttachDataObject'}
 
 
 class Message(object):
@@ -2674,7 +2693,7 @@ class Message(object):
      Class to store Message properties
     """
 
-    def __init__(self, directory_entries, parent_directory_path=None):
+    def __init__(self, directory_entries, parent_directory_path=None, msg_file_path=None):
 
         if parent_directory_path is None:
             parent_directory_path = []
@@ -2683,6 +2702,7 @@ class Message(object):
         self.embedded_messages = []  # type: list
         self._data_model = DataModel()
         self._parent_directory_path = parent_directory_path
+        self._msg_file_path = msg_file_path
         self._nested_attachments_depth = 0
         self.properties = self._get_properties()
         self.attachments = self._get_attachments()
@@ -2892,7 +2912,8 @@ class Message(object):
                     if kids:
                         embedded_message = Message(
                             property_entry.kids_dict,
-                            self._parent_directory_path + [directory_name, property_entry.name]
+                            self._parent_directory_path + [directory_name, property_entry.name],
+                            self._msg_file_path
                         )
 
                         directory_values["EmbeddedMessage"] = {
@@ -2935,6 +2956,17 @@ class Message(object):
             demisto.info('could not parse property type, skipping property "{}"'.format(property_details))
             return None
 
+        if property_name in LAZY_LOADED_PROPERTIES and self._msg_file_path:
+            try:
+                stream_size = ole_file.get_size(stream_name)
+            except (IOError, TypeError):
+                stream_size = 0
+            if not stream_size:
+                demisto.debug('Stream "{}" is empty, skipping property "{}"'.format(stream_name, property_details))
+                return None
+
+            return {property_name: OleStreamReference(self._msg_file_path, stream_name, stream_size)}
+
         try:
             raw_content = ole_file.openstream(stream_name).read()
         except IOError:
@@ -3055,6 +3087,32 @@ class Message(object):
         return u'Message [%s]' % self.properties.get('InternetMessageId', self.properties.get("Subject"))
 
 
+class OleStreamReference(object):
+    """
+     class to reference a binary stream of the msg file without holding its content in memory
+    """
+
+    def __init__(self, msg_file_path, stream_name, size):
+        self.msg_file_path = msg_file_path
+        self.stream_name = stream_name
+        self.size = size
+
+    def iter_chunks(self, chunk_size=ATTACHMENT_CHUNK_SIZE):
+        ole_file = OleFileIO(self.msg_file_path)
+        try:
+            stream = ole_file.openstream(self.stream_name)
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            ole_file.close()
+
+    def __repr__(self):
+        return 'OleStreamReference [%s]' % '/'.join(self.stream_name)
+
+
 class Recipient(object):
     """
      class to store recipient attributes
@@ -3094,12 +3152,32 @@ class Attachment(object):
             self.Filename = os.path.basename(self.Filename)
         else:
             self.Filename = '[NoFilename_Method%s]' % self.AttachMethod
-        self.data = attachment_properties.get("AttachDataObject")
+        self._data = attachment_properties.get("AttachDataObject")
         self.AttachMimeTag = attachment_properties.get("AttachMimeTag", "application/octet-stream")
         self.AttachExtension = attachment_properties.get("AttachExtension")
 
+    @property
+    def data(self):
+        if isinstance(self._data, OleStreamReference):
+            return ''.join(self._data.iter_chunks())
+        return self._data
+
+    @property
+    def data_size(self):
+        if isinstance(self._data, OleStreamReference):
+            return self._data.size
+        return len(self._data or [])
+
+    def has_data(self):
+        return self._data is not None
+
+    def iter_data_chunks(self):
+        if isinstance(self._data, OleStreamReference):
+            return self._data.iter_chunks()
+        return iter_string_chunks(self._data or '')
+
     def __repr__(self):
-        return '%s (%s / %s)' % (self.Filename, self.AttachmentSize, len(self.data or []))
+        return '%s (%s / %s)' % (self.Filename, self.AttachmentSize, self.data_size)
 
 
 class MsOxMessage(object):
@@ -3122,7 +3200,7 @@ class MsOxMessage(object):
             ole_root = ole_file.root
             kids_dict = ole_root.kids_dict
 
-            self._message = Message(kids_dict)
+            self._message = Message(kids_dict, msg_file_path=msg_file_path)
 
         finally:
             if ole_file is not None:
@@ -3339,32 +3417,204 @@ def data_to_md(email_data, email_file_name=None, parent_email_file=None, print_o
     return md
 
 
+BASE64_IGNORED_CHARS = re.compile(r'[^A-Za-z0-9+/=]')
+
+
+def size_arg_to_bytes(size_in_mb):
+    if not size_in_mb:
+        return None
+    return int(float(size_in_mb) * 1024 * 1024)
+
+
+def iter_string_chunks(s, chunk_size=ATTACHMENT_CHUNK_SIZE):
+    for start in range(0, len(s), chunk_size):
+        yield s[start:start + chunk_size]
+
+
+def iter_file_chunks(file_obj, chunk_size=ATTACHMENT_CHUNK_SIZE):
+    file_obj.seek(0)
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def iter_base64_decoded(chunks):
+    """
+      Decode base64 content given in chunks, only whole 4 characters groups are decoded on each chunk
+      and the rest is carried to the next one. Raises binascii.Error on bad padding, as a2b_base64 does.
+    """
+    remainder = ''
+    for chunk in chunks:
+        chunk = remainder + BASE64_IGNORED_CHARS.sub('', chunk)
+        complete_length = len(chunk) - len(chunk) % 4
+        remainder = chunk[complete_length:]
+        if complete_length:
+            yield binascii.a2b_base64(chunk[:complete_length])
+    if remainder:
+        yield binascii.a2b_base64(remainder)
+
+
+def iter_quoted_printable_decoded(chunks):
+    """
+      Decode quoted-printable content given in chunks, each chunk is decoded up to its last full line
+      as soft line breaks never span lines.
+    """
+    remainder = ''
+    for chunk in chunks:
+        chunk = remainder + chunk
+        lines_end = chunk.rfind('\n') + 1
+        remainder = chunk[lines_end:]
+        if lines_end:
+            yield binascii.a2b_qp(chunk[:lines_end])
+    if remainder:
+        yield binascii.a2b_qp(remainder)
+
+
+def iter_decoded_payload(part):
+    """
+      Decode the payload of a non multipart MIME part in chunks.
+      This is the chunked equivalent of part.get_payload(decode=True).
+    """
+    payload = part.get_payload()
+    if not isinstance(payload, basestring):
+        decoded_payload = part.get_payload(decode=True)
+        return iter([decoded_payload] if decoded_payload else [])
+
+    cte = part.get('content-transfer-encoding', '').lower()
+    chunks = iter_string_chunks(payload)
+    if cte == 'base64':
+        return iter_base64_decoded(chunks)
+    if cte == 'quoted-printable':
+        return iter_quoted_printable_decoded(chunks)
+    if cte in ('x-uuencode', 'uuencode', 'uue', 'x-uue'):
+        return iter([part.get_payload(decode=True)])
+    return chunks
+
+
+def is_attachment_size_exceeded(attachment_size):
+    if MAX_ATTACHMENT_SIZE is not None and attachment_size > MAX_ATTACHMENT_SIZE:
+        return True
+    if MAX_TOTAL_ATTACHMENTS_SIZE is not None \
+            and TOTAL_ATTACHMENTS_SIZE + attachment_size > MAX_TOTAL_ATTACHMENTS_SIZE:
+        return True
+    return False
+
+
+def spool_chunks(chunks, attachment_name):
+    """
+      Write the attachment chunks into a spooled temporary file while enforcing the attachments size limits.
+
+      Returns the spooled file positioned at its start or None if the attachment exceeded the size limits.
+    """
+    global TOTAL_ATTACHMENTS_SIZE
+
+    spooled_file = tempfile.SpooledTemporaryFile(max_size=ATTACHMENT_SPOOL_MAX_MEMORY)
+    attachment_size = 0
+    try:
+        for chunk in chunks:
+            attachment_size += len(chunk)
+            if is_attachment_size_exceeded(attachment_size):
+                spooled_file.close()
+                demisto.info('Attachment "{}" exceeds the attachments size limit, skipping it'.format(attachment_name))
+                return_outputs(readable_output='Attachment "{}" was not saved as it exceeds the attachments size '
+                                               'limit.'.format(attachment_name), outputs=None)
+                return None
+            spooled_file.write(chunk)
+    except Exception:
+        spooled_file.close()
+        raise
+
+    TOTAL_ATTACHMENTS_SIZE += attachment_size
+    spooled_file.seek(0)
+    return spooled_file
+
+
+def spool_part(part, attachment_name):
+    try:
+        return spool_chunks(iter_decoded_payload(part), attachment_name)
+    except binascii.Error:
+        # the email package returns the payload as is when it can not be decoded
+        return spool_chunks(iter_string_chunks(part.get_payload(decode=True) or ''), attachment_name)
+
+
+def spool_message(message, base64_encoded, attachment_name):
+    flattened_file = tempfile.SpooledTemporaryFile(max_size=ATTACHMENT_SPOOL_MAX_MEMORY)
+    try:
+        # same as message.as_string() without holding the whole string in memory
+        Generator(flattened_file).flatten(message)
+        if base64_encoded:
+            try:
+                return spool_chunks(iter_base64_decoded(iter_file_chunks(flattened_file)), attachment_name)
+            except binascii.Error:
+                pass  # In case the file is a string, decode=True for get_payload is not working
+        return spool_chunks(iter_file_chunks(flattened_file), attachment_name)
+    finally:
+        flattened_file.close()
+
+
+def get_stream_size(stream):
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def save_stream_to_temp_file(stream):
+    tf = tempfile.NamedTemporaryFile(delete=False)
+    try:
+        stream.seek(0)
+        shutil.copyfileobj(stream, tf, ATTACHMENT_CHUNK_SIZE)
+    finally:
+        tf.close()
+        stream.seek(0)
+    return tf.name
+
+
+def file_result_from_stream(filename, stream):
+    """
+      Same as fileResult, but copies the file content from a stream instead of getting it as a string
+    """
+    temp = demisto.uniqueFile()
+    stream.seek(0)
+    with open(demisto.investigation()['id'] + '_' + temp, 'wb') as f:
+        shutil.copyfileobj(stream, f, ATTACHMENT_CHUNK_SIZE)
+    stream.seek(0)
+    return {'Contents': '', 'ContentsFormat': formats['text'], 'Type': entryTypes['file'], 'File': filename,
+            'FileID': temp}
+
+
 def save_attachments(attachments, root_email_file_name, max_depth):
     attached_emls = []
     for attachment in attachments:
-        if attachment.data is not None:
+        if attachment.has_data():
             display_name = attachment.DisplayName if attachment.DisplayName else attachment.AttachFilename
             display_name = display_name if display_name else ''
-            demisto.results(fileResult(display_name, attachment.data))
-            name_lower = display_name.lower()
-            if max_depth > 0 and (name_lower.endswith(".eml") or name_lower.endswith('.p7m')):
-                tf = tempfile.NamedTemporaryFile(delete=False)
-
-                try:
-                    tf.write(attachment.data)
-                    tf.close()
-
-                    inner_eml, attached_inner_emails = handle_eml(tf.name, file_name=root_email_file_name,
-                                                                  max_depth=max_depth)
-                    if inner_eml:
-                        return_outputs(
-                            readable_output=data_to_md(inner_eml, attachment.DisplayName, root_email_file_name),
-                            outputs=None)
-                        attached_emls.append(inner_eml)
-                    if attached_inner_emails:
-                        attached_emls.extend(attached_inner_emails)
-                finally:
-                    os.remove(tf.name)
+            attachment_file = spool_chunks(attachment.iter_data_chunks(), display_name)
+            if attachment_file is None:
+                continue
+
+            try:
+                demisto.results(file_result_from_stream(display_name, attachment_file))
+                name_lower = display_name.lower()
+                if max_depth > 0 and (name_lower.endswith(".eml") or name_lower.endswith('.p7m')):
+                    tf_name = save_stream_to_temp_file(attachment_file)
+
+                    try:
+                        inner_eml, attached_inner_emails = handle_eml(tf_name, file_name=root_email_file_name,
+                                                                      max_depth=max_depth)
+                        if inner_eml:
+                            return_outputs(
+                                readable_output=data_to_md(inner_eml, attachment.DisplayName, root_email_file_name),
+                                outputs=None)
+                            attached_emls.append(inner_eml)
+                        if attached_inner_emails:
+                            attached_emls.extend(attached_inner_emails)
+                    finally:
+                        os.remove(tf_name)
+            finally:
+                attachment_file.close()
 
     return attached_emls
 
@@ -3486,6 +3736,37 @@ def decode_content(mime):
         return payload
 
 
+def iter_eml_file_chunks(eml_file, b64=False, bom=False):
+    """
+      Yields the content of an eml file in chunks, base64 decoded and without the UTF-8 BOM if needed.
+    """
+    chunks = iter_file_chunks(eml_file)
+    if b64:
+        chunks = iter_base64_decoded(chunks)
+    if not bom:
+        for chunk in chunks:
+            yield chunk
+        return
+    # decode bytes taking into account BOM and re-encode to utf-8
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    for chunk in chunks:
+        yield decoder.decode(chunk).encode('utf-8')
+    yield decoder.decode('', final=True).encode('utf-8')
+
+
+def parse_eml_file(eml_file, b64=False, bom=False, headers_only=False):
+    """
+      Parses an eml file by feeding it to the email parser in chunks, so the raw file is never held in memory
+      as a whole next to the parsed message. The parsed message still holds the encoded payload of every part.
+    """
+    parser = FeedParser()
+    if headers_only:
+        parser._set_headersonly()
+    for chunk in iter_eml_file_chunks(eml_file, b64, bom):
+        parser.feed(chunk)
+    return parser.close()
+
+
 def handle_eml(file_path, b64=False, file_name=None, parse_only_headers=False, max_depth=3, bom=False):
     global ENCODINGS_TYPES
 
@@ -3493,20 +3774,11 @@ def handle_eml(file_path, b64=False, file_name=None, parse_only_headers=False, m
         return None, []
 
     with open(file_path, 'rb') as emlFile:
-
-        file_data = emlFile.read()
-        if b64:
-            file_data = b64decode(file_data)
-        if bom:
-            # decode bytes taking into account BOM and re-encode to utf-8
-            file_data = file_data.decode("utf-8-sig").encode("utf-8")
-
-        parser = HeaderParser()
-        headers = parser.parsestr(file_data)
+        eml = parse_eml_file(emlFile, b64, bom, headers_only=parse_only_headers)
 
         header_list = []
         headers_map = {}  # type: dict
-        for item in headers.items():
+        for item in eml.items():
             value = unfold(convert_to_unicode(item[1]))
             item_dict = {
                 "name": item[0],
@@ -3529,7 +3801,6 @@ def handle_eml(file_path, b64=False, file_name=None, parse_only_headers=False, m
             else:
                 headers_map[item[0]] = value
 
-        eml = message_from_string(file_data)
         if not eml:
             raise Exception("Could not parse eml file!")
 
@@ -3562,7 +3833,7 @@ def handle_eml(file_path, b64=False, file_name=None, parse_only_headers=False, m
                             and attachment_file_name.endswith(".eml")):
 
                     # .eml files
-                    file_content = ""  # type: str
+                    attachment_file = None
                     base64_encoded = "base64" in part.get("Content-Transfer-Encoding", "")
 
                     if isinstance(part.get_payload(), list) and len(part.get_payload()) > 0:
@@ -3573,40 +3844,38 @@ def handle_eml(file_path, b64=False, file_name=None, parse_only_headers=False, m
                             attachment_name = part.get_payload()[0].get('Subject', "no_name_mail_attachment")
                             attachment_file_name = convert_to_unicode(attachment_name) + '.eml'
 
-                        file_content = part.get_payload()[0].as_string()
-                        if base64_encoded:
-                            try:
-                                file_content = b64decode(file_content)
-
-                            except TypeError:
-                                pass  # In case the file is a string, decode=True for get_payload is not working
+                        attachment_file = spool_message(part.get_payload()[0], base64_encoded, attachment_file_name)
 
                     elif isinstance(part.get_payload(), basestring) and base64_encoded:
-                        file_content = part.get_payload(decode=True)
+                        attachment_file = spool_part(part, attachment_file_name)
                     else:
                         demisto.debug("found eml attachment with Content-Type=message/rfc822 but has no payload")
 
-                    if file_content:
-                        # save the eml to war room as file entry
-                        demisto.results(fileResult(attachment_file_name, file_content))
-
-                    if file_content and max_depth - 1 > 0:
-                        f = tempfile.NamedTemporaryFile(delete=False)
+                    if attachment_file is not None:
                         try:
-                            f.write(file_content)
-                            f.close()
-                            inner_eml, inner_attached_emails = handle_eml(file_path=f.name,
-                                                                          file_name=attachment_file_name,
-                                                                          max_depth=max_depth - 1)
-                            attached_emails.append(inner_eml)
-                            attached_emails.extend(inner_attached_emails)
-                            # if we are outter email is a singed attachment it is a wrapper and we don't return the output of
-                            # this inner email as it will be returned as part of the main result
-                            if 'multipart/signed' not in eml.get_content_type():
-                                return_outputs(readable_output=data_to_md(inner_eml, attachment_file_name, file_name),
-                                               outputs=None)
+                            if get_stream_size(attachment_file):
+                                # save the eml to war room as file entry
+                                demisto.results(file_result_from_stream(attachment_file_name, attachment_file))
+
+                                if max_depth - 1 > 0:
+                                    tf_name = save_stream_to_temp_file(attachment_file)
+                                    try:
+                                        inner_eml, inner_attached_emails = handle_eml(file_path=tf_name,
+                                                                                      file_name=attachment_file_name,
+                                                                                      max_depth=max_depth - 1)
+                                        attached_emails.append(inner_eml)
+                                        attached_emails.extend(inner_attached_emails)
+                                        # if we are outter email is a singed attachment it is a wrapper and we don't
+                                        # return the output of this inner email as it will be returned as part of the
+                                        # main result
+                                        if 'multipart/signed' not in eml.get_content_type():
+                                            return_outputs(
+                                                readable_output=data_to_md(inner_eml, attachment_file_name, file_name),
+                                                outputs=None)
+                                    finally:
+                                        os.remove(tf_name)
                         finally:
-                            os.remove(f.name)
+                            attachment_file.close()
                     attachment_names.append(attachment_file_name)
                 else:
                     # .msg and other files (png, jpeg)
@@ -3630,27 +3899,29 @@ def handle_eml(file_path, b64=False, file_name=None, parse_only_headers=False, m
                             i += 1
 
                     else:
-                        file_content = part.get_payload(decode=True)
-                        # fileResult will return an error if file_content is None.
-                        if file_content and not attachment_file_name.endswith('.p7s'):
-                            demisto.results(fileResult(attachment_file_name, file_content))
-
-                        if attachment_file_name.endswith(".msg") and max_depth - 1 > 0:
-                            f = tempfile.NamedTemporaryFile(delete=False)
+                        attachment_file = spool_part(part, attachment_file_name)
+                        if attachment_file is not None:
                             try:
-                                f.write(file_content)
-                                f.close()
-                                inner_msg, inner_attached_emails = handle_msg(f.name, attachment_file_name, False,
-                                                                              max_depth - 1)
-                                attached_emails.append(inner_msg)
-                                attached_emails.extend(inner_attached_emails)
-
-                                # will output the inner email to the UI
-                                return_outputs(
-                                    readable_output=data_to_md(inner_msg, attachment_file_name, file_name),
-                                    outputs=None)
+                                # an empty attachment is not saved to the war room.
+                                if get_stream_size(attachment_file) and not attachment_file_name.endswith('.p7s'):
+                                    demisto.results(file_result_from_stream(attachment_file_name, attachment_file))
+
+                                if attachment_file_name.endswith(".msg") and max_depth - 1 > 0:
+                                    tf_name = save_stream_to_temp_file(attachment_file)
+                                    try:
+                                        inner_msg, inner_attached_emails = handle_msg(tf_name, attachment_file_name,
+                                                                                      False, max_depth - 1)
+                                        attached_emails.append(inner_msg)
+                                        attached_emails.extend(inner_attached_emails)
+
+                                        # will output the inner email to the UI
+                                        return_outputs(
+                                            readable_output=data_to_md(inner_msg, attachment_file_name, file_name),
+                                            outputs=None)
+                                    finally:
+                                        os.remove(tf_name)
                             finally:
-                                os.remove(f.name)
+                                attachment_file.close()
 
                         attachment_names.append(attachment_file_name)
                 demisto.setContext('AttachmentName', attachment_file_name)
@@ -3711,9 +3982,301 @@ def is_email_data_populated(email_data):
     return False
 
 
+class EmailParseError(Exception):
+    pass
+
+
+def get_file_type(file_metadata):
+    file_type = file_metadata.get('info', '') or file_metadata.get('type', '')
+    if 'MIME entity text, ISO-8859 text' in file_type:
+        file_type = 'application/pkcs7-mime'
+    return file_type
+
+
+def parse_email_file(file_path, file_name, file_type, parse_only_headers, max_depth):
+    """
+      Parses an email file according to its type.
+
+      Returns the email output (a single email or a list of the email and its attached emails).
+      Raises EmailParseError with the error to return when the file could not be parsed as an email.
+    """
+    output = None
+    file_type_lower = file_type.lower()
+    if 'composite document file v2 document' in file_type_lower \
+            or 'cdfv2 microsoft outlook message' in file_type_lower:
+        email_data, attached_emails = handle_msg(file_path, file_name, parse_only_headers, max_depth)
+        output = create_email_output(email_data, attached_emails)
+
+    elif any(eml_candidate in file_type_lower for eml_candidate in
+             ['rfc 822 mail', 'smtp mail', 'multipart/signed', 'message/rfc822', 'application/pkcs7-mime']):
+        if 'unicode (with bom) text' in file_type_lower:
+            email_data, attached_emails = handle_eml(
+                file_path, False, file_name, parse_only_headers, max_depth, bom=True
+            )
+        else:
+            email_data, attached_emails = handle_eml(file_path, False, file_name, parse_only_headers, max_depth)
+        output = create_email_output(email_data, attached_emails)
+
+    elif ('ascii text' in file_type_lower or 'unicode text' in file_type_lower
+          or ('data' == file_type_lower.strip() and file_name and file_name.lower().strip().endswith('.eml'))):
+        try:
+            # Try to open the email as-is
+            with open(file_path, 'rb') as f:
+                file_contents = f.read()
+            has_content_type = bool(file_contents) and 'Content-Type:'.lower() in file_contents.lower()
+            if not has_content_type:
+                # Try a base64 decode
+                b64decode(file_contents)
+            # handle_eml reads the file again in chunks, so its content is not kept in memory meanwhile
+            del file_contents
+
+            if has_content_type:
+                email_data, attached_emails = handle_eml(file_path, b64=False, file_name=file_name,
+                                                         parse_only_headers=parse_only_headers, max_depth=max_depth)
+                output = create_email_output(email_data, attached_emails)
+            else:
+                if has_content_type:
+                    email_data, attached_emails = handle_eml(file_path, b64=True, file_name=file_name,
+                                                             parse_only_headers=parse_only_headers,
+                                                             max_depth=max_depth)
+                    output = create_email_output(email_data, attached_emails)
+                else:
+                    try:
+                        # Try to open
+                        email_data, attached_emails = handle_eml(file_path, b64=False, file_name=file_name,
+                                                                 parse_only_headers=parse_only_headers,
+                                                                 max_depth=max_depth)
+                        is_data_populated = is_email_data_populated(email_data)
+                        if not is_data_populated:
+                            raise DemistoException("No email_data found")
+                        output = create_email_output(email_data, attached_emails)
+                    except Exception as e:
+                        demisto.debug("ParseEmailFiles failed with {}".format(str(e)))
+                        raise EmailParseError("Could not extract email from file. Possible reasons for this error are:\n"
+                                              "- Base64 decode did not include rfc 822 strings.\n"
+                                              "- Email contained no Content-Type and no data.")
+
+        except EmailParseError:
+            raise
+        except Exception as e:
+            raise EmailParseError("Exception while trying to decode email from within base64: {}\n\nTrace:\n{}"
+                                  .format(str(e), traceback.format_exc()))
+    else:
+        raise EmailParseError("Unknown file format: [{}] for file: [{}]".format(file_type, file_name))
+    return recursive_convert_to_unicode(output)
+
+
+def get_message_id(email_data):
+    if not isinstance(email_data, dict):
+        return None
+    for header_name, header_value in (email_data.get('HeadersMap') or {}).items():
+        if header_name.lower() == 'message-id':
+            if isinstance(header_value, list):
+                header_value = header_value[0] if header_value else None
+            return header_value.strip() if header_value else None
+    return None
+
+
+def get_file_entries(entry_ids):
+    """
+      Resolves the path, name and type of the email file entries of the batch mode.
+      The metadata of the investigation attachments is fetched with a single getEntries call,
+      getEntry is used only for entries which are not found there (e.g. entries of other investigations).
+
+      Returns a list of file entries, entries which could not be resolved hold an Error.
+    """
+    entries = demisto.executeCommand('getEntries', {'filter': {'categories': ['attachments']}})
+    if is_error(entries) or not isinstance(entries, list):
+        demisto.debug('Could not get the investigation attachments: {}'.format(entries))
+        entries = []
+    file_metadata_by_id = {entry.get('ID'): entry.get('FileMetadata') for entry in entries
+                           if isinstance(entry, dict) and entry.get('FileMetadata')}
+
+    file_entries = []
+    for entry_id in entry_ids:
+        try:
+            file_metadata = file_metadata_by_id.get(entry_id)
+            if file_metadata is None:
+                result = demisto.executeCommand('getEntry', {'id': entry_id})
+                if is_error(result):
+                    raise DemistoException(get_error(result))
+                file_metadata = result[0]['FileMetadata']
+
+            file_info = demisto.getFilePath(entry_id)
+            file_entries.append({
+                'EntryID': entry_id,
+                'Path': file_info['path'],
+                'Name': file_info['name'],
+                'Type': get_file_type(file_metadata)
+            })
+        except Exception as ex:
+            file_entries.append({
+                'EntryID': entry_id,
+                'Error': 'Failed to load file entry with entry id: {}. Error: {}'.format(entry_id, str(ex))
+            })
+    return file_entries
+
+
+def collect_demisto_call(collected_calls, function_name, *args, **kwargs):
+    collected_calls.append((function_name, args, kwargs))
+
+
+def parse_email_entry(file_entry, parse_only_headers, max_depth):
+    """
+      Parses a single email file entry of the batch mode.
+
+      This runs in a worker process which must not interact with the server, so the war room entries, context
+      updates and logs made while parsing are collected and returned to be sent by the parent process.
+    """
+    global TOTAL_ATTACHMENTS_SIZE
+    # in batch mode the attachments size limits apply to each email file separately
+    TOTAL_ATTACHMENTS_SIZE = 0
+
+    collected_calls = []  # type: list
+    original_functions = {}
+    for function_name in BATCH_COLLECTED_DEMISTO_FUNCTIONS:
+        original_functions[function_name] = getattr(demisto, function_name)
+        setattr(demisto, function_name, partial(collect_demisto_call, collected_calls, function_name))
+
+    result = {'EntryID': file_entry['EntryID'], 'Name': file_entry.get('Name'), 'Output': None,
+              'Error': file_entry.get('Error')}
+    try:
+        if not result['Error']:
+            result['Output'] = parse_email_file(file_entry['Path'], file_entry['Name'], file_entry['Type'],
+                                                parse_only_headers, max_depth)
+    except EmailParseError as ex:
+        result['Error'] = str(ex)
+    except Exception as ex:
+        demisto.error(str(ex) + "\n\nTrace:\n" + traceback.format_exc())
+        result['Error'] = str(ex)
+    finally:
+        for function_name, function in original_functions.items():
+            setattr(demisto, function_name, function)
+
+    result['DemistoCalls'] = collected_calls
+    return result
+
+
+def parse_email_entries_worker(indexed_file_entries, results_queue, parse_only_headers, max_depth):
+    for index, file_entry in indexed_file_entries:
+        results_queue.put((index, parse_email_entry(file_entry, parse_only_headers, max_depth)))
+
+
+def parse_email_entries_in_processes(file_entries, parse_only_headers, max_depth, max_workers):
+    """
+      Parses the email file entries over a pool of forked worker processes.
+
+      Processes are used directly rather than multiprocessing.Pool as the script functions can not be pickled,
+      only the parsing results are sent back over the queue.
+    """
+    workers_count = max(1, min(max_workers, len(file_entries)))
+    if workers_count == 1:
+        return [parse_email_entry(file_entry, parse_only_headers, max_depth) for file_entry in file_entries]
+
+    results_queue = multiprocessing.Queue()
+    indexed_file_entries = list(enumerate(file_entries))
+    workers = [
+        multiprocessing.Process(
+            target=parse_email_entries_worker,
+            args=(indexed_file_entries[i::workers_count], results_queue, parse_only_headers, max_depth)
+        )
+        for i in range(workers_count)
+    ]
+    for worker in workers:
+        worker.start()
+
+    results = [None] * len(file_entries)  # type: list
+    pending = len(file_entries)
+    while pending:
+        try:
+            index, result = results_queue.get(timeout=1)
+        except Empty:
+            if not any(worker.is_alive() for worker in workers) and results_queue.empty():
+                break
+            continue
+        results[index] = result
+        pending -= 1
+
+    for worker in workers:
+        worker.join()
+
+    for index, file_entry in enumerate(file_entries):
+        if results[index] is None:
+            results[index] = {'EntryID': file_entry['EntryID'], 'Name': file_entry.get('Name'), 'Output': None,
+                              'Error': 'The email parsing worker process terminated unexpectedly.',
+                              'DemistoCalls': []}
+    return results
+
+
+def merge_batch_outputs(results):
+    """
+      Combines the outputs of all the parsed email files, keeping a single email for each Message-ID.
+      Emails without a Message-ID are always kept.
+    """
+    emails = []
+    message_ids = set()
+    duplicates_count = 0
+    for result in results:
+        output = result['Output']
+        if output is None:
+            continue
+        for email_data in (output if isinstance(output, list) else [output]):
+            message_id = get_message_id(email_data)
+            if message_id:
+                if message_id in message_ids:
+                    duplicates_count += 1
+                    continue
+                message_ids.add(message_id)
+            emails.append(email_data)
+    return emails, duplicates_count
+
+
+def parse_email_entries_batch(entry_ids, parse_only_headers, max_depth, max_workers):
+    file_entries = get_file_entries(entry_ids)
+    results = parse_email_entries_in_processes(file_entries, parse_only_headers, max_depth, max_workers)
+
+    rows = []
+    for result in results:
+        # send the war room entries, context updates and logs collected while parsing
+        for function_name, args, kwargs in result['DemistoCalls']:
+            getattr(demisto, function_name)(*args, **kwargs)
+
+        output = result['Output']
+        email_data = output[0] if isinstance(output, list) and output else output
+        email_data = email_data if isinstance(email_data, dict) else {}
+        rows.append({
+            'EntryID': result['EntryID'],
+            'File Name': result['Name'],
+            'Subject': email_data.get('Subject'),
+            'From': email_data.get('From'),
+            'Message-ID': get_message_id(email_data),
+            'Error': result['Error']
+        })
+
+    failed_results = [result for result in results if result['Error']]
+    if len(failed_results) == len(results):
+        return_error('Failed to parse all the email files:\n{}'.format(
+            '\n'.join('{}: {}'.format(result['EntryID'], result['Error']) for result in failed_results)))
+
+    emails, duplicates_count = merge_batch_outputs(results)
+    readable_output = tableToMarkdown('Parsed {} email files'.format(len(results)), rows,
+                                      headers=['EntryID', 'File Name', 'Subject', 'From', 'Message-ID', 'Error'],
+                                      removeNull=True)
+    if duplicates_count:
+        readable_output += '\n{} duplicate emails with the same Message-ID were omitted.'.format(duplicates_count)
+
+    return_outputs(
+        readable_output=readable_output,
+        outputs={
+            'Email': emails
+        },
+        raw_response=emails
+    )
+
+
 def main():
     file_type = ''
-    entry_id = demisto.args()['entryid']
+    entry_ids = argToList(demisto.args()['entryid'])
     max_depth = int(demisto.args().get('max_depth', '3'))
 
     # we use the MAX_DEPTH_CONST to calculate the depth of the email
@@ -3722,10 +4285,26 @@ def main():
     global MAX_DEPTH_CONST
     MAX_DEPTH_CONST = max_depth
 
+    global MAX_ATTACHMENT_SIZE, MAX_TOTAL_ATTACHMENTS_SIZE, TOTAL_ATTACHMENTS_SIZE
+    TOTAL_ATTACHMENTS_SIZE = 0
+    MAX_ATTACHMENT_SIZE = size_arg_to_bytes(demisto.args().get('max_attachment_size'))
+    MAX_TOTAL_ATTACHMENTS_SIZE = size_arg_to_bytes(demisto.args().get('max_total_attachments_size'))
+
     if max_depth < 1:
         return_error('Minimum max_depth is 1, the script will parse just the top email')
 
     parse_only_headers = demisto.args().get('parse_only_headers', 'false').lower() == 'true'
+
+    if len(entry_ids) > 1:
+        max_workers = int(demisto.args().get('max_workers') or multiprocessing.cpu_count())
+        try:
+            parse_email_entries_batch(entry_ids, parse_only_headers, max_depth, max_workers)
+        except Exception as ex:
+            demisto.error(str(ex) + "\n\nTrace:\n" + traceback.format_exc())
+            return_error(str(ex) + "\n\nTrace:\n" + traceback.format_exc())
+        return
+
+    entry_id = entry_ids[0]
     try:
         result = demisto.executeCommand('getFilePath', {'id': entry_id})
         if is_error(result):
@@ -3737,10 +4316,7 @@ def main():
         if is_error(result):
             return_error(get_error(result))
 
-        file_metadata = result[0]['FileMetadata']
-        file_type = file_metadata.get('info', '') or file_metadata.get('type', '')
-        if 'MIME entity text, ISO-8859 text' in file_type:
-            file_type = 'application/pkcs7-mime'
+        file_type = get_file_type(result[0]['FileMetadata'])
 
     except Exception as ex:
         return_error(
@@ -3748,63 +4324,11 @@ def main():
                 entry_id, str(ex) + "\n\nTrace:\n" + traceback.format_exc()))
 
     try:
-        file_type_lower = file_type.lower()
-        if 'composite document file v2 document' in file_type_lower \
-                or 'cdfv2 microsoft outlook message' in file_type_lower:
-            email_data, attached_emails = handle_msg(file_path, file_name, parse_only_headers, max_depth)
-            output = create_email_output(email_data, attached_emails)
-
-        elif any(eml_candidate in file_type_lower for eml_candidate in
-                 ['rfc 822 mail', 'smtp mail', 'multipart/signed', 'message/rfc822', 'application/pkcs7-mime']):
-            if 'unicode (with bom) text' in file_type_lower:
-                email_data, attached_emails = handle_eml(
-                    file_path, False, file_name, parse_only_headers, max_depth, bom=True
-                )
-            else:
-                email_data, attached_emails = handle_eml(file_path, False, file_name, parse_only_headers, max_depth)
-            output = create_email_output(email_data, attached_emails)
-
-        elif ('ascii text' in file_type_lower or 'unicode text' in file_type_lower
-              or ('data' == file_type_lower.strip() and file_name and file_name.lower().strip().endswith('.eml'))):
-            try:
-                # Try to open the email as-is
-                with open(file_path, 'rb') as f:
-                    file_contents = f.read()
+        try:
+            output = parse_email_file(file_path, file_name, file_type, parse_only_headers, max_depth)
+        except EmailParseError as ex:
+            return_error(str(ex))
 
-                if file_contents and 'Content-Type:'.lower() in file_contents.lower():
-                    email_data, attached_emails = handle_eml(file_path, b64=False, file_name=file_name,
-                                                             parse_only_headers=parse_only_headers, max_depth=max_depth)
-                    output = create_email_output(email_data, attached_emails)
-                else:
-                    # Try a base64 decode
-                    b64decode(file_contents)
-                    if file_contents and 'Content-Type:'.lower() in file_contents.lower():
-                        email_data, attached_emails = handle_eml(file_path, b64=True, file_name=file_name,
-                                                                 parse_only_headers=parse_only_headers,
-                                                                 max_depth=max_depth)
-                        output = create_email_output(email_data, attached_emails)
-                    else:
-                        try:
-                            # Try to open
-                            email_data, attached_emails = handle_eml(file_path, b64=False, file_name=file_name,
-                                                                     parse_only_headers=parse_only_headers,
-                                                                     max_depth=max_depth)
-                            is_data_populated = is_email_data_populated(email_data)
-                            if not is_data_populated:
-                                raise DemistoException("No email_data found")
-                            output = create_email_output(email_data, attached_emails)
-                        except Exception as e:
-                            demisto.debug("ParseEmailFiles failed with {}".format(str(e)))
-                            return_error("Could not extract email from file. Possible reasons for this error are:\n"
-                                         "- Base64 decode did not include rfc 822 strings.\n"
-                                         "- Email contained no Content-Type and no data.")
-
-            except Exception as e:
-                return_error("Exception while trying to decode email from within base64: {}\n\nTrace:\n{}"
-                             .format(str(e), traceback.format_exc()))
-        else:
-            return_error("Unknown file format: [{}] for file: [{}]".format(file_type, file_name))
-        output = recursive_convert_to_unicode(output)
         email = output  # output may be a single email
         if isinstance(output, list) and len(output) > 0:
             email = output[0]
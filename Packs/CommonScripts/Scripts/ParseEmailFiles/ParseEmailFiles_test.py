@@ -941,3 +941,183 @@ def test_PtypString():
 
     data_value = DataModel.PtypString(b'e\x9c\xe6\xb9pe')
     assert data_value == u'eśćąpe'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 4, 7, 1024])
+def test_iter_base64_decoded(chunk_size):
+    """
+    Given: A base64 encoded payload with line breaks, split into chunks of different sizes.
+    When: Decoding the payload chunk by chunk.
+    Then: The decoded content is the same as decoding the whole payload at once.
+    """
+    from base64 import encodestring
+    from ParseEmailFiles import iter_base64_decoded, iter_string_chunks
+
+    content = ''.join(chr(i % 256) for i in range(3000))
+    encoded = encodestring(content)
+    assert ''.join(iter_base64_decoded(iter_string_chunks(encoded, chunk_size))) == content
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1024])
+def test_iter_quoted_printable_decoded(chunk_size):
+    from quopri import encodestring
+    from ParseEmailFiles import iter_quoted_printable_decoded, iter_string_chunks
+
+    content = u'שלום world = a very long line to make sure soft line breaks are added ' * 10
+    encoded = encodestring(content.encode('utf-8'))
+    assert ''.join(iter_quoted_printable_decoded(iter_string_chunks(encoded, chunk_size))) == content.encode('utf-8')
+
+
+def test_eml_attachment_exceeds_size_limit(mocker):
+    """
+    Given: An email containing an htm attachment.
+    When: Parsing the email with a max_attachment_size smaller than the attachment.
+    Then: The attachment is not saved to the war room but is still listed in the email attachments.
+    """
+    mocker.patch.object(demisto, 'args', return_value={'entryid': 'test', 'max_attachment_size': '0.00001'})
+    mocker.patch.object(demisto, 'executeCommand', side_effect=exec_command_for_file('eml_contains_htm_attachment.eml'))
+    mocker.patch.object(demisto, 'results')
+    main()
+
+    results = [call[0][0] for call in demisto.results.call_args_list]
+    assert not [result for result in results if result['Type'] == entryTypes['file']]
+    assert 'exceeds the attachments size limit' in results[0]['HumanReadable']
+    assert results[-1]['EntryContext']['Email'][u'Attachments'] == '1.htm'
+
+
+def test_eml_file_read_in_chunks(mocker, tmpdir):
+    """
+    Given: An email with a 5MB base64 encoded attachment.
+    When: Parsing the email.
+    Then: The eml file is read in chunks and never as a whole, and the attachment is saved intact.
+    """
+    from base64 import encodestring
+    from ParseEmailFiles import handle_eml, ATTACHMENT_CHUNK_SIZE
+
+    content = ''.join(chr(i % 256) for i in range(5 * 1024 * 1024))
+    eml_path = str(tmpdir.join('large_attachment.eml'))
+    with open(eml_path, 'wb') as f:
+        f.write('From: sender@test.com\r\nTo: receiver@test.com\r\nSubject: large attachment\r\n'
+                'MIME-Version: 1.0\r\nContent-Type: multipart/mixed; boundary="BOUNDARY"\r\n\r\n'
+                '--BOUNDARY\r\nContent-Type: text/plain\r\n\r\nbody\r\n'
+                '--BOUNDARY\r\nContent-Type: application/octet-stream\r\n'
+                'Content-Disposition: attachment; filename="large.bin"\r\n'
+                'Content-Transfer-Encoding: base64\r\n\r\n')
+        f.write(encodestring(content))
+        f.write('--BOUNDARY--\r\n')
+
+    read_sizes = []
+
+    class ReadRecorder(object):
+        def __init__(self, file_obj):
+            self.file_obj = file_obj
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.file_obj.close()
+
+        def __getattr__(self, name):
+            return getattr(self.file_obj, name)
+
+        def read(self, size=-1):
+            data = self.file_obj.read(size)
+            read_sizes.append(len(data))
+            return data
+
+    def recording_open(path, *args, **kwargs):
+        file_obj = open(path, *args, **kwargs)
+        return ReadRecorder(file_obj) if path == eml_path else file_obj
+
+    mocker.patch('ParseEmailFiles.open', create=True, side_effect=recording_open)
+    mocker.patch('ParseEmailFiles.MAX_ATTACHMENT_SIZE', None)
+    mocker.patch('ParseEmailFiles.MAX_TOTAL_ATTACHMENTS_SIZE', None)
+    saved_files = []
+    mocker.patch.object(demisto, 'results', side_effect=saved_files.append)
+    mocker.patch.object(demisto, 'uniqueFile', return_value='large_attachment_file')
+    mocker.patch.object(demisto, 'investigation', return_value={'id': str(tmpdir.join('inv'))})
+
+    email_data, _ = handle_eml(eml_path, file_name='large_attachment.eml')
+
+    assert email_data['Subject'] == 'large attachment'
+    assert email_data['Attachments'] == 'large.bin'
+    assert read_sizes and max(read_sizes) <= ATTACHMENT_CHUNK_SIZE
+    assert [result['File'] for result in saved_files] == ['large.bin']
+    with open(str(tmpdir.join('inv_large_attachment_file')), 'rb') as f:
+        assert f.read() == content
+
+
+def exec_command_for_entries(entries):
+    """
+    Return a executeCommand function which returns the passed entries (entry id to file name in the test_data dir)
+    as the investigation attachments to the call 'getEntries'
+    """
+    def executeCommand(name, args=None):
+        if name == 'getEntries':
+            return [
+                {
+                    'ID': entry_id,
+                    'Type': entryTypes['file'],
+                    'FileMetadata': {
+                        'info': 'RFC 822 mail text, with CRLF line terminators'
+                    }
+                }
+                for entry_id in entries
+            ]
+        raise ValueError('Unimplemented command called: {}'.format(name))
+
+    def getFilePath(entry_id):
+        return {'path': 'test_data/' + entries[entry_id], 'name': entries[entry_id]}
+
+    return executeCommand, getFilePath
+
+
+@pytest.mark.parametrize('max_workers', ['1', '2'])
+def test_batch_mode_deduplicates_by_message_id(mocker, max_workers):
+    """
+    Given: Three email file entries, two of them are the same email.
+    When: Parsing them in batch mode.
+    Then: The emails are combined into a single output with one email for each Message-ID,
+          and the attachments of all the emails are returned to the war room.
+    """
+    entries = {
+        '1@1': 'eml_contains_htm_attachment.eml',
+        '2@1': 'multiple_to_cc.eml',
+        '3@1': 'eml_contains_htm_attachment.eml',
+    }
+    execute_command, get_file_path = exec_command_for_entries(entries)
+    mocker.patch.object(demisto, 'args', return_value={'entryid': '1@1,2@1,3@1', 'max_workers': max_workers})
+    mocker.patch.object(demisto, 'executeCommand', side_effect=execute_command)
+    mocker.patch.object(demisto, 'getFilePath', side_effect=get_file_path)
+    mocker.patch.object(demisto, 'results')
+    main()
+
+    results = [call[0][0] for call in demisto.results.call_args_list]
+    assert len([result for result in results if result['Type'] == entryTypes['file']]) == 2
+    emails = results[-1]['EntryContext']['Email']
+    assert len(emails) == 2
+    assert emails[0]['Attachments'] == '1.htm'
+    assert '1 duplicate emails' in results[-1]['HumanReadable']
+
+
+def test_batch_mode_entry_failure(mocker):
+    """
+    Given: Two file entries, one of them is not an email.
+    When: Parsing them in batch mode.
+    Then: The email is parsed and the failure of the other entry is reported in the human readable.
+    """
+    entries = {
+        '1@1': 'eml_contains_htm_attachment.eml',
+        '2@1': 'no_content.eml',
+    }
+    execute_command, get_file_path = exec_command_for_entries(entries)
+    mocker.patch.object(demisto, 'args', return_value={'entryid': ['1@1', '2@1'], 'max_workers': '2'})
+    mocker.patch.object(demisto, 'executeCommand', side_effect=execute_command)
+    mocker.patch.object(demisto, 'getFilePath', side_effect=get_file_path)
+    mocker.patch.object(demisto, 'results')
+    main()
+
+    result = demisto.results.call_args[0][0]
+    assert len(result['EntryContext']['Email']) == 1
+    assert '| 2@1 | no_content.eml |  |  |  | Could not parse eml file! |' in result['HumanReadable']